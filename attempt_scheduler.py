@@ -0,0 +1,66 @@
+# Learns which recognition attempts win on this device and tries those first
+import json
+import os
+import socket
+import tempfile
+import threading
+
+ATTEMPT_STATS_FILE = os.getenv('ATTEMPT_STATS_FILE', '.attempt_stats.json')
+
+def attempt_key(speed, config, language):
+    energy, pause = config
+    return f"{speed}|{language}|{energy}/{pause}"
+
+class AttemptScheduler:
+    """
+    Persistent per-device record of how often each (speed, language, config)
+    attempt produced the accepted transcript.
+
+    Attempts are ranked by their smoothed win rate (wins + 1) / (tries + 2),
+    so untried combinations start at an even chance and the original order
+    breaks ties.
+    """
+    def __init__(self, path=None, device=None):
+        self.path = path or ATTEMPT_STATS_FILE
+        self.device = device or os.getenv('DEVICE_ID') or socket.gethostname()
+        self._lock = threading.Lock()
+        self._all = self._load()
+        self.stats = self._all.setdefault(self.device, {})
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def score(self, speed, config, language):
+        entry = self.stats.get(attempt_key(speed, config, language), {})
+        return (entry.get('won', 0) + 1) / (entry.get('tried', 0) + 2)
+
+    def order(self, attempts):
+        """Sort plan_attempts() output, likeliest winner first"""
+        return sorted(attempts, key=lambda item: -self.score(item[0][0], item[0][2], item[0][3]))
+
+    def record(self, outcomes, accepted):
+        """
+        outcomes: {attempt: transcript or None} for every attempt that ran
+        accepted: the transcript that was returned (None if nothing was)
+        """
+        with self._lock:
+            for (speed, _, config, language), text in outcomes.items():
+                entry = self.stats.setdefault(attempt_key(speed, config, language), {'tried': 0, 'won': 0})
+                entry['tried'] += 1
+                if accepted is not None and text == accepted:
+                    entry['won'] += 1
+            self.save()
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='tmp', suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._all, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Could not save attempt statistics: {e}")
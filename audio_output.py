@@ -0,0 +1,223 @@
+# Device-ready speech output: trim silence, resample and encode replies compactly for the speakers
+import argparse
+import json
+import os
+import struct
+import tempfile
+from fractions import Fraction
+import wav_analyzer
+from lazy import lazy_import
+from metrics import METRICS
+
+np = lazy_import('numpy')
+scipy = lazy_import('scipy')  # find_spec('scipy.signal') would import scipy itself
+pydub = lazy_import('pydub')
+
+ENCODINGS = {
+    # encoding: (WAV format tag, bits per sample)
+    'pcm16': (wav_analyzer.WAVE_FORMAT_PCM, 16),
+    'ulaw': (wav_analyzer.WAVE_FORMAT_MULAW, 8)
+}
+
+class OutputProfile:
+    """
+    What the speakers play: sample rate, channel count and encoding
+    ('pcm16' or 'ulaw'). Leading and trailing sound more than trim_db
+    below the loudest 10 ms is cut, keeping pad_ms either side.
+    """
+    def __init__(self, name, rate, channels=1, encoding='pcm16', trim_db=45, pad_ms=100):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}, expected one of {sorted(ENCODINGS)}")
+        self.name = name
+        self.rate = rate
+        self.channels = channels
+        self.encoding = encoding
+        self.trim_db = trim_db
+        self.pad_ms = pad_ms
+
+    def __repr__(self):
+        return f"OutputProfile({self.name!r}, {self.rate}, {self.channels}, {self.encoding!r})"
+
+PROFILES = {
+    'pcm16_16k': OutputProfile('pcm16_16k', 16000),
+    'pcm16_8k': OutputProfile('pcm16_8k', 8000),
+    'ulaw_8k': OutputProfile('ulaw_8k', 8000, encoding='ulaw'),
+    'ulaw_16k': OutputProfile('ulaw_16k', 16000, encoding='ulaw')
+}
+# 'original' leaves the TTS engine's output untouched
+DEFAULT_PROFILE = os.getenv('AUDIO_OUTPUT_PROFILE', 'pcm16_16k')
+
+def get_profile(name=None):
+    """OutputProfile by name (default: AUDIO_OUTPUT_PROFILE), None for 'original'"""
+    name = name or DEFAULT_PROFILE
+    if name == 'original':
+        return None
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown output profile {name!r}, expected 'original' or one of {sorted(PROFILES)}")
+
+def load(path):
+    """
+    Decode a speech file to float32 samples shaped (frames, channels) and
+    its sample rate. WAV is read directly; anything else (gTTS MP3,
+    AIFF from some pyttsx3 drivers) is decoded by pydub (and ffmpeg).
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic in (b'RIFF', b'RF64'):
+        samples, header = wav_analyzer.read_samples(path)
+        return samples, header['sample_rate']
+    try:
+        segment = pydub.AudioSegment.from_file(path)
+    except pydub.exceptions.CouldntDecodeError as e:
+        raise ValueError(f"Could not decode {path}: {e}")
+    samples = np.array(segment.get_array_of_samples()).reshape(-1, segment.channels)
+    # pydub hands back signed samples at every width (8-bit WAV data included)
+    return (samples / float(1 << (8 * segment.sample_width - 1))).astype(np.float32), segment.frame_rate
+
+def trim_silence(samples, rate, trim_db=45, pad_ms=100, frame_ms=10):
+    """
+    Cut leading and trailing frames more than trim_db below the loudest one,
+    keeping pad_ms. All-silent input comes back empty.
+    """
+    frame = max(1, rate * frame_ms // 1000)
+    n_frames = len(samples) // frame
+    if not n_frames:
+        return samples
+    mix = samples[:n_frames * frame].mean(axis=1).reshape(n_frames, frame)
+    power = np.mean(np.square(mix), axis=1)
+    if power.max() <= 0:
+        return samples[:0]
+    loud = np.flatnonzero(power >= power.max() * 10 ** (-trim_db / 10))
+    pad = rate * pad_ms // 1000
+    return samples[max(0, loud[0] * frame - pad):min(len(samples), (loud[-1] + 1) * frame + pad)]
+
+def convert_channels(samples, channels):
+    if samples.shape[1] == channels:
+        return samples
+    mono = samples.mean(axis=1, keepdims=True)
+    return np.repeat(mono, channels, axis=1)
+
+def resample(samples, rate, target):
+    """Polyphase resampling (which low-passes first) to the target rate"""
+    if rate == target or not len(samples):
+        return samples
+    ratio = Fraction(target, rate).limit_denominator(1000)
+    return scipy.signal.resample_poly(samples, ratio.numerator, ratio.denominator, axis=0).astype(np.float32)
+
+def to_pcm16(samples):
+    return np.int16(np.clip(np.round(samples * 32768), -32768, 32767))
+
+def ulaw_encode(pcm):
+    """
+    16-bit linear samples to G.711 mu-law bytes (inverse of
+    wav_analyzer.ulaw_decode), bit-identical to audioop.lin2ulaw: the
+    sample is floored to 14 bits before its sign is taken, which moves
+    the segment boundaries of negative values by one step.
+    """
+    x = pcm.astype(np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(x), 8159) + 33
+    segment = np.maximum(np.frexp(magnitude)[1] - 6, 0)  # position of the highest set bit above bit 5
+    code = np.where(segment >= 8, 0x7F, (np.minimum(segment, 7) << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    return (code ^ mask).astype(np.uint8)
+
+def wav_header(tag, bits, rate, channels, data_size):
+    """
+    RIFF header for data_size bytes of audio in format tag. Non-PCM formats
+    such as mu-law get the extended fmt chunk and the fact chunk the spec requires.
+    """
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', tag, channels, rate, rate * block_align, block_align, bits)
+    chunks = b''
+    if tag != wav_analyzer.WAVE_FORMAT_PCM:
+        fmt += struct.pack('<H', 0)
+        chunks = b'fact' + struct.pack('<II', 4, data_size // block_align)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt + chunks
+    riff_size = 4 + len(chunks) + 8 + data_size + (data_size & 1)
+    return b'RIFF' + struct.pack('<I', riff_size) + b'WAVE' + chunks + b'data' + struct.pack('<I', data_size)
+
+def encode(samples, profile):
+    """Complete WAV file bytes of samples already at the profile's rate and channel count"""
+    pcm = to_pcm16(samples)
+    data = ulaw_encode(pcm).tobytes() if profile.encoding == 'ulaw' else pcm.astype('<i2').tobytes()
+    tag, bits = ENCODINGS[profile.encoding]
+    return wav_header(tag, bits, profile.rate, profile.channels, len(data)) + data + b'\0' * (len(data) & 1)
+
+def convert(input_path, output_path=None, profile=None):
+    """
+    Write input_path as a device-ready WAV to output_path (default:
+    replace input_path). Returns the size report. Raises ValueError, and
+    writes nothing, if input_path holds no sound: a header-only WAV is a
+    failed render, not a reply to cache.
+    """
+    profile = profile or get_profile()
+    output_path = output_path or input_path
+    input_bytes = os.path.getsize(input_path)
+    samples, rate = load(input_path)
+    source_seconds = len(samples) / rate if rate else 0.0
+    samples = trim_silence(samples, rate, profile.trim_db, profile.pad_ms)
+    if not len(samples):
+        raise ValueError(f"{input_path} contains no sound")
+    samples = resample(convert_channels(samples, profile.channels), rate, profile.rate)
+    data = encode(samples, profile)
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.audio_output_', suffix='.wav')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, output_path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+    METRICS.inc('output_bytes_total', input_bytes, stage='source')
+    METRICS.inc('output_bytes_total', len(data), stage='device')
+    return {
+        'path': output_path,
+        'profile': profile.name,
+        'input_bytes': input_bytes,
+        'output_bytes': len(data),
+        'saved_bytes': input_bytes - len(data),
+        'saved_ratio': round(1 - len(data) / input_bytes, 4) if input_bytes else 0.0,
+        'source_seconds': round(source_seconds, 3),
+        'trimmed_seconds': round(max(0.0, source_seconds - len(samples) / profile.rate), 3)
+    }
+
+def format_saving(report):
+    change = (f"{report['saved_ratio']:.0%} saved" if report['saved_ratio'] >= 0
+              else f"{-report['saved_ratio']:.0%} larger")
+    return (f"{report['path']}: {report['input_bytes']} -> {report['output_bytes']} bytes "
+            f"({change}, {report['trimmed_seconds']:.2f}s of silence trimmed, {report['profile']})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert speech files to compact device-ready WAV")
+    parser.add_argument('paths', nargs='+', help="WAV/MP3 files to convert")
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=sorted(PROFILES))
+    parser.add_argument('--out-dir', default='device_audio', help="where converted files are written")
+    parser.add_argument('--in-place', action='store_true', help="replace the input files instead")
+    parser.add_argument('--json', action='store_true', help="print one JSON report per file")
+    args = parser.parse_args()
+
+    profile = get_profile(args.profile)
+    totals = [0, 0]
+    for path in args.paths:
+        output = None
+        if not args.in_place:
+            os.makedirs(args.out_dir, exist_ok=True)
+            output = os.path.join(args.out_dir, os.path.splitext(os.path.basename(path))[0] + '.wav')
+        try:
+            report = convert(path, output, profile)
+        except (OSError, ValueError, struct.error, wav_analyzer.WavFormatError, ImportError) as e:
+            print(json.dumps({'path': path, 'error': str(e)}) if args.json else f"{path}: {e}")
+            continue
+        totals[0] += report['input_bytes']
+        totals[1] += report['output_bytes']
+        print(json.dumps(report) if args.json else format_saving(report))
+    if not args.json and totals[0]:
+        print(f"Total: {totals[0]} -> {totals[1]} bytes ({1 - totals[1] / totals[0]:.0%} saved)")
+
+if __name__ == "__main__":
+    main()
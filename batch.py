@@ -0,0 +1,192 @@
+# Resumable batch mode: STT -> LLM -> TTS over many WAVs on a process pool, logged to a JSONL manifest
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import speech_recognition as sr
+
+DEFAULT_MANIFEST = 'batch_manifest.jsonl'
+# Outcomes that are final; errors are retried on the next run
+COMPLETED = ('ok', 'no_speech')
+
+_robot = None
+
+def _init_worker(quiet):
+    global _robot
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    from main import RobotVoiceSystem
+    _robot = RobotVoiceSystem()
+
+def process_file(input_wav, output_wav):
+    """Run one WAV through the robot pipeline and return its manifest entry"""
+    entry = {'input': input_wav, 'output': None, 'status': 'error', 'timings': {}}
+    started = time.perf_counter()
+    try:
+        # Not process_audio: it reports service errors as "no text", which would be final here.
+        # transcribe() raises sr.RequestError when the service (or every segment) failed
+        with sr.AudioFile(input_wav) as source:
+            audio = _robot.recognizer.record(source)
+        text = _robot.transcribe(audio)
+        entry['timings']['stt'] = round(time.perf_counter() - started, 3)
+        entry['transcript'] = text
+        if not text:
+            entry['status'] = 'no_speech'
+            return entry
+
+        step = time.perf_counter()
+        # Files are unrelated requests; an LLM failure must be retried, not answered with the fallback
+        reply, _ = _robot.answer(text, session_id=None, strict=True)
+        entry['timings']['llm'] = round(time.perf_counter() - step, 3)
+        entry['reply'] = reply
+
+        step = time.perf_counter()
+        if not _robot.create_audio_response(reply, output_wav):
+            raise RuntimeError("Failed to create response")
+        entry['timings']['tts'] = round(time.perf_counter() - step, 3)
+        entry['output'] = output_wav
+        entry['status'] = 'ok'
+    except Exception as e:
+        entry['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        entry['timings']['total'] = round(time.perf_counter() - started, 3)
+    return entry
+
+def find_inputs(patterns, recursive=False):
+    """Expand files, directories and glob patterns into a sorted list of absolute WAV paths"""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*.wav') if recursive else os.path.join(pattern, '*.wav')
+        for path in glob.glob(pattern, recursive=recursive):
+            if os.path.isfile(path):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+def load_completed(manifest):
+    """
+    Map input path -> signature for every finished entry in the manifest.
+    Lines that don't parse (e.g. cut short by a crash) are ignored.
+    """
+    completed = {}
+    try:
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get('status') in COMPLETED:
+                    completed[entry['input']] = entry.get('signature')
+                else:
+                    completed.pop(entry.get('input'), None)
+    except FileNotFoundError:
+        pass
+    return completed
+
+def output_paths(inputs, out_dir):
+    """<stem>_reply.wav per input, disambiguated by a path hash when stems collide"""
+    stems = {}
+    for path in inputs:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        stems.setdefault(stem, []).append(path)
+    outputs = {}
+    for stem, paths in stems.items():
+        for path in paths:
+            suffix = '' if len(paths) == 1 else '_' + hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]
+            outputs[path] = os.path.join(out_dir, f"{stem}{suffix}_reply.wav")
+    return outputs
+
+def run_batch(inputs, out_dir, manifest=DEFAULT_MANIFEST, workers=None, quiet=True):
+    """
+    Process inputs, appending one JSON line per file to manifest, and skip
+    files already completed there with the same size and mtime. workers=0
+    runs everything in this process. Returns a {status: count} summary.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    completed = load_completed(manifest)
+    outputs = output_paths(inputs, out_dir)
+    todo = []
+    for path in inputs:
+        signature = file_signature(path)
+        if path not in completed or completed[path] != signature:
+            todo.append((path, signature))
+    summary = {'skipped': len(inputs) - len(todo)}
+    print(f"{len(inputs)} files, {summary['skipped']} already done, {len(todo)} to process.")
+    if not todo:
+        return summary
+
+    with open(manifest, 'a', encoding='utf-8') as log:
+        def record(entry, signature, done):
+            entry['signature'] = signature
+            entry['finished_at'] = time.time()
+            log.write(json.dumps(entry) + '\n')
+            log.flush()
+            summary[entry['status']] = summary.get(entry['status'], 0) + 1
+            print(f"[{done}/{len(todo)}] {entry['status']:<9} {entry['input']} ({entry['timings'].get('total', 0):.2f}s)")
+
+        if workers == 0:
+            _init_worker(False)
+            for done, (path, signature) in enumerate(todo, 1):
+                record(process_file(path, outputs[path]), signature, done)
+            return summary
+
+        workers = workers or os.cpu_count() or 1
+        jobs = iter(todo)
+        pending = {}
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(quiet,)) as executor:
+            def refill():
+                # Bounded submission keeps memory flat on very large backlogs
+                while len(pending) < workers * 4:
+                    job = next(jobs, None)
+                    if job is None:
+                        return
+                    path, signature = job
+                    pending[executor.submit(process_file, path, outputs[path])] = (path, signature)
+
+            refill()
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, signature = pending.pop(future)
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        entry = {'input': path, 'output': None, 'status': 'error', 'timings': {},
+                                 'error': f"{type(e).__name__}: {e}"}
+                    done += 1
+                    record(entry, signature, done)
+                refill()
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the robot voice pipeline over many WAV files")
+    parser.add_argument('inputs', nargs='+', help="WAV files, directories or glob patterns")
+    parser.add_argument('--out-dir', default='replies', help="where reply WAVs are written")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help="JSONL log of finished files")
+    parser.add_argument('--workers', type=int, help="worker processes (default: CPU count, 0: in-process)")
+    parser.add_argument('--recursive', action='store_true', help="descend into subdirectories")
+    parser.add_argument('--verbose', action='store_true', help="show the workers' own output")
+    args = parser.parse_args()
+
+    inputs = find_inputs(args.inputs, args.recursive)
+    if not inputs:
+        print("No WAV files found.")
+        return
+    started = time.perf_counter()
+    summary = run_batch(inputs, args.out_dir, args.manifest, args.workers, quiet=not args.verbose)
+    print(f"Finished in {time.perf_counter() - started:.1f}s: {summary}")
+
+if __name__ == "__main__":
+    main()
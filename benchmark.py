@@ -0,0 +1,859 @@
+# Offline benchmark suite: runs the pipelines against local fake services
+import argparse
+import importlib.util
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import fake_services
+import tts_cache
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(filename, module_name):
+    """Import one of the repo's scripts whose file name isn't a valid module name"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def synth_utterance(seconds, rate=16000, seed=0):
+    """Speech-like test signal: syllable-rate modulated harmonics separated by pauses, over noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = 120 + 60 * rng.random()
+    voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    words = (np.sin(2 * np.pi * 0.7 * t + rng.random() * 6) > -0.3).astype(np.float32)
+    signal = voice * syllables * words * 0.3 + rng.normal(0, 0.01, len(t))
+    return np.int16(np.clip(signal, -1, 1) * 32767)
+
+def make_corpus(directory, count, seconds, rate=16000):
+    """Write count generated WAVs into directory and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"utterance_{i:04d}.wav")
+        with wave.open(path, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(rate)
+            wav.writeframes(synth_utterance(seconds, rate, seed=i).tobytes())
+        paths.append(path)
+    return paths
+
+def percentile(values, q):
+    """Nearest-rank percentile of values (q in 0-100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(np.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+def summarize(latencies, errors, wall):
+    return {
+        'count': len(latencies) + errors,
+        'errors': errors,
+        'throughput': (len(latencies) + errors) / wall if wall else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'mean_ms': _ms(sum(latencies) / len(latencies)) if latencies else None
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def run_timed(func, items, concurrency=1):
+    """Call func on every item, returning the per-item latency summary"""
+    latencies = []
+    errors = 0
+
+    def timed(item):
+        started = time.perf_counter()
+        ok = func(item)
+        return ok, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, item) for item in items]
+        for future in futures:
+            try:
+                ok, elapsed = future.result()
+            except Exception as e:
+                print(f"  error: {e}")
+                errors += 1
+                continue
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+# Each scenario returns (func(item) -> truthy on success, items, max concurrency)
+
+def scenario_robot(ctx):
+    from main import RobotVoiceSystem
+    robot = RobotVoiceSystem()
+    if not ctx.warm_caches:
+        robot.chat.cache = None
+
+    def run(path):
+        text = robot.process_audio(path)
+        if not text:
+            return False
+        reply = robot.get_ai_response(text, session_id=None)
+        return robot.create_audio_response(reply, os.path.join(ctx.workdir, 'robot_out.wav'))
+    # pyttsx3 engines are single-threaded
+    return run, ctx.corpus, 1
+
+def scenario_transcriber(ctx):
+    module = load_script('wav to txt.py', 'wav_to_txt')
+
+    def run(path):
+        return module.ShortPhraseTranscriber(path).transcribe() is not None
+    return run, ctx.corpus, ctx.concurrency
+
+def scenario_transcriber_adaptive(ctx):
+    module = load_script('wav to txt.py', 'wav_to_txt')
+    import attempt_scheduler
+    # Learns from scratch over the corpus, one device-local stats file per run
+    scheduler = attempt_scheduler.AttemptScheduler(os.path.join(ctx.workdir, 'attempt_stats.json'), 'benchmark')
+
+    def run(path):
+        transcriber = module.ShortPhraseTranscriber(path, scheduler=scheduler, confidence_threshold=0.85)
+        return transcriber.transcribe() is not None
+    return run, ctx.corpus, ctx.concurrency
+
+def scenario_tts(ctx):
+    module = load_script('txt to wav.py', 'txt_to_wav')
+    module.playsound.playsound = lambda *args, **kwargs: None  # Never play audio while benchmarking
+    converter = module.AdvancedTTSConverter()
+    texts = [(i, f"Reminder {i}: the meeting on March {i % 28 + 1}, 2024 starts at {i % 12 + 1}:30.")
+             for i in range(len(ctx.corpus))]
+
+    def run(item):
+        i, text = item
+        output = os.path.join(ctx.workdir, f"tts_{i}.wav")
+        converter.text_to_speech(text, output)
+        return os.path.exists(output)
+    return run, texts, ctx.concurrency
+
+def scenario_voicerss(ctx):
+    import voicerss_tts
+    texts = [f"Sensor {i} reports {i * 3} degrees." for i in range(len(ctx.corpus))]
+
+    def run(text):
+        result = voicerss_tts.speech({'key': 'benchmark', 'src': text, 'hl': 'en-us',
+                                      'cache': ctx.warm_caches})
+        return result['error'] is None
+    return run, texts, ctx.concurrency
+
+SCENARIOS = {
+    'robot': scenario_robot,
+    'transcriber': scenario_transcriber,
+    'transcriber_adaptive': scenario_transcriber_adaptive,
+    'tts': scenario_tts,
+    'voicerss': scenario_voicerss
+}
+
+def parse_service_values(values, option):
+    """Parse ['stt=0.2', 'llm=0.5'] (or a bare number for every service)"""
+    parsed = {}
+    for value in values or []:
+        name, sep, number = value.partition('=')
+        if not sep:
+            parsed.update({service: float(name) for service in fake_services.SERVICE_HOSTS.values()})
+        elif name not in fake_services.SERVICE_HOSTS.values():
+            raise SystemExit(f"{option}: unknown service {name!r}")
+        else:
+            parsed[name] = float(number)
+    return parsed
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results):
+    columns = ['count', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms']
+    print(f"\n{'scenario':<22}" + ''.join(f"{c:>12}" for c in columns))
+    for name, result in results.items():
+        if 'skipped' in result:
+            print(f"{name:<22}  skipped: {result['skipped']}")
+            continue
+        cells = []
+        for column in columns:
+            value = result[column]
+            cells.append(f"{'-':>12}" if value is None else f"{value:>12.2f}" if isinstance(value, float) else f"{value:>12}")
+        print(f"{name:<22}" + ''.join(cells))
+
+def print_comparison(results, baseline):
+    """Show relative change against a previous --json run"""
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'}:")
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before or 'skipped' in result or 'skipped' in before:
+            continue
+        deltas = []
+        for column in ['throughput', 'p50_ms', 'p95_ms', 'p99_ms']:
+            if result.get(column) and before.get(column):
+                change = (result[column] - before[column]) / before[column] * 100
+                deltas.append(f"{column} {change:+.1f}%")
+        print(f"  {name:<22}" + ', '.join(deltas))
+
+def bench_pipeline(args):
+    workdir = tempfile.mkdtemp(prefix='voice_bench_')
+    try:
+        ctx = argparse.Namespace(
+            workdir=workdir,
+            corpus=make_corpus(os.path.join(workdir, 'corpus'), args.files, args.seconds),
+            concurrency=args.concurrency,
+            warm_caches=args.warm_caches
+        )
+        if not args.warm_caches:
+            # Start from an empty synthesis cache so every run measures real work
+            tts_cache._default_cache = tts_cache.SynthesisCache(os.path.join(workdir, 'tts_cache'))
+
+        latency = parse_service_values(args.latency, '--latency')
+        jitter = parse_service_values(args.jitter, '--jitter')
+        error_rate = parse_service_values(args.error_rate, '--error-rate')
+        profiles = {
+            name: fake_services.ServiceProfile(latency.get(name, 0.05), jitter.get(name, 0.01),
+                                               error_rate.get(name, 0.0))
+            for name in fake_services.SERVICE_HOSTS.values()
+        }
+        reply = "Reply {n}. Why did the robot go on holiday?" if not args.warm_caches else \
+            "Why did the robot go on holiday? To recharge."
+
+        results = {}
+        with fake_services.FakeServices(profiles, reply=reply) as services, \
+                fake_services.redirect(services.base_url):
+            for name in args.scenarios:
+                print(f"Running {name}...")
+                try:
+                    func, items, concurrency = SCENARIOS[name](ctx)
+                except Exception as e:
+                    results[name] = {'skipped': f"{type(e).__name__}: {e}"}
+                    continue
+                before = dict(services.requests)
+                results[name] = run_timed(func, items, concurrency)
+                results[name]['remote_requests'] = {service: count - before[service]
+                                                    for service, count in services.requests.items()
+                                                    if count > before[service]}
+            remote = {'requests': dict(services.requests), 'injected_errors': dict(services.errors)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('func', 'compare', 'json')},
+        'remote': remote,
+        'results': results
+    }
+    print_table(results)
+    print("\nRemote requests per scenario:")
+    for name, result in results.items():
+        if 'remote_requests' in result:
+            print(f"  {name:<22}{result['remote_requests']}")
+    finish(report, args)
+
+def finish(report, args):
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(report['results'], json.load(f))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+def best_of(func, repeat):
+    """Fastest wall time of repeat calls to func"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def peak_allocated(func):
+    """Peak bytes allocated (as seen by tracemalloc) while func runs"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def legacy_normalize(text, engine):
+    """The TTS front-end before text_normalizer: a regex callback per number, then a second pass"""
+    def replace_number(match):
+        number = match.group(0)
+        try:
+            if '.' in number:
+                return engine.number_to_words(float(number))
+            elif len(number) == 4 and number.startswith(('19', '20')):
+                return number[:2] + ' ' + engine.number_to_words(int(number[2:]))
+            else:
+                return engine.number_to_words(int(number))
+        except Exception:
+            return number
+    text = re.sub(r'\b\d+\.?\d*\b', replace_number, text)
+    return text.replace(",", "...")
+
+def sample_text(size_bytes, seed=0):
+    """Generated prose with the numbers, years, prices and ordinals the normalizer handles"""
+    rng = np.random.default_rng(seed)
+    templates = [
+        "On March {d}, {y} the {o} shipment of {n} units cost ${p}.{c}, roughly {f} per cent more.\n",
+        "Sensor {n} reported {f} degrees at {d}:{m}, the {o} reading since {y}.\n",
+        "We sold {n} tickets, {g} visitors came, and the record from {y} still stands.\n"
+    ]
+    lines = []
+    size = 0
+    while size < size_bytes:
+        line = templates[int(rng.integers(len(templates)))].format(
+            d=int(rng.integers(1, 29)), y=int(rng.integers(1900, 2030)), o=f"{int(rng.integers(1, 40))}th",
+            n=int(rng.integers(1, 5000)), p=int(rng.integers(1, 500)), c=f"{int(rng.integers(0, 100)):02d}",
+            f=f"{rng.random() * 100:.1f}", m=f"{int(rng.integers(0, 60)):02d}", g=f"{int(rng.integers(1, 999))},{int(rng.integers(0, 1000)):03d}")
+        lines.append(line)
+        size += len(line.encode('utf-8'))
+    return ''.join(lines)
+
+def bench_normalize(args):
+    import inflect
+    import text_normalizer
+    text = sample_text(int(args.mb * 1024 * 1024))
+    size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+    lines = text.splitlines(keepends=True)
+    engine = inflect.engine()
+    normalizer = text_normalizer.TextNormalizer()
+
+    text_normalizer.number_words.cache_clear()
+    timings = {
+        'legacy': best_of(lambda: legacy_normalize(text, engine), args.repeat),
+        'single_pass': best_of(lambda: normalizer.normalize(text), args.repeat),
+        'streaming': best_of(lambda: sum(1 for _ in normalizer.normalize_lines(lines)), args.repeat)
+    }
+    results = {name: {'seconds': round(seconds, 4), 'mb_per_s': round(size_mb / seconds, 3)}
+               for name, seconds in timings.items()}
+    print(f"\nNormalizing {size_mb:.2f} MB (best of {args.repeat}):")
+    for name, result in results.items():
+        print(f"  {name:<12} {result['mb_per_s']:>8.2f} MB/s  ({result['seconds']:.3f}s)")
+    print(f"  speed-up     {timings['legacy'] / timings['single_pass']:>8.2f}x")
+    print(f"  number cache {text_normalizer.number_words.cache_info()}")
+    finish({'revision': git_revision(), 'results': results}, args)
+
+def legacy_speech_dsp(data, rate, speeds):
+    """optimize_for_speech's numpy stage before dsp.py: float64 copies at every step"""
+    import noisereduce as nr
+    from scipy.signal import butter, filtfilt
+    clean_data = nr.reduce_noise(y=data, sr=rate, prop_decrease=0.99, n_std_thresh_stationary=1.1)
+    nyquist = rate / 2
+    b, a = butter(4, [250 / nyquist, 3500 / nyquist], btype='band')
+    filtered = filtfilt(b, a, clean_data)
+    variants = []
+    for speed in speeds:
+        if speed == 0.5:
+            output_data = filtered
+        else:
+            new_len = int(len(filtered) / speed)
+            output_data = np.interp(np.linspace(0, len(filtered) - 1, new_len), np.arange(len(filtered)), filtered)
+        peak = np.max(np.abs(output_data))
+        if peak > 0:
+            output_data = output_data / peak
+        variants.append(np.int16(output_data * 32767).tobytes())
+    return variants
+
+def optimized_speech_dsp(engine, data, speeds):
+    cleaned = engine.process(data)
+    stretches = [1.0 if speed == 0.5 else 1 / speed for speed in speeds]
+    return [pcm.tobytes() for _, pcm in engine.speed_variants(cleaned, stretches)]
+
+def bench_dsp(args):
+    import dsp
+    rate = 16000
+    speeds = [1.0, 0.8, 0.5]
+    samples = synth_utterance(args.minutes * 60, rate)
+    data = samples.astype(np.float32)
+    input_mb = samples.nbytes / (1024 * 1024)
+
+    candidates = {
+        'legacy': lambda: legacy_speech_dsp(data, rate, speeds),
+        # A fresh engine each run, so its buffers count towards the peak
+        'dsp': lambda: optimized_speech_dsp(dsp.SpeechDSP(rate), samples, speeds)
+    }
+    results = {}
+    for name, func in candidates.items():
+        print(f"Running {name}...")
+        seconds = best_of(func, args.repeat)
+        # The variants' PCM bytes are the output, not working memory
+        output = sum(len(variant) for variant in func())
+        peak = peak_allocated(func)
+        results[name] = {
+            'seconds': round(seconds, 3),
+            'realtime_factor': round(args.minutes * 60 / seconds, 1),
+            'peak_mb': round(peak / (1024 * 1024), 1),
+            'working_mb': round((peak - output) / (1024 * 1024), 1)
+        }
+
+    print(f"\n{args.minutes:g} min of 16 kHz audio ({input_mb:.1f} MB as int16), best of {args.repeat}:")
+    print(f"  {'':<8}{'seconds':>10}{'x realtime':>12}{'peak MB':>10}{'working MB':>12}")
+    for name, result in results.items():
+        print(f"  {name:<8}{result['seconds']:>10.2f}{result['realtime_factor']:>12.1f}"
+              f"{result['peak_mb']:>10.1f}{result['working_mb']:>12.1f}")
+    finish({'revision': git_revision(), 'config': {'minutes': args.minutes}, 'results': results}, args)
+
+# Cold-start probes, each run in a fresh interpreter: the import, then whatever makes it ready to serve
+STARTUP_TARGETS = {
+    'main': ("import main", "main.RobotVoiceSystem()"),
+    'raw2': ("import raw2", "raw2.RobotVoiceSystem()"),
+    'wav_to_txt': ("import importlib.util\n"
+                   "spec = importlib.util.spec_from_file_location('wav_to_txt', 'wav to txt.py')\n"
+                   "module = importlib.util.module_from_spec(spec)\n"
+                   "spec.loader.exec_module(module)",
+                   "module.ShortPhraseTranscriber('input.wav')"),
+    'voice_service': ("import voice_service", "voice_service.VoiceService()")
+}
+
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{import_code}
+imported = time.perf_counter()
+{ready_code}
+ready = time.perf_counter()
+print(json.dumps({{'import_s': imported - started, 'ready_s': ready - started}}))
+"""
+
+# Imported by the interpreter or the probe itself, not by the code under test
+PROBE_IMPORTS = {'site', 'encodings', 'json', 'time', 'importlib.util'}
+
+def probe_startup(import_code, ready_code, importtime=False):
+    """Run one cold start; returns (timings, stderr)"""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+        ['-c', STARTUP_PROBE.format(import_code=import_code, ready_code=ready_code)]
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+def heaviest_imports(stderr, target, count):
+    """
+    The costliest modules pulled in at startup, from -X importtime output:
+    the target module's direct imports, or the top-level imports for scripts
+    loaded by path.
+    """
+    modules = []
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entry = (int(cumulative) / 1000, name.strip())
+        if depth == 1:
+            children.append(entry)  # importtime lists children before their parent
+        elif depth == 0:
+            if entry[1] == target:
+                modules.extend(children)
+            elif entry[1] not in PROBE_IMPORTS:
+                modules.append(entry)
+            children = []
+    return [f"{name} {ms:.0f}ms" for ms, name in sorted(modules, reverse=True)[:count]]
+
+def bench_startup(args):
+    results = {}
+    for name in args.targets:
+        import_code, ready_code = STARTUP_TARGETS[name]
+        print(f"Running {name}...")
+        try:
+            runs = [probe_startup(import_code, ready_code)[0] for _ in range(args.repeat)]
+            _, stderr = probe_startup(import_code, ready_code, importtime=True)
+        except RuntimeError as e:
+            results[name] = {'skipped': str(e)}
+            continue
+        results[name] = {
+            'import_ms': _ms(sorted(run['import_s'] for run in runs)[len(runs) // 2]),
+            'ready_ms': _ms(sorted(run['ready_s'] for run in runs)[len(runs) // 2]),
+            'heaviest': heaviest_imports(stderr, name, 3)
+        }
+
+    print(f"\nCold start, median of {args.repeat}:")
+    print(f"  {'target':<14}{'import ms':>10}{'ready ms':>10}  heaviest imports")
+    for name, result in results.items():
+        if 'skipped' in result:
+            print(f"  {name:<14}skipped: {result['skipped']}")
+            continue
+        print(f"  {name:<14}{result['import_ms']:>10.1f}{result['ready_ms']:>10.1f}  {', '.join(result['heaviest'])}")
+    finish({'revision': git_revision(), 'results': results}, args)
+
+def bench_conversation(args):
+    import conversation
+    from main import RobotVoiceSystem
+    rng = np.random.default_rng(0)
+    words = sample_text(64 * 1024).split()
+
+    def utterance(count):
+        start = int(rng.integers(len(words) - count))
+        return ' '.join(words[start:start + count])
+
+    turns = [(utterance(int(rng.integers(4, 20))), utterance(int(rng.integers(20, 50))))
+             for _ in range(args.turns)]
+    system = RobotVoiceSystem.SYSTEM_PROMPT
+    dialog = conversation.Conversation(system, budget=args.budget)
+    unbounded = conversation.estimate_tokens(system) + 2 * conversation.MESSAGE_OVERHEAD
+    checkpoints = sorted({1, 10, 50, args.turns} & set(range(1, args.turns + 1)))
+    results = {}
+    history_time = 0.0
+    for number, (user, assistant) in enumerate(turns, 1):
+        text = RobotVoiceSystem.PROMPT_TEMPLATE.format(text=user)
+        started = time.perf_counter()
+        messages = dialog.history(text)
+        history_time += time.perf_counter() - started
+        if number in checkpoints:
+            budgeted = sum(conversation.estimate_tokens(m['content']) + conversation.MESSAGE_OVERHEAD
+                           for m in messages) + conversation.estimate_tokens(system) \
+                       + conversation.estimate_tokens(text) + 2 * conversation.MESSAGE_OVERHEAD
+            results[f"turn_{number}"] = {
+                'unbounded_tokens': unbounded + conversation.estimate_tokens(text),
+                'budgeted_tokens': budgeted,
+                'kept_turns': len(dialog.turns),
+                'summary_lines': len(dialog.summary)
+            }
+        dialog.add_turn(user, assistant)
+        unbounded += conversation.estimate_tokens(user) + conversation.estimate_tokens(assistant) \
+                     + 2 * conversation.MESSAGE_OVERHEAD
+
+    print(f"\nPrompt size over {args.turns} turns (budget {args.budget} tokens, estimated):")
+    print(f"  {'turn':<10}{'unbounded':>10}{'budgeted':>10}{'turns':>7}{'summary':>9}")
+    for name, result in results.items():
+        print(f"  {name:<10}{result['unbounded_tokens']:>10}{result['budgeted_tokens']:>10}"
+              f"{result['kept_turns']:>7}{result['summary_lines']:>9}")
+    print(f"  history() {history_time / args.turns * 1e6:.0f}us per turn")
+    finish({'revision': git_revision(), 'results': results}, args)
+
+# (name, ServiceProfile options, backend down for the whole run)
+RESILIENCE_SCENARIOS = [
+    ('tail', {'latency': 0.03, 'jitter': 0.01, 'tail_rate': 0.03, 'tail_latency': 1.0}, False),
+    ('flaky', {'latency': 0.03, 'jitter': 0.01, 'error_rate': 0.2}, False),
+    ('outage', {'latency': 0.03}, True)
+]
+
+def legacy_policies(robot):
+    """What the robot did before resilience.py: a plain STT retry loop and a single chat attempt"""
+    import resilience
+    import speech_recognition as sr
+    robot.stt_policy = resilience.Resilience('google_stt', retryable=lambda e: isinstance(e, sr.RequestError),
+                                             deadline=None, retries=2, backoff=0.5, hedge=False, breaker=None)
+    robot.llm_policy = resilience.Resilience('openrouter', deadline=None, retries=0, hedge=False, breaker=None)
+
+def bench_resilience(args):
+    import speech_recognition as sr
+    from main import RobotVoiceSystem
+    pcm = np.clip(synth_utterance(1.0), -32768, 32767).astype(np.int16).tobytes()
+    audio = sr.AudioData(pcm, 16000, 2)
+    results = {}
+    for scenario, options, down in RESILIENCE_SCENARIOS:
+        for mode in ('legacy', 'resilient'):
+            profile = fake_services.ServiceProfile(**options)
+            print(f"Running {scenario}/{mode}...")
+            with fake_services.FakeServices({'stt': profile, 'llm': profile}) as services, \
+                    fake_services.redirect(services.base_url):
+                robot = RobotVoiceSystem()
+                robot.chat.cache = None
+                if mode == 'legacy':
+                    legacy_policies(robot)
+                for service in ('stt', 'llm') if down else ():
+                    services.set_down(service)
+
+                def stt(_):
+                    try:
+                        return robot.transcribe(audio) == services.transcript
+                    except sr.RequestError:
+                        return False
+
+                def llm(_):
+                    # Not a device command, so the intent table can't answer it locally
+                    return robot.get_ai_response("tell me a joke", session_id=None) == services.reply
+
+                for service, func in (('stt', stt), ('llm', llm)):
+                    latencies, answered = [], 0
+                    for item in range(args.requests):
+                        started = time.perf_counter()
+                        answered += bool(func(item))
+                        latencies.append(time.perf_counter() - started)
+                    results[f"{scenario}/{mode}/{service}"] = {
+                        'p50_ms': _ms(percentile(latencies, 50)),
+                        'p95_ms': _ms(percentile(latencies, 95)),
+                        'p99_ms': _ms(percentile(latencies, 99)),
+                        'answered': round(answered / args.requests, 3),
+                        'backend_requests': services.requests[service]
+                    }
+                robot.stt_policy.shutdown()
+                robot.llm_policy.shutdown()
+
+    print(f"\n{args.requests} sequential requests per row:")
+    print(f"  {'scenario':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'answered':>10}{'backend':>9}")
+    for name, result in results.items():
+        print(f"  {name:<26}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+              f"{result['answered']:>10.0%}{result['backend_requests']:>9}")
+    finish({'revision': git_revision(), 'results': results}, args)
+
+# Transcripts as they arrive from STT: command phrasings the table covers, and open questions
+INTENT_SAMPLE = [
+    "turn on the light", "Turn the lights on please.", "switch off the light", "can you turn off the lights",
+    "what time is it", "What's the time?", "what day is it today", "turn on the fan", "stop the fan",
+    "thank you", "hello robot", "who is the prime minister of Nepal", "tell me a joke",
+    "how far away is the moon", "what is the weather like tomorrow", "turn on the television"
+]
+
+def bench_intents(args):
+    from main import RobotVoiceSystem
+    profile = fake_services.ServiceProfile(args.llm_latency, args.llm_latency / 10)
+    results = {}
+    for mode in ('llm_only', 'intents'):
+        print(f"Running {mode}...")
+        with fake_services.FakeServices({'llm': profile}) as services, \
+                fake_services.redirect(services.base_url):
+            robot = RobotVoiceSystem()
+            robot.chat.cache = None
+            if mode == 'llm_only':
+                robot.intents.match = lambda text: None
+            latencies = []
+            for round_number in range(args.rounds):
+                for text in INTENT_SAMPLE:
+                    started = time.perf_counter()
+                    robot.get_ai_response(text, session_id=None)
+                    latencies.append(time.perf_counter() - started)
+            results[mode] = summarize(latencies, 0, sum(latencies))
+            results[mode]['llm_requests'] = services.requests['llm']
+            if mode == 'intents':
+                results[mode]['intent_report'] = robot.intent_report()
+
+    report = results['intents']['intent_report']
+    print(f"\n{len(INTENT_SAMPLE) * args.rounds} transcripts, LLM latency {args.llm_latency * 1000:.0f}ms:")
+    print(f"  {'mode':<10}{'p50 ms':>9}{'mean ms':>9}{'LLM calls':>11}")
+    for name, result in results.items():
+        print(f"  {name:<10}{result['p50_ms']:>9.1f}{result['mean_ms']:>9.1f}{result['llm_requests']:>11}")
+    print(f"  intent hit rate {report['hit_rate']:.0%}, {report['mean_match_us']:.1f}us per match, "
+          f"{report['saved_seconds']:.2f}s of LLM time saved")
+    finish({'revision': git_revision(), 'results': results}, args)
+
+def replayed_clip(pcm, rng, rate=16000):
+    """pcm as a device would resend it: different gain, DC offset and leading/trailing silence"""
+    gain = rng.uniform(0.5, 1.5)
+    offset = rng.uniform(-1000, 1000)
+    lead, tail = (np.zeros(int(rng.uniform(0, 0.3) * rate)) for _ in range(2))
+    signal = np.concatenate([lead, pcm.astype(np.float64), tail]) * gain + offset
+    return np.int16(np.clip(signal, -32768, 32767))
+
+def near_identical_clip(pcm, rng, rate=16000, chunk=(0.10, 0.15)):
+    """pcm with one 100-150 ms stretch of sound swapped for another part of it, like a changed word"""
+    x = pcm.astype(np.float64)
+    x -= x.mean()
+    size = int(rng.uniform(*chunk) * rate)
+    power = np.mean(np.square(x))
+    starts = np.arange(0, len(x) - size, size // 4)
+    # Only stretches at least a quarter as loud as the clip on average count as words
+    loud = [start for start in starts if np.mean(np.square(x[start:start + size])) >= 0.25 * power]
+    for _ in range(100):
+        old, new = rng.choice(loud, 2)
+        if np.sum(np.square(x[new:new + size] - x[old:old + size])) >= 0.25 * np.sum(np.square(x[old:old + size])):
+            break
+    variant = x.copy()
+    variant[old:old + size] = x[new:new + size]
+    return np.int16(np.clip(variant + pcm.mean(), -32768, 32767))
+
+def read_wav_int16(path):
+    """Mono 16-bit samples and rate of an 8- or 16-bit PCM WAV"""
+    with wave.open(path, 'rb') as wav:
+        width, channels, rate = wav.getsampwidth(), wav.getnchannels(), wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.int16) - 128) << 8
+    else:
+        samples = np.frombuffer(data, dtype=np.int16)
+    return samples.reshape(-1, channels).mean(axis=1).astype(np.int16), rate
+
+def bench_near_identical(clips, variants, rng):
+    """
+    Fingerprint-only matches vs confirmed cache hits for clips that differ
+    in one short stretch. clips is a list of (samples, rate).
+    """
+    import utterance_cache
+    workdir = tempfile.mkdtemp(prefix='utterance_pairs_')
+    try:
+        cache = utterance_cache.UtteranceCache(workdir)
+        keys = [utterance_cache.fingerprint(pcm, rate) for pcm, rate in clips]
+        for i, key in enumerate(keys):
+            cache.put(key, f"clip {i}", f"reply {i}", b'RIFF')
+        similar = replayed = resent = 0
+        for i, (pcm, rate) in enumerate(clips):
+            for _ in range(variants):
+                key = utterance_cache.fingerprint(near_identical_clip(pcm, rng, rate), rate)
+                if key is None:
+                    continue
+                seconds = keys[i].seconds
+                similar += (float(keys[i].vector @ key.vector) >= cache.threshold
+                            and abs(seconds - key.seconds) <= cache.duration_tolerance * max(seconds, key.seconds))
+                replayed += cache.get(key) is not None
+                # The same recording resent must still be served
+                resent += cache.get(utterance_cache.fingerprint(replayed_clip(pcm, rng, rate), rate)) is not None
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    total = len(clips) * variants
+    return {'pairs': total, 'fingerprint_matches': similar, 'replayed': replayed, 'resent_hits': resent}
+
+def bench_utterances(args):
+    import utterance_cache
+    from main import RobotVoiceSystem
+    rng = np.random.default_rng(0)
+    # Endpointed recordings: speech with a little room noise either side
+    clips = [np.int16(np.concatenate([rng.normal(0, 30, 3200), synth_utterance(rng.uniform(1.0, 4.0), seed=i),
+                                      rng.normal(0, 30, 3200)]))
+             for i in range(args.clips)]
+    # Every clip arrives once as recorded, then replayed with level and padding changes, shuffled
+    requests = [(i, clip) for i, clip in enumerate(clips)]
+    requests += [(i, replayed_clip(clips[i], rng)) for i in rng.integers(0, args.clips, args.replays)]
+    order = list(range(args.clips)) + list(args.clips + rng.permutation(args.replays))
+    profile = fake_services.ServiceProfile(args.latency, args.latency / 10)
+    workdir = tempfile.mkdtemp(prefix='utterance_bench_')
+    results = {}
+    try:
+        paths = []
+        for n, (_, pcm) in enumerate(requests):
+            path = os.path.join(workdir, f"request_{n:04d}.wav")
+            with wave.open(path, 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(16000)
+                wav.writeframes(pcm.tobytes())
+            paths.append(path)
+        for mode in ('no_cache', 'utterance_cache'):
+            print(f"Running {mode}...")
+            # "{n}" makes every chat reply unique, so a wrong replay shows up as a mismatch
+            with fake_services.FakeServices({'stt': profile, 'llm': profile}, transcript="tell me a joke",
+                                            reply="Reply {n}") as services, \
+                    fake_services.redirect(services.base_url):
+                robot = RobotVoiceSystem()
+                robot.chat.cache = None
+                robot.utterances = utterance_cache.UtteranceCache(os.path.join(workdir, mode))
+                if mode == 'no_cache':
+                    robot.utterances.get = lambda key: None
+                output = os.path.join(workdir, 'out.wav')
+                latencies, errors, replies, wrong = [], 0, {}, 0
+                for n in order:
+                    clip = requests[n][0]
+                    started = time.perf_counter()
+                    answered = robot.respond(paths[n], output, session_id=None)
+                    latencies.append(time.perf_counter() - started)
+                    if answered is None:
+                        errors += 1
+                        continue
+                    # A replay must return one of the replies generated for the same clip
+                    if answered[1] in replies and replies[answered[1]] != clip:
+                        wrong += 1
+                    replies.setdefault(answered[1], clip)
+                result = summarize(latencies, errors, sum(latencies))
+                result.update(stt_requests=services.requests['stt'], llm_requests=services.requests['llm'],
+                              hits=robot.utterances.stats['hits'], wrong_replays=wrong)
+                results[mode] = result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{args.clips} clips, {args.replays} replays with new gain/offset/padding, "
+          f"remote latency {args.latency * 1000:.0f}ms:")
+    print(f"  {'mode':<17}{'p50 ms':>9}{'mean ms':>9}{'STT calls':>11}{'LLM calls':>11}{'hits':>6}")
+    for name, result in results.items():
+        print(f"  {name:<17}{result['p50_ms']:>9.1f}{result['mean_ms']:>9.1f}"
+              f"{result['stt_requests']:>11}{result['llm_requests']:>11}{result['hits']:>6}")
+    cached = results['utterance_cache']
+    print(f"  replay hit rate {cached['hits'] / args.replays:.0%}, {cached['wrong_replays']} wrong replies")
+
+    # Near-identical pairs: the generated clips plus the recordings shipped with the repo
+    pairs = [(clip, 16000) for clip in clips]
+    for name in ('AUDIO.wav', 'AUDIO (3).wav'):
+        try:
+            pcm, rate = read_wav_int16(os.path.join(ROOT, name))
+        except (OSError, EOFError, wave.Error):
+            continue
+        # These carry a large DC offset; centre and leave headroom so replayed_clip() doesn't clip them
+        pcm = pcm - pcm.mean()
+        pairs.append((np.int16(pcm * (16000 / np.abs(pcm).max())), rate))
+    near = bench_near_identical(pairs, args.variants, rng)
+    results['near_identical'] = near
+    print(f"\n{near['pairs']} near-identical pairs (one 100-150 ms stretch swapped):")
+    print(f"  fingerprint alone would match {near['fingerprint_matches']}, "
+          f"cache replayed {near['replayed']}; resent originals still hit {near['resent_hits']}/{near['pairs']}")
+    finish({'revision': git_revision(), 'results': results}, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the voice pipeline")
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--compare', help="compare against a previous --json file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = commands.add_parser('pipeline', help="end-to-end scenarios against fake remote services")
+    pipeline.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    pipeline.add_argument('--files', type=int, default=20, help="generated WAVs in the corpus")
+    pipeline.add_argument('--seconds', type=float, default=3.0, help="length of each generated WAV")
+    pipeline.add_argument('--concurrency', type=int, default=1)
+    pipeline.add_argument('--latency', nargs='*', help="SERVICE=SECONDS (stt, llm, gtts, voicerss), default 0.05")
+    pipeline.add_argument('--jitter', nargs='*', help="SERVICE=SECONDS, default 0.01")
+    pipeline.add_argument('--error-rate', nargs='*', help="SERVICE=FRACTION, default 0")
+    pipeline.add_argument('--warm-caches', action='store_true', help="leave the LLM/TTS caches enabled")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    normalize = commands.add_parser('normalize', help="TTS text normalizer throughput (MB/s)")
+    normalize.add_argument('--mb', type=float, default=2.0, help="size of the generated text")
+    normalize.add_argument('--repeat', type=int, default=3)
+    normalize.set_defaults(func=bench_normalize)
+
+    speech_dsp = commands.add_parser('dsp', help="time and peak memory of the speech clean-up stage")
+    speech_dsp.add_argument('--minutes', type=float, default=5.0, help="length of the generated recording")
+    speech_dsp.add_argument('--repeat', type=int, default=3)
+    speech_dsp.set_defaults(func=bench_dsp)
+
+    startup = commands.add_parser('startup', help="cold-start import time and time-to-ready")
+    startup.add_argument('--targets', nargs='+', choices=sorted(STARTUP_TARGETS), default=sorted(STARTUP_TARGETS))
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    dialog = commands.add_parser('conversation', help="prompt size of a long session under the token budget")
+    dialog.add_argument('--turns', type=int, default=500)
+    dialog.add_argument('--budget', type=int, default=1024)
+    dialog.set_defaults(func=bench_conversation)
+
+    resilient = commands.add_parser('resilience', help="tail latency, flaky and outage behaviour of remote calls")
+    resilient.add_argument('--requests', type=int, default=100, help="requests per scenario and service")
+    resilient.set_defaults(func=bench_resilience)
+
+    intent = commands.add_parser('intents', help="local intent fast path: hit rate and LLM calls avoided")
+    intent.add_argument('--rounds', type=int, default=5, help="passes over the sample transcripts")
+    intent.add_argument('--llm-latency', type=float, default=0.3, help="fake chat endpoint latency (seconds)")
+    intent.set_defaults(func=bench_intents)
+
+    utterances = commands.add_parser('utterances', help="utterance cache: replayed clips skipping STT, LLM and TTS")
+    utterances.add_argument('--clips', type=int, default=10, help="distinct generated recordings")
+    utterances.add_argument('--replays', type=int, default=40, help="resent copies with changed level and padding")
+    utterances.add_argument('--latency', type=float, default=0.2, help="fake STT and chat latency (seconds)")
+    utterances.add_argument('--variants', type=int, default=10, help="near-identical versions of each clip")
+    utterances.set_defaults(func=bench_utterances)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
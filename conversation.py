@@ -0,0 +1,182 @@
+# Per-session chat history that fits a fixed token budget by compacting old turns
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from metrics import METRICS
+
+DEFAULT_SESSION = 'default'
+# Chat formats add a few tokens of framing per message
+MESSAGE_OVERHEAD = 4
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+# Words that point back at an earlier exchange ("turn it off", "what about tomorrow", "and then?")
+_FOLLOW_UP = re.compile(
+    r"^\s*(and|but|so|or|also)\b"
+    r"|\b(it|its|that|this|these|those|they|them|their|he|him|his|she|her|there|then|"
+    r"again|more|else|another|same|instead|too|previous|earlier|why|what about|how about)\b",
+    re.IGNORECASE
+)
+
+def estimate_tokens(text):
+    """
+    Cheap local token estimate: the larger of one token per word or
+    punctuation mark and one per four characters, which tracks BPE
+    tokenizers closely enough for budgeting without loading one.
+    """
+    if not text:
+        return 0
+    return max(len(_TOKEN.findall(text)), (len(text) + 3) // 4)
+
+def is_follow_up(text):
+    """
+    Whether text may depend on the earlier turns. Self-contained requests
+    are sent without history, so repeated commands share a cached reply.
+    """
+    return bool(_FOLLOW_UP.search(text or ''))
+
+def clip_tokens(text, tokens):
+    """Cut text to roughly tokens tokens at a word boundary"""
+    if estimate_tokens(text) <= tokens:
+        return text
+    words = []
+    for word in text.split():
+        if estimate_tokens(' '.join(words + [word]) + ' ...') > tokens:
+            break
+        words.append(word)
+    return ' '.join(words) + ' ...'
+
+def compact_turn(user, assistant, tokens=24):
+    """Default summarizer: one clipped line per evicted exchange"""
+    return f"- User: {clip_tokens(user, tokens)} / Robot: {clip_tokens(assistant, tokens)}"
+
+class Conversation:
+    """
+    Chat history for one session under a hard token budget.
+
+    history(text) returns the messages to send between the system prompt
+    and the new user message. Whenever they would not fit in budget
+    (system prompt and new message included), the oldest turns are
+    evicted and folded into a running summary one at a time, so each
+    turn is summarized once. The summary is itself capped at
+    summary_budget tokens by dropping its oldest lines. The newest
+    pinned_turns turns are never evicted, only clipped if nothing else
+    fits.
+    """
+    def __init__(self, system_prompt, budget=1024, pinned_turns=2, summary_budget=256, summarizer=None):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.pinned_turns = pinned_turns
+        self.summary_budget = summary_budget
+        self.summarizer = summarizer or compact_turn
+        self.turns = deque()     # (user, assistant, tokens)
+        self.summary = deque()   # (line, tokens)
+        self.turn_tokens = 0
+        self.summary_tokens = 0
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_turn(self, user, assistant):
+        """Record a completed exchange"""
+        tokens = estimate_tokens(user) + estimate_tokens(assistant) + 2 * MESSAGE_OVERHEAD
+        with self._lock:
+            self.turns.append((user, assistant, tokens))
+            self.turn_tokens += tokens
+            self.last_used = time.monotonic()
+            # Keep the stored history within budget even before the next request
+            self._compact(self.budget - self._fixed_tokens(''))
+
+    def history(self, text):
+        """Messages (summary, then past turns) to send before the user message text"""
+        with self._lock:
+            self.last_used = time.monotonic()
+            available = self.budget - self._fixed_tokens(text)
+            self._compact(available)
+            messages = []
+            if self.summary:
+                messages.append({"role": "system",
+                                 "content": SUMMARY_PREFIX + '\n'.join(line for line, _ in self.summary)})
+            turns = list(self.turns)
+            used = self._summary_cost()
+            if used + self.turn_tokens > available:
+                turns = self._clip_pinned(turns, available - used)
+            for user, assistant, _ in turns:
+                messages.append({"role": "user", "content": user})
+                messages.append({"role": "assistant", "content": assistant})
+        prompt_tokens = self._fixed_tokens(text) + sum(
+            estimate_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages)
+        METRICS.observe('llm_prompt_tokens', prompt_tokens)
+        return messages
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+            self.summary.clear()
+            self.turn_tokens = 0
+            self.summary_tokens = 0
+
+    def _fixed_tokens(self, text):
+        return estimate_tokens(self.system_prompt) + estimate_tokens(text) + 2 * MESSAGE_OVERHEAD
+
+    def _summary_cost(self):
+        if not self.summary:
+            return 0
+        return self.summary_tokens + estimate_tokens(SUMMARY_PREFIX) + MESSAGE_OVERHEAD
+
+    def _compact(self, available):
+        while self.turns and len(self.turns) > self.pinned_turns and \
+                self._summary_cost() + self.turn_tokens > available:
+            user, assistant, tokens = self.turns.popleft()
+            self.turn_tokens -= tokens
+            line = self.summarizer(user, assistant)
+            self.summary.append((line, estimate_tokens(line)))
+            self.summary_tokens += self.summary[-1][1]
+            while self.summary and self.summary_tokens > self.summary_budget:
+                self.summary_tokens -= self.summary.popleft()[1]
+        # Pinned turns alone may still not fit: give up summary lines before clipping them
+        while self.summary and self._summary_cost() + self.turn_tokens > available:
+            self.summary_tokens -= self.summary.popleft()[1]
+
+    def _clip_pinned(self, turns, available):
+        """Shorten the kept turns, oldest first, until they fit in available tokens"""
+        excess = self.turn_tokens - available
+        clipped = []
+        for user, assistant, tokens in turns:
+            if excess > 0:
+                share = max(1, (tokens - excess) // 2 - MESSAGE_OVERHEAD)
+                user, assistant = clip_tokens(user, share), clip_tokens(assistant, share)
+                new_tokens = estimate_tokens(user) + estimate_tokens(assistant) + 2 * MESSAGE_OVERHEAD
+                excess -= tokens - new_tokens
+                tokens = new_tokens
+            clipped.append((user, assistant, tokens))
+        return clipped
+
+class ConversationStore:
+    """Conversations by session id, dropping the least recently used and idle ones"""
+    def __init__(self, system_prompt, max_sessions=256, idle_ttl=1800, **conversation_options):
+        self.system_prompt = system_prompt
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.conversation_options = conversation_options
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id=DEFAULT_SESSION):
+        with self._lock:
+            now = time.monotonic()
+            conversation = self._sessions.get(session_id)
+            if conversation is None or now - conversation.last_used > self.idle_ttl:
+                conversation = Conversation(self.system_prompt, **self.conversation_options)
+                self._sessions[session_id] = conversation
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return conversation
+
+    def reset(self, session_id=DEFAULT_SESSION):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
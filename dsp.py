@@ -0,0 +1,164 @@
+# Float32 speech clean-up: spectral-gate noise reduction and bandpass in one STFT pass
+from fractions import Fraction
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft
+from scipy.signal import butter, filtfilt, fftconvolve, get_window, resample_poly, sosfreqz
+
+def smoothing_kernel(n_time, n_freq):
+    """Triangular 2-D kernel (time x frequency) used to soften the gate mask"""
+    def ramp(n):
+        return np.concatenate([np.linspace(0, 1, n + 1, endpoint=False), np.linspace(1, 0, n + 2)])[1:-1]
+    kernel = np.outer(ramp(n_time), ramp(n_freq))
+    return (kernel / kernel.sum()).astype(np.float32)
+
+class SpeechDSP:
+    """
+    Noise-gates and band-limits 16-bit speech in float32, block by block.
+
+    The gate follows noisereduce's non-stationary mode (a per-bin noise
+    floor smoothed over time_constant_s, a sigmoid mask and a triangular
+    smoothing kernel); the Butterworth bandpass is applied as the squared
+    magnitude response of its second-order sections, which is what
+    filtfilt would apply, so both happen in the same STFT. Only
+    block_frames STFT frames are held at a time, and the working buffers
+    are kept and reused between calls.
+    """
+    def __init__(self, rate=16000, band=(250, 3500), order=4, n_fft=1024, prop_decrease=0.99,
+                 time_constant_s=2.0, thresh_n_mult=2, sigmoid_slope=10,
+                 freq_smooth_hz=500, time_smooth_ms=50, block_frames=256, envelope_frames=8):
+        self.rate = rate
+        self.n_fft = n_fft
+        self.hop = n_fft // 4
+        self.prop_decrease = prop_decrease
+        self.thresh_n_mult = thresh_n_mult
+        self.sigmoid_slope = sigmoid_slope
+        self.block_frames = block_frames
+        self.envelope_frames = envelope_frames
+        self.window = get_window('hann', n_fft).astype(np.float32)
+        # Overlap-added hann^2 at a quarter-frame hop sums to a constant 1.5
+        self.ola_gain = np.float32(self.hop / np.sum(self.window ** 2))
+
+        self.sos = butter(order, band, btype='band', fs=rate, output='sos')
+        _, response = sosfreqz(self.sos, worN=fft.rfftfreq(n_fft, 1 / rate), fs=rate)
+        self.band_gain = (np.abs(response) ** 2).astype(np.float32)
+
+        n_grad_freq = max(1, int(freq_smooth_hz / (rate / (n_fft / 2))))
+        n_grad_time = max(1, int(time_smooth_ms / (self.hop / rate * 1000)))
+        self.kernel = smoothing_kernel(n_grad_time, n_grad_freq)
+        self.context = n_grad_time  # frames of look-around each block needs for the kernel
+
+        # One-pole smoother for the noise floor, run over envelope_frames-sized steps
+        t_steps = time_constant_s * rate / (self.hop * envelope_frames)
+        self.floor_b = (np.sqrt(1 + 4 * t_steps ** 2) - 1) / (2 * t_steps ** 2)
+
+        self._frames = np.empty((block_frames + 2 * self.context, n_fft), np.float32)
+        self._buffers = {}
+
+    def _buffer(self, name, size, dtype=np.float32):
+        """A zeroed length-size view of a named buffer that grows but is never shrunk"""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(size, dtype)
+        view = buffer[:size]
+        view.fill(0)
+        return view
+
+    def _spectrum(self, frames, start, stop):
+        frames_out = self._frames[:stop - start]
+        np.multiply(frames[start:stop], self.window, out=frames_out)
+        return fft.rfft(frames_out, axis=1)
+
+    def _noise_floor(self, frames):
+        """Per-bin noise floor, averaged over envelope_frames and smoothed forwards and backwards"""
+        step = self.envelope_frames
+        count = len(frames)
+        levels = np.empty((-(-count // step), self.n_fft // 2 + 1), np.float32)
+        block = self.block_frames - self.block_frames % step
+        for start in range(0, count, block):
+            stop = min(start + block, count)
+            magnitude = np.abs(self._spectrum(frames, start, stop))
+            for i, first in enumerate(range(0, stop - start, step)):
+                levels[start // step + i] = magnitude[first:first + step].mean(axis=0)
+        if len(levels) > 1:
+            levels = filtfilt([self.floor_b], [1, self.floor_b - 1], levels, axis=0, padtype=None)
+        return np.maximum(levels, np.finfo(np.float32).eps).astype(np.float32)
+
+    def _floor_at(self, floor, start, stop):
+        """Linearly interpolate the coarse noise floor at frames start..stop"""
+        step = self.envelope_frames
+        position = (np.arange(start, stop, dtype=np.float32) - (step - 1) / 2) / step
+        position = np.clip(position, 0, len(floor) - 1)
+        below = position.astype(np.intp)
+        above = np.minimum(below + 1, len(floor) - 1)
+        weight = (position - below)[:, None]
+        return floor[below] * (1 - weight) + floor[above] * weight
+
+    def process(self, samples):
+        """
+        Return the cleaned signal as float32, the same length as samples.
+        The result is a view into a buffer that the next call reuses.
+        """
+        n = len(samples)
+        pad = self.n_fft
+        total = -(-(n + 2 * pad) // self.hop) * self.hop
+        signal = self._buffer('signal', total)
+        signal[pad:pad + n] = samples
+        output = self._buffer('output', total)
+        frames = sliding_window_view(signal, self.n_fft)[::self.hop]
+        hops = output.reshape(-1, self.hop)
+        overlap = self.n_fft // self.hop
+
+        floor = self._noise_floor(frames)
+        ctx = self.context
+        for start in range(0, len(frames), self.block_frames):
+            stop = min(start + self.block_frames, len(frames))
+            lo, hi = max(0, start - ctx), min(len(frames), stop + ctx)
+            spectrum = self._spectrum(frames, lo, hi)
+
+            # Gate: how far each bin rises above its noise floor, through a sigmoid
+            magnitude = np.abs(spectrum)
+            level = self._floor_at(floor, lo, hi)
+            mask = (magnitude - level) / level - self.thresh_n_mult
+            mask *= -self.sigmoid_slope
+            np.exp(mask, out=mask)
+            mask += 1
+            np.reciprocal(mask, out=mask)
+            mask = fftconvolve(mask, self.kernel, mode='same')[start - lo:stop - lo]
+            mask *= self.prop_decrease
+            mask += 1 - self.prop_decrease
+            mask *= self.band_gain
+
+            spectrum = spectrum[start - lo:stop - lo]
+            spectrum *= mask
+            frames_out = fft.irfft(spectrum, self.n_fft, axis=1)
+            frames_out *= self.window
+            frames_out = frames_out.reshape(stop - start, overlap, self.hop)
+            for k in range(overlap):
+                hops[start + k:stop + k] += frames_out[:, k]
+
+        output *= self.ola_gain
+        return output[pad:pad + n]
+
+    def speed_variants(self, signal, stretches):
+        """
+        Yield (stretch, int16 PCM) for each stretch factor (new length / old
+        length), peak-normalized. Lengths change by polyphase resampling and
+        every variant is written into the same int16 buffer, so convert
+        each one (e.g. with .tobytes()) before asking for the next.
+        """
+        for stretch in stretches:
+            ratio = Fraction(stretch).limit_denominator(64)
+            if ratio == 1:
+                variant = signal
+            else:
+                variant = resample_poly(signal, ratio.numerator, ratio.denominator)
+            yield stretch, self.to_pcm16(variant)
+
+    def to_pcm16(self, signal):
+        """Peak-normalize signal into the shared int16 buffer"""
+        pcm = self._buffer('pcm16', len(signal), np.int16)
+        peak = max(float(signal.max(initial=0)), -float(signal.min(initial=0)))
+        scale = 32767 / peak if peak > 0 else 1.0
+        np.multiply(signal, scale, out=pcm, casting='unsafe')
+        return pcm
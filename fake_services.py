@@ -0,0 +1,259 @@
+# Local stand-ins for Google speech, openrouter.ai, gTTS and VoiceRSS with injectable latency and errors
+import base64
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
+import wave
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+import voicerss_tts
+
+# Hosts the real clients talk to, mapped to the service name used in profiles
+SERVICE_HOSTS = {
+    'www.google.com': 'stt',
+    'openrouter.ai': 'llm',
+    'translate.google.com': 'gtts',
+    'api.voicerss.org': 'voicerss'
+}
+
+class ServiceProfile:
+    """
+    Latency (seconds), uniform jitter (+/- seconds) and error rate of one
+    fake service; a tail_rate fraction of requests is tail_latency slower.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, tail_rate=0.0, tail_latency=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+
+    def delay(self):
+        tail = self.tail_latency if random.random() < self.tail_rate else 0.0
+        return max(0.0, self.latency + tail + random.uniform(-self.jitter, self.jitter))
+
+def silent_wav(seconds=0.5, rate=16000):
+    """A short silent 16-bit mono WAV payload"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b'\x00\x00' * int(seconds * rate))
+    return buffer.getvalue()
+
+def tone_wav(seconds=0.5, rate=16000, hz=440):
+    """
+    A short sine tone as a 16-bit mono WAV payload. Served in place of the
+    gTTS MP3: the client only stores the bytes, audio_output.load() reads
+    them as WAV without ffmpeg, and (unlike silence) they survive trimming.
+    """
+    frames = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * hz * i / rate)))
+                      for i in range(int(seconds * rate)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return buffer.getvalue()
+
+TONE_WAV = tone_wav()
+
+class FakeServices:
+    """
+    One local HTTP server answering all four remote APIs.
+
+    profiles maps 'stt' / 'llm' / 'gtts' / 'voicerss' to a ServiceProfile;
+    transcript and reply set what the fake STT and chat endpoints return;
+    "{n}" in reply is replaced by the request number so replies can be
+    made unique (defeating the response and synthesis caches).
+    """
+    def __init__(self, profiles=None, transcript="tell me a joke",
+                 reply="Why did the robot go on holiday? To recharge.", host='127.0.0.1', port=0):
+        self.profiles = {name: ServiceProfile() for name in SERVICE_HOSTS.values()}
+        self.profiles.update(profiles or {})
+        self.transcript = transcript
+        self.reply = reply
+        self.requests = {name: 0 for name in self.profiles}
+        self.errors = {name: 0 for name in self.profiles}
+        self.down = set()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def set_down(self, service, down=True):
+        """Simulate an outage: every request to service fails at once until brought back"""
+        with self._lock:
+            if down:
+                self.down.add(service)
+            else:
+                self.down.discard(service)
+
+    def _admit(self, service):
+        """Apply the service's latency and decide whether to inject an error"""
+        if service in self.down:
+            with self._lock:
+                self.requests[service] += 1
+                self.errors[service] += 1
+            return False
+        profile = self.profiles[service]
+        time.sleep(profile.delay())
+        failed = random.random() < profile.error_rate
+        with self._lock:
+            self.requests[service] += 1
+            if failed:
+                self.errors[service] += 1
+        return not failed
+
+    def _handler_class(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                path = urllib.parse.urlsplit(self.path).path
+                if path.startswith('/speech-api/v2/recognize'):
+                    self.recognize(body)
+                elif path.endswith('/chat/completions'):
+                    self.chat(body)
+                elif path.endswith('/batchexecute'):
+                    self.gtts()
+                elif path == '/':
+                    self.voicerss(body)
+                else:
+                    self.send_bytes(404, b'Not found')
+
+            def send_bytes(self, status, body, content_type='text/plain'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def recognize(self, body):
+                if not services._admit('stt'):
+                    return self.send_bytes(500, b'Injected failure')
+                result = {"result": [{"alternative": [{"transcript": services.transcript, "confidence": 0.92}],
+                                      "final": True}], "result_index": 0}
+                payload = '{"result":[]}\n' + json.dumps(result) + '\n'
+                self.send_bytes(200, payload.encode(), 'application/json')
+
+            def chat(self, body):
+                if not services._admit('llm'):
+                    return self.send_bytes(503, b'{"error":"injected"}', 'application/json')
+                request = json.loads(body or b'{}')
+                reply = services.reply.replace('{n}', str(services.requests['llm']))
+                if not request.get('stream'):
+                    payload = {"choices": [{"message": {"role": "assistant", "content": reply}}]}
+                    return self.send_bytes(200, json.dumps(payload).encode(), 'application/json')
+
+                # Server-sent events, one word per chunk
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                words = reply.split(' ')
+                for i, word in enumerate(words):
+                    delta = word + (' ' if i < len(words) - 1 else '')
+                    self.chunk(f"data: {json.dumps({'choices': [{'delta': {'content': delta}}]})}\n\n".encode())
+                    time.sleep(services.profiles['llm'].jitter / max(1, len(words)))
+                self.chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def gtts(self):
+                if not services._admit('gtts'):
+                    return self.send_bytes(500, b'Injected failure')
+                audio = base64.b64encode(TONE_WAV).decode('ascii')
+                line = '[["wrb.fr","jQ1olc","[\\"' + audio + '\\"]",null,null,null,"generic"]]'
+                self.send_bytes(200, (")]}'\n\n" + line + "\n").encode(), 'application/json')
+
+            def voicerss(self, body):
+                if not services._admit('voicerss'):
+                    return self.send_bytes(500, b'Injected failure')
+                params = urllib.parse.parse_qs(body.decode('utf-8'))
+                if not params.get('key'):
+                    return self.send_bytes(200, b'ERROR: The API key is not available!')
+                self.send_bytes(200, silent_wav(), 'audio/wav')
+
+        return Handler
+
+@contextmanager
+def redirect(base_url):
+    """
+    Point every client in this repo at base_url for the duration:
+    urllib (speech_recognition), requests (gTTS, ChatClient) and
+    voicerss_tts's http.client connection.
+    """
+    target = urllib.parse.urlsplit(base_url)
+
+    def rewrite(url):
+        parts = urllib.parse.urlsplit(url)
+        host = parts.hostname or ''
+        if host not in SERVICE_HOSTS and not host.startswith('translate.google.'):
+            return url
+        return urllib.parse.urlunsplit((target.scheme, target.netloc, parts.path, parts.query, ''))
+
+    class RewriteHandler(urllib.request.BaseHandler):
+        handler_order = 100
+
+        def http_request(self, request):
+            request.full_url = rewrite(request.full_url)
+            return request
+
+        https_request = http_request
+
+    original_send = requests.Session.send
+
+    def send(session, request, **kwargs):
+        request.url = rewrite(request.url)
+        return original_send(session, request, **kwargs)
+
+    saved = (voicerss_tts.HOST, voicerss_tts.HTTP_PORT)
+    urllib.request.install_opener(urllib.request.build_opener(RewriteHandler))
+    requests.Session.send = send
+    voicerss_tts.HOST, voicerss_tts.HTTP_PORT = target.hostname, target.port
+    try:
+        yield
+    finally:
+        urllib.request.install_opener(None)
+        requests.Session.send = original_send
+        voicerss_tts.HOST, voicerss_tts.HTTP_PORT = saved
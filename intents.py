@@ -0,0 +1,161 @@
+# Local fast path: answer common device commands from a table instead of asking the LLM
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from metrics import METRICS
+
+INTENTS_FILE = os.getenv('INTENTS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json'))
+
+CONTRACTIONS = {"what's": "what is", "it's": "it is", "don't": "do not", "i'm": "i am", "let's": "let us",
+                "can't": "can not", "won't": "will not"}
+# Politeness that doesn't change which command was meant
+FILLER = {'please', 'can', 'could', 'would', 'you', 'hey', 'ok', 'okay', 'robot', 'now', 'just'}
+# A near-miss containing one of these that its pattern lacks means the opposite of the pattern
+NEGATIONS = {'not', 'no', 'never', 'nor', 'neither', 'none', 'nothing'}
+_WORD = re.compile(r"[a-z0-9']+")
+
+def normalize_command(text):
+    """Lower-case words without punctuation, contractions expanded and filler dropped"""
+    words = []
+    for word in _WORD.findall((text or '').lower().replace('\u2019', "'")):
+        expanded = CONTRACTIONS.get(word)
+        if expanded is None:
+            # doesn't -> does not, shouldn't -> should not, ...
+            expanded = word[:-3] + ' not' if word.endswith("n't") else word
+        for part in expanded.split():
+            part = part.replace("'", '')
+            if part and part not in FILLER:
+                words.append(part)
+    return ' '.join(words)
+
+def char_ngrams(text, n=3):
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+def template_values(now=None):
+    """Values available to reply templates"""
+    now = now or datetime.now()
+    return {
+        'time': now.strftime('%I:%M %p').lstrip('0'),
+        'date': f"{now.strftime('%B')} {now.day}, {now.year}",
+        'weekday': now.strftime('%A')
+    }
+
+class IntentMatcher:
+    """
+    Matches transcripts against a table of intents (see intents.json).
+
+    Patterns are normalized and indexed once: an exact-match dict for the
+    common case, and an inverted index of character trigrams for
+    near-misses ("turn the lights on please"), scored by Dice similarity.
+    A match needs threshold similarity and must beat the best pattern of
+    any other intent by margin, so "turn on" vs "turn off" is never a
+    guess, and a near-miss may not add a negation ("do not turn on the
+    light"); anything else goes to the LLM.
+    """
+    def __init__(self, path=None, threshold=None, margin=0.05, n=3):
+        self.path = path or INTENTS_FILE
+        self.margin = margin
+        self.n = n
+        self.intents = []
+        self.threshold = 0.82
+        self.stats = {'hits': 0, 'misses': 0, 'match_seconds': 0.0}
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._patterns = []  # (intent index, gram count, negation words)
+        self._index = {}     # gram -> pattern ids
+        self._load()
+        if threshold is not None:
+            self.threshold = threshold
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                table = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Intent table unavailable ({e}); every request goes to the LLM.")
+            return
+        self.threshold = table.get('threshold', self.threshold)
+        for intent in table.get('intents', []):
+            self.add_intent(intent['name'], intent['patterns'], intent['reply'], intent.get('ttl'))
+
+    def add_intent(self, name, patterns, reply, ttl=None):
+        """ttl: seconds the reply stays true (e.g. the time), None for replies that don't go stale"""
+        index = len(self.intents)
+        self.intents.append({'name': name, 'reply': reply, 'ttl': ttl})
+        for pattern in patterns:
+            normalized = normalize_command(pattern)
+            if not normalized:
+                continue
+            self._exact.setdefault(normalized, index)
+            grams = char_ngrams(normalized, self.n)
+            pattern_id = len(self._patterns)
+            self._patterns.append((index, len(grams), NEGATIONS.intersection(normalized.split())))
+            for gram in grams:
+                self._index.setdefault(gram, []).append(pattern_id)
+
+    def match(self, text):
+        """{'intent', 'reply', 'score', 'ttl'} for a confident match, otherwise None"""
+        started = time.perf_counter()
+        result = self._match(normalize_command(text))
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats['hits' if result else 'misses'] += 1
+            self.stats['match_seconds'] += elapsed
+        METRICS.inc('intent_requests_total', result='hit' if result else 'miss')
+        return result
+
+    def _match(self, normalized):
+        if not normalized:
+            return None
+        index = self._exact.get(normalized)
+        if index is not None:
+            return self._result(index, 1.0)
+
+        grams = char_ngrams(normalized, self.n)
+        overlaps = Counter()
+        for gram in grams:
+            overlaps.update(self._index.get(gram, ()))
+        best = {}  # intent index -> (score, negation words of that pattern)
+        for pattern_id, overlap in overlaps.items():
+            index, size, negations = self._patterns[pattern_id]
+            score = 2 * overlap / (len(grams) + size)
+            if score > best.get(index, (0.0,))[0]:
+                best[index] = (score, negations)
+        if not best:
+            return None
+        ranked = sorted(best.items(), key=lambda item: -item[1][0])
+        index, (score, negations) = ranked[0]
+        runner_up = ranked[1][1][0] if len(ranked) > 1 else 0.0
+        if score < self.threshold or score - runner_up < self.margin:
+            return None
+        if not NEGATIONS.intersection(normalized.split()) <= negations:
+            return None
+        return self._result(index, score)
+
+    def _result(self, index, score):
+        intent = self.intents[index]
+        return {'intent': intent['name'], 'reply': intent['reply'].format(**template_values()),
+                'score': round(score, 3), 'ttl': intent['ttl']}
+
+    def report(self, llm_seconds=None):
+        """
+        Hit rate and mean match time; given the mean LLM round-trip
+        (llm_seconds), also the latency the hits saved.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        total = stats['hits'] + stats['misses']
+        report = {
+            'requests': total,
+            'hits': stats['hits'],
+            'hit_rate': stats['hits'] / total if total else 0.0,
+            'mean_match_us': stats['match_seconds'] / total * 1e6 if total else 0.0
+        }
+        if llm_seconds is not None:
+            report['saved_seconds'] = stats['hits'] * llm_seconds - stats['match_seconds']
+        return report
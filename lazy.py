@@ -0,0 +1,21 @@
+# Deferred imports for heavy optional modules, so entry points start quickly
+import importlib.util
+import sys
+
+def lazy_import(name):
+    """
+    Return module name without executing it yet; the real import happens on
+    the first attribute access. Already-imported modules are returned as is.
+    A missing module still raises ModuleNotFoundError here, at import time.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,207 @@
+# Pooled chat-completion client with timeouts and an optional response cache
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from metrics import METRICS
+from lazy import lazy_import
+
+requests = lazy_import('requests')
+
+DEFAULT_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+
+class ChatError(Exception):
+    """Raised when the chat endpoint answers with a non-200 status"""
+    def __init__(self, status_code, body=''):
+        super().__init__(f"Chat endpoint returned HTTP {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+def is_retryable(error):
+    """Rate limiting, server errors and network failures are worth another attempt"""
+    if isinstance(error, ChatError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def normalize_text(text):
+    """Normalize user text so repeated voice commands share a cache entry"""
+    return ' '.join((text or '').lower().split()).strip(' .!?')
+
+# Questions whose answer changes over minutes or hours (weather, news, clock)
+TIME_SENSITIVE = re.compile(
+    r"\b(weather|forecast|temperature|rain(ing)?|snow(ing)?|news|headlines?|today|tonight|"
+    r"tomorrow|yesterday|now|current(ly)?|latest|recent(ly)?|live|scores?|prices?|stocks?|"
+    r"traffic|time|date|day)\b"
+)
+
+def is_cacheable(text):
+    """False for prompts whose reply would go stale, which are always sent"""
+    return not TIME_SENSITIVE.search(normalize_text(text))
+
+class CompletionCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds"""
+    def __init__(self, ttl, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class ChatClient:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, connect_timeout=3.05,
+                 read_timeout=30, pool_size=10, cache_ttl=None, cache_size=256):
+        """
+        api_key: bearer token for the chat endpoint
+        base_url: API root, override to point at a local stand-in server
+        cache_ttl: seconds to keep completions, None or 0 disables the cache;
+        time-sensitive prompts (see is_cacheable) are never cached
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.cache = CompletionCache(cache_ttl, cache_size) if cache_ttl else None
+
+    @property
+    def session(self):
+        """Pooled requests session, created (and requests imported) on first use"""
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                        pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                })
+                self._session = session
+            return self._session
+
+    def complete(self, text, system_prompt, model="gpt-3.5-turbo", template=None, history=None):
+        """
+        Return the assistant reply for text.
+
+        template, if given, wraps text (as {text}) before it is sent.
+        history: earlier messages ({"role", "content"} dicts) sent between
+        the system prompt and text. The cache is keyed on the normalized
+        text, model, system prompt and the full history.
+        """
+        key = self._cache_key(text, system_prompt, model, template, history)
+        cache = self.cache if is_cacheable(text) else None
+        if cache is not None:
+            cached = cache.get(key)
+            METRICS.record_cache('llm', cached is not None)
+            if cached is not None:
+                return cached
+
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            json=self._payload(text, system_prompt, model, template, history),
+            timeout=self.timeout
+        )
+        METRICS.record_remote_call('openrouter', len(response.request.body or b''),
+                                   len(response.content), error=response.status_code != 200)
+        if response.status_code != 200:
+            raise ChatError(response.status_code, response.text)
+
+        content = response.json()['choices'][0]['message']['content']
+        if cache is not None:
+            cache.put(key, content)
+        return content
+
+    def stream(self, text, system_prompt, model="gpt-3.5-turbo", template=None, history=None):
+        """
+        Yield the assistant reply in pieces as the endpoint streams it.
+
+        Uses server-sent events ("stream": true); a cached reply is yielded
+        whole and a fully received reply is added to the cache.
+        """
+        key = self._cache_key(text, system_prompt, model, template, history)
+        cache = self.cache if is_cacheable(text) else None
+        if cache is not None:
+            cached = cache.get(key)
+            METRICS.record_cache('llm', cached is not None)
+            if cached is not None:
+                yield cached
+                return
+
+        payload = self._payload(text, system_prompt, model, template, history)
+        payload["stream"] = True
+        with self.session.post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            sent = len(response.request.body or b'')
+            if response.status_code != 200:
+                METRICS.record_remote_call('openrouter', sent, len(response.content), error=True)
+                raise ChatError(response.status_code, response.text)
+
+            response.encoding = 'utf-8'  # SSE is always UTF-8
+            parts = []
+            received = 0
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                received += len(line) + 1
+                # Blank lines separate events, ':' lines are keep-alive comments
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                choices = json.loads(data).get('choices') or [{}]
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            METRICS.record_remote_call('openrouter', sent, received)
+
+        if cache is not None and parts:
+            cache.put(key, ''.join(parts))
+
+    def _cache_key(self, text, system_prompt, model, template, history):
+        # The same words mean something else after a different exchange
+        context = tuple((message['role'], message['content']) for message in history or ())
+        return (normalize_text(text), model, system_prompt, template, context)
+
+    def _payload(self, text, system_prompt, model, template, history=None):
+        return {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                *(history or []),
+                {"role": "user", "content": template.format(text=text) if template else text}
+            ]
+        }
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
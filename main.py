@@ -1,132 +1,349 @@
 import speech_recognition as sr
-import pyttsx3
-import requests
 import json
 import os
-import wave
+import sys
+import threading
+import time
+import tts_cache
+import audio_output
+import llm_client
+import resilience
+import conversation
+import intents
+import utterance_cache
+import streaming_tts
+import segmenter
+import wav_analyzer
+import voices
+from lazy import lazy_import
+from metrics import METRICS
 from dotenv import load_dotenv
 
+pyttsx3 = lazy_import('pyttsx3')
+
 load_dotenv()
 
 class RobotVoiceSystem:
+    # Recordings longer than this are split at pauses and transcribed in parallel
+    SEGMENT_THRESHOLD_S = 15
+    VOICE_KEYWORD = 'female'
+    VOICE_RATE = 200  # Moderate speed
+    VOICE_VOLUME = 5  # Clear volume
+
     def __init__(self):
         self.recognizer = sr.Recognizer()
-        self.engine = pyttsx3.init()
-        self.setup_voice()
+        # Abandoned (hedged or timed-out) attempts must not hold a worker thread forever
+        self.recognizer.operation_timeout = float(os.getenv('STT_TIMEOUT', 15))
+        self._engine = None  # Started on first use, see the engine property
+        self._voice_id = None
+        # Concurrent TTS requests must not start two engines or drive one from two threads
+        self._engine_lock = threading.RLock()
+        self.tts_pool = None  # Optional tts_pool.TTSPool that renders instead of the local engine
         self.api_key = os.getenv('OPENAI_API_KEY')
+        self.chat = llm_client.ChatClient(
+            self.api_key,
+            cache_ttl=float(os.getenv('LLM_CACHE_TTL', 600))
+        )
+        # Follow-up context per session, kept to a flat prompt size
+        self.conversations = conversation.ConversationStore(
+            self.SYSTEM_PROMPT,
+            budget=int(os.getenv('CONVERSATION_TOKEN_BUDGET', 1024))
+        )
+        self.stt_policy = resilience.Resilience(
+            'google_stt',
+            retryable=lambda error: isinstance(error, sr.RequestError),
+            deadline=float(os.getenv('STT_DEADLINE', 10))
+        )
+        self.llm_policy = resilience.Resilience(
+            'openrouter',
+            retryable=llm_client.is_retryable,
+            deadline=float(os.getenv('LLM_DEADLINE', 12))
+        )
+        # Common device commands are answered locally, without a chat round-trip
+        self.intents = intents.IntentMatcher()
+        self.tts_cache = tts_cache.get_default_cache()
+        # What the speakers play (AUDIO_OUTPUT_PROFILE); None keeps the engine's own WAV
+        self.output_profile = audio_output.get_profile()
+        # Resent clips (retries, replays, canned prompts) skip STT, LLM and TTS entirely
+        self.utterances = utterance_cache.UtteranceCache()
         
-    def setup_voice(self):
+    @property
+    def engine(self):
+        """pyttsx3 engine, started and configured the first time speech is rendered"""
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    engine = pyttsx3.init()
+                    self.setup_voice(engine)
+                    self._engine = engine  # Published only once fully configured
+        return self._engine
+
+    @property
+    def voice_id(self):
+        """Selected voice (None for the default), known without starting the engine once cached"""
+        if self._engine is None:
+            voice_id = voices.cached_voice_id(self.VOICE_KEYWORD)
+            if voice_id is not voices.UNRESOLVED:
+                return voice_id
+        self.engine  # Starting the engine resolves the voice
+        return self._voice_id
+
+    def setup_voice(self, engine):
         """Configure voice settings for robot-like response using a female voice"""
-        voices = self.engine.getProperty('voices')
-        # Select female voice if available
-        female_voice_found = False
-        for voice in voices:
-            if "female" in voice.name.lower():
-                self.engine.setProperty('voice', voice.id)
-                female_voice_found = True
-                break
-        if not female_voice_found:
+        self._voice_id = voices.resolve_voice_id(engine, self.VOICE_KEYWORD)
+        if self._voice_id is None:
             print("Female voice not found. Using default voice.")
-        self.engine.setProperty('rate', 200)  # Moderate speed
-        self.engine.setProperty('volume', 5)  # Clear volume
+        engine.setProperty('rate', self.VOICE_RATE)
+        engine.setProperty('volume', self.VOICE_VOLUME)
 
+    @METRICS.timed('stt')
     def process_audio(self, input_wav):
         """Convert input WAV to text"""
+        audio = self.load_audio(input_wav)
+        if audio is None:
+            return None
+        return self.transcribe_audio(audio)
+
+    def load_audio(self, input_wav):
+        """AudioData of a WAV path or file object, None if it can't be read"""
         try:
             with sr.AudioFile(input_wav) as source:
                 print("Processing audio...")
-                audio = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio)
-                return text
+                return self.recognizer.record(source)
         except Exception as e:
             print(f"Audio processing error: {e}")
             return None
 
-    def get_ai_response(self, text):
-        """Get concise AI response"""
+    def transcribe_audio(self, audio):
+        """transcribe() with errors reported as no text, like process_audio"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            prompt = f"As a robot assistant, provide a clear and concise response (max 50 words) to: {text}"
-            
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": "You are a helpful robot assistant. Keep responses under 50 words."},
-                    {"role": "user", "content": prompt}
-                ]
-            }
-
-            response = requests.post(
-                'https://openrouter.ai/api/v1/chat/completions',
-                headers=headers,
-                json=payload
-            )
+            return self.transcribe(audio)
+        except Exception as e:
+            print(f"Audio processing error: {e}")
+            return None
 
-            if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
-            return "I apologize, I cannot process your request at the moment."
-            
+    def transcribe(self, audio):
+        """Transcribe AudioData, segmenting long recordings"""
+        duration = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+        METRICS.record_audio(duration, 'stt')
+        if duration <= self.SEGMENT_THRESHOLD_S:
+            return segmenter.recognize_with_retry(self.recognize_reliably, audio, retries=0)
+        return segmenter.transcribe_segments(audio, self.recognize_reliably, retries=0)
+
+    SYSTEM_PROMPT = "You are a helpful robot assistant. Keep responses under 50 words."
+    PROMPT_TEMPLATE = "As a robot assistant, provide a clear and concise response (max 50 words) to: {text}"
+
+    def get_ai_response(self, text, session_id=conversation.DEFAULT_SESSION):
+        """Get concise AI response, in the context of the session's earlier turns (session_id=None: none)"""
+        return self.answer(text, session_id)[0]
+
+    @METRICS.timed('llm')
+    def answer(self, text, session_id=conversation.DEFAULT_SESSION, strict=False):
+        """
+        get_ai_response() plus how long the reply may be replayed for the
+        same utterance: None for the cache default, 0 for replies that
+        must not be cached (fallbacks, answers that relied on earlier turns,
+        time-sensitive questions that llm_client.is_cacheable() turns away).
+        strict: raise chat and resilience errors instead of answering with the fallback
+        """
+        dialog = self.conversations.get(session_id) if session_id is not None else None
+        match = self.intents.match(text)
+        if match:
+            print(f"Answered locally (intent {match['intent']})")
+            if dialog is not None:
+                dialog.add_turn(text, match['reply'])
+            return match['reply'], match['ttl']
+        try:
+            history = self._history(dialog, text)
+            reply = self.llm_policy.call(
+                self.chat.complete,
+                text,
+                system_prompt=self.SYSTEM_PROMPT,
+                template=self.PROMPT_TEMPLATE,
+                history=history
+            )
+            if dialog is not None:
+                dialog.add_turn(text, reply)
+            return reply, 0 if history or not llm_client.is_cacheable(text) else None
+        except (llm_client.ChatError, resilience.ResilienceError):
+            if strict:
+                raise
+            return "I apologize, I cannot process your request at the moment.", 0
         except Exception as e:
+            if strict:
+                raise
             print(f"API error: {e}")
-            return "System processing error occurred."
+            return "System processing error occurred.", 0
+
+    def respond(self, input_wav, output_wav, session_id=conversation.DEFAULT_SESSION):
+        """
+        STT -> LLM -> TTS for one recording, replaying the stored transcript,
+        reply and WAV when the same clip was answered before.
+        Returns (transcript, reply), or None if nothing was written.
+        """
+        audio = self.load_audio(input_wav)
+        if audio is None:
+            return None
+        key = utterance_cache.audio_fingerprint(audio)
+        cached = self.utterances.fetch(key, output_wav)
+        if cached:
+            print(f"Replayed cached reply (similarity {cached['similarity']})")
+            self.remember_turn(session_id, cached['transcript'], cached['reply'])
+            return cached['transcript'], cached['reply']
+
+        with METRICS.stage('stt'):
+            text = self.transcribe_audio(audio)
+        if not text:
+            return None
+        reply, ttl = self.answer(text, session_id)
+        if not self.create_audio_response(reply, output_wav):
+            return None
+        with open(output_wav, 'rb') as f:
+            self.utterances.put(key, text, reply, f.read(), ttl)
+        return text, reply
 
+    def remember_turn(self, session_id, text, reply):
+        """Record a turn answered without the LLM (e.g. from the utterance cache)"""
+        if session_id is not None:
+            self.conversations.get(session_id).add_turn(text, reply)
+
+    @METRICS.timed('tts')
     def create_audio_response(self, text, output_wav):
         """Convert text to WAV audio"""
         try:
-            self.engine.save_to_file(text, output_wav)
-            self.engine.runAndWait()
+            key = self.tts_cache.key(
+                text, 'pyttsx3',
+                voice=self.voice_id,
+                rate=self.VOICE_RATE,
+                volume=self.VOICE_VOLUME,
+                output=self.output_profile.name if self.output_profile else 'original'
+            )
+            if not self.tts_cache.synthesize(key, 'wav', output_wav, lambda path: self._render_output(text, path)):
+                raise RuntimeError("TTS engine produced no audio")
             return True
         except Exception as e:
             print(f"Speech generation error: {e}")
             return False
 
+    def stream_response(self, text, output_wav, session_id=conversation.DEFAULT_SESSION):
+        """Stream the AI reply and speak it sentence by sentence into output_wav"""
+        started = time.perf_counter()
+        dialog = self.conversations.get(session_id) if session_id is not None else None
+        match = self.intents.match(text)
+        try:
+            if match:
+                # Nothing to stream: the whole reply is known already
+                if not self.create_audio_response(match['reply'], output_wav):
+                    return None
+                elapsed = time.perf_counter() - started
+                result = {'text': match['reply'], 'sentences': 1,
+                          'time_to_first_audio': elapsed, 'total_time': elapsed}
+            else:
+                # Spoken sentences can't be taken back, so streaming is only breaker-guarded
+                with self.llm_policy.guarded():
+                    pieces = self.chat.stream(
+                        text,
+                        system_prompt=self.SYSTEM_PROMPT,
+                        template=self.PROMPT_TEMPLATE,
+                        history=self._history(dialog, text)
+                    )
+                    result = streaming_tts.stream_to_wav(pieces, self.create_audio_response, output_wav, started)
+                if not result['sentences']:
+                    # Nothing was spoken, so there is no WAV either: use the fallback
+                    raise ValueError("streamed reply contained no speech")
+            if dialog is not None:
+                dialog.add_turn(text, result['text'])
+        except Exception as e:
+            print(f"Streaming error: {e}")
+            # Fall back to speaking the canned reply in one piece
+            response = "I apologize, I cannot process your request at the moment."
+            if not self.create_audio_response(response, output_wav):
+                return None
+            result = {'text': response, 'sentences': 1,
+                      'time_to_first_audio': time.perf_counter() - started,
+                      'total_time': time.perf_counter() - started}
+        print(f"Time to first audio: {result['time_to_first_audio']:.2f}s "
+              f"({result['sentences']} sentences in {result['total_time']:.2f}s)")
+        return result
+
+    def intent_report(self):
+        """Local intent hit rate and the time it saved, priced at the median chat round-trip"""
+        return self.intents.report(self.llm_policy.latency.percentile(50))
+
+    def _history(self, dialog, text):
+        """Earlier turns for a follow-up; None for self-contained requests, which stay cacheable"""
+        if dialog is None or not (dialog.turns or dialog.summary) or not conversation.is_follow_up(text):
+            return None
+        return dialog.history(self.PROMPT_TEMPLATE.format(text=text))
+
+    def recognize_reliably(self, audio):
+        """recognize() under the STT resilience policy, giving up as sr.RequestError"""
+        try:
+            return self.stt_policy.call(self.recognize, audio)
+        except resilience.ResilienceError as e:
+            raise sr.RequestError(str(e)) from e
+
+    def recognize(self, audio):
+        """Single recognize_google call, counted as a remote call"""
+        METRICS.record_remote_call('google_stt', sent=len(audio.frame_data))
+        return self.recognizer.recognize_google(audio)
+
+    def _render_output(self, text, path):
+        """Render text to path, then trim and encode it for the speakers"""
+        self._render(text, path)
+        if self.output_profile is not None and os.path.getsize(path):
+            print(audio_output.format_saving(audio_output.convert(path, profile=self.output_profile)))
+
+    def _render(self, text, path):
+        if self.tts_pool is not None:
+            self.tts_pool.render(text, path)
+            return
+        with self._engine_lock:
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+
+    @METRICS.timed('analyze')
     def analyze_wav(self, wav_file):
-        """Analyze and display WAV file properties"""
+        """Analyze WAV file properties and signal levels, returning a dict (None on failure)"""
         try:
-            with wave.open(wav_file, 'rb') as audio:
-                channels = audio.getnchannels()
-                sample_width = audio.getsampwidth()
-                frame_rate = audio.getframerate()
-                num_frames = audio.getnframes()
-                duration = num_frames / frame_rate
-
-                print("\nWAV File Analysis:")
-                print(f"- Channels: {'Mono' if channels == 1 else 'Stereo'}")
-                print(f"- Sample Rate: {frame_rate} Hz")
-                print(f"- Sample Width: {sample_width * 8} bits ({sample_width} bytes)")
-                print(f"- Duration: {duration:.2f} seconds")
-                print(f"- Total Frames: {num_frames}")
+            return wav_analyzer.analyze(wav_file)
         except Exception as e:
             print(f"Error analyzing WAV file: {e}")
+            return None
 
-def main():
+def main(stream=False):
     robot = RobotVoiceSystem()
     
     # Process flow
     input_wav = "AUDIO (3).wav"
     output_wav = "output.wav"
     
-    # 1. Convert input WAV to text
-    text = robot.process_audio(input_wav)
-    if not text:
-        return
-    
-    # 2. Get AI response
-    response = robot.get_ai_response(text)
-    
-    # 3. Create audio response
-    success = robot.create_audio_response(response, output_wav)
+    with METRICS.trace(input=input_wav):
+        run_pipeline(robot, input_wav, output_wav, stream)
+    if METRICS.tracing:
+        METRICS.export_traces("traces.jsonl")
+        print("Stage timeline appended to traces.jsonl")
+
+def run_pipeline(robot, input_wav, output_wav, stream=False):
+    if stream:
+        # 1. Convert input WAV to text
+        text = robot.process_audio(input_wav)
+        if not text:
+            return
+        # 2+3. Speak the reply while it is still being generated
+        success = robot.stream_response(text, output_wav) is not None
+    else:
+        # 1-3. Text, AI response and audio response, or all three from the utterance cache
+        success = robot.respond(input_wav, output_wav) is not None
     
     if success:
         print(f"Response saved to {output_wav}")
         # Analyze the output WAV file
-        robot.analyze_wav(output_wav)
+        analysis = robot.analyze_wav(output_wav)
+        if analysis:
+            print(wav_analyzer.format_report(analysis))
     else:
         print("Failed to create response")
 
 if __name__ == "__main__":
-    main()
+    main(stream="--stream" in sys.argv)
@@ -0,0 +1,278 @@
+# Per-stage latency, remote-call, cache and resource metrics with opt-in request traces
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class Metrics:
+    """
+    Registry of counters, gauges and histograms keyed by name and labels.
+
+    Tracing is opt-in (enable_tracing() or VOICE_TRACE=1); when on, every
+    stage timed inside a trace() block is recorded on that request's
+    timeline, including stages run on worker threads via wrap().
+    """
+    def __init__(self, max_traces=1000):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.tracing = os.getenv('VOICE_TRACE') == '1'
+        self.traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def enable_tracing(self, enabled=True):
+        self.tracing = enabled
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def record_remote_call(self, service, sent=0, received=0, error=False):
+        self.inc('remote_calls_total', service=service)
+        self.inc('remote_bytes_sent_total', sent, service=service)
+        self.inc('remote_bytes_received_total', received, service=service)
+        if error:
+            self.inc('remote_errors_total', service=service)
+
+    def record_cache(self, cache, hit):
+        self.inc('cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+    def record_audio(self, seconds, stage):
+        self.inc('audio_seconds_total', seconds, stage=stage)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Time a block as one pipeline stage"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe('stage_seconds', elapsed, stage=name)
+            if error:
+                self.inc('stage_errors_total', stage=name)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace['spans'].append(dict(
+                    labels,
+                    stage=name,
+                    start=round(started - trace['_origin'], 6),
+                    duration=round(elapsed, 6),
+                    error=error
+                ))
+
+    def timed(self, name):
+        """Decorator form of stage()"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def trace(self, trace_id=None, **attributes):
+        """Collect the stage timeline of one request (no-op unless tracing)"""
+        if not self.tracing:
+            yield None
+            return
+        trace = {
+            'trace_id': trace_id or uuid.uuid4().hex,
+            'started': time.time(),
+            'spans': [],
+            '_origin': time.perf_counter()
+        }
+        trace.update(attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace['total'] = round(time.perf_counter() - trace.pop('_origin'), 6)
+            with self._lock:
+                self.traces.append(trace)
+
+    @staticmethod
+    def wrap(func):
+        """Bind func to the caller's trace so worker threads report into it"""
+        context = contextvars.copy_context()
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # A context can only be entered by one thread at a time
+            return context.copy().run(func, *args, **kwargs)
+        return wrapper
+
+    def snapshot(self):
+        """Plain-dict view of every metric plus derived rates"""
+        with self._lock:
+            counters = {_series(name, labels): value for (name, labels), value in self.counters.items()}
+            gauges = {_series(name, labels): value for (name, labels), value in self.gauges.items()}
+            histograms = {
+                _series(name, labels): {'count': h.count, 'sum': h.sum}
+                for (name, labels), h in self.histograms.items()
+            }
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms,
+            'cache_hit_rate': self.cache_hit_rates(),
+            'audio_seconds_per_second': self.audio_throughput(),
+            'peak_rss_bytes': peak_rss_bytes()
+        }
+
+    def cache_hit_rates(self):
+        totals = {}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                if name != 'cache_requests_total':
+                    continue
+                labels = dict(labels)
+                hits, total = totals.get(labels['cache'], (0, 0))
+                totals[labels['cache']] = (hits + (value if labels['result'] == 'hit' else 0), total + value)
+        return {cache: hits / total for cache, (hits, total) in totals.items() if total}
+
+    def audio_throughput(self):
+        """Audio seconds processed per wall-clock second spent in each stage"""
+        rates = {}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                if name != 'audio_seconds_total':
+                    continue
+                stage = dict(labels)['stage']
+                histogram = self.histograms.get(('stage_seconds', (('stage', stage),)))
+                if histogram and histogram.sum:
+                    rates[stage] = value / histogram.sum
+        return rates
+
+    def to_prometheus(self, prefix='voice_'):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} counter")
+                seen.add(name)
+            lines.append(f"{prefix}{_series(name, labels)} {value}")
+        for (name, labels), value in gauges:
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} gauge")
+                seen.add(name)
+            lines.append(f"{prefix}{_series(name, labels)} {value}")
+        for (name, labels), h in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f"{prefix}{_series(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{prefix}{_series(name + '_bucket', labels + (('le', '+Inf'),))} {h.count}")
+            lines.append(f"{prefix}{_series(name + '_sum', labels)} {h.sum}")
+            lines.append(f"{prefix}{_series(name + '_count', labels)} {h.count}")
+
+        hit_rates = sorted(self.cache_hit_rates().items())
+        if hit_rates:
+            lines.append(f"# TYPE {prefix}cache_hit_ratio gauge")
+        for cache, rate in hit_rates:
+            lines.append(f"{prefix}cache_hit_ratio{{cache=\"{cache}\"}} {rate}")
+        throughput = sorted(self.audio_throughput().items())
+        if throughput:
+            lines.append(f"# TYPE {prefix}audio_seconds_per_second gauge")
+        for stage, rate in throughput:
+            lines.append(f"{prefix}audio_seconds_per_second{{stage=\"{stage}\"}} {rate}")
+        rss = peak_rss_bytes()
+        if rss is not None:
+            lines.append(f"# TYPE {prefix}peak_rss_bytes gauge")
+            lines.append(f"{prefix}peak_rss_bytes {rss}")
+        return '\n'.join(lines) + '\n'
+
+    def take_traces(self):
+        """Remove and return the collected traces"""
+        with self._lock:
+            traces = list(self.traces)
+            self.traces.clear()
+        return traces
+
+    def export_traces(self, path):
+        """Append the collected traces to a JSON lines file and clear them"""
+        traces = self.take_traces()
+        with open(path, 'a', encoding='utf-8') as f:
+            for trace in traces:
+                f.write(json.dumps(trace) + '\n')
+        return len(traces)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.traces.clear()
+
+def _series(name, labels):
+    if not labels:
+        return name
+    rendered = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{name}{{{rendered}}}"
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Process-wide registry used by every module
+METRICS = Metrics()
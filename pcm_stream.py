@@ -0,0 +1,296 @@
+# Live PCM input: ring-buffered stream reader with incremental endpointing
+import argparse
+import socket
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import speech_recognition as sr
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+class RingBuffer:
+    """
+    Fixed-size byte ring addressed by absolute stream position, so old
+    audio is overwritten instead of the buffer growing.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0  # Bytes written since the start of the stream
+        self._data = bytearray(capacity)
+
+    def append(self, data):
+        data = memoryview(data)
+        if len(data) > self.capacity:
+            # Only the newest capacity bytes can survive anyway
+            self.total += len(data) - self.capacity
+            data = data[-self.capacity:]
+        start = self.total % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._data[start:start + first] = data[:first]
+        self._data[:len(data) - first] = data[first:]
+        self.total += len(data)
+
+    def get(self, start, end):
+        """Bytes between absolute positions start and end, if still buffered"""
+        if start < self.total - self.capacity or end > self.total or start > end:
+            raise ValueError(f"bytes {start}-{end} are not in the buffer (have {max(0, self.total - self.capacity)}-{self.total})")
+        start_index = start % self.capacity
+        length = end - start
+        if start_index + length <= self.capacity:
+            return bytes(self._data[start_index:start_index + length])
+        first = self.capacity - start_index
+        return bytes(self._data[start_index:]) + bytes(self._data[:length - first])
+
+class Endpointer:
+    """
+    Frame-by-frame speech start/end detection against an adaptive noise floor.
+
+    A frame is voiced when its level is margin_db above the tracked floor
+    (and above floor_db). Speech starts after min_speech_ms of voiced
+    frames and ends after min_silence_ms without any; utterances are
+    padded by pad_ms and cut at max_utterance_s.
+    """
+    def __init__(self, frame_ms=30, margin_db=10, floor_db=-50, min_speech_ms=150,
+                 min_silence_ms=500, pad_ms=150, max_utterance_s=20):
+        self.margin_db = margin_db
+        self.floor_db = floor_db
+        self.min_speech = max(1, min_speech_ms // frame_ms)
+        self.min_silence = max(1, min_silence_ms // frame_ms)
+        self.pad = min(pad_ms // frame_ms, self.min_silence)
+        self.max_frames = max(self.min_speech, int(max_utterance_s * 1000 // frame_ms))
+        self.noise = None
+        self.frame = 0
+        self.start = None      # First frame of the current utterance
+        self.run_start = None  # First frame of the current voiced run before speech is confirmed
+        self.last_voiced = None
+
+    def push(self, level):
+        """
+        Feed the next frame's level (dBFS). Returns (start, end) frame
+        indices once an utterance ends, otherwise None.
+        """
+        frame = self.frame
+        self.frame += 1
+        if self.noise is None:
+            self.noise = level
+        voiced = level > max(self.noise + self.margin_db, self.floor_db)
+        if not voiced and self.start is None:
+            # Track the floor quickly downwards and slowly upwards, only between utterances
+            self.noise += (level - self.noise) * (0.5 if level < self.noise else 0.02)
+
+        if self.start is None:
+            if not voiced:
+                self.run_start = None
+                return None
+            if self.run_start is None:
+                self.run_start = frame
+            if frame - self.run_start + 1 >= self.min_speech:
+                self.start = max(0, self.run_start - self.pad)
+                self.last_voiced = frame
+                self.run_start = None
+            return None
+
+        if voiced:
+            self.last_voiced = frame
+        if frame - self.last_voiced >= self.min_silence:
+            return self._end(self.last_voiced + 1 + self.pad)
+        if frame + 1 - self.start >= self.max_frames:
+            # Over-long utterance: cut here and keep listening as a new one
+            end = frame + 1
+            utterance = (self.start, end)
+            self.start = end
+            return utterance
+        return None
+
+    def flush(self):
+        """End any utterance still open at the end of the stream"""
+        if self.start is None:
+            return None
+        return self._end(min(self.frame, self.last_voiced + 1 + self.pad))
+
+    def _end(self, end):
+        utterance = (self.start, end)
+        self.start = None
+        self.last_voiced = None
+        return utterance
+
+def read_exact(source, size):
+    data = b''
+    while len(data) < size:
+        chunk = source.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def read_wav_header(source):
+    """
+    Consume a RIFF/WAVE header from a non-seekable stream whose first 4
+    bytes (b'RIFF') were already read, stopping at the start of the
+    sample data. Returns (rate, width, channels).
+    """
+    rest = read_exact(source, 8)
+    if len(rest) < 8 or rest[4:8] != b'WAVE':
+        raise ValueError("stream starts with RIFF but is not a WAVE file")
+    fmt = None
+    while True:
+        head = read_exact(source, 8)
+        if len(head) < 8:
+            raise ValueError("WAV stream has no data chunk")
+        chunk_id, size = struct.unpack('<4sI', head)
+        if chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("WAV stream has data before its fmt chunk")
+            return fmt
+        body = read_exact(source, size + (size & 1))
+        if chunk_id == b'fmt ':
+            tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+            if tag not in (1, 0xFFFE):
+                raise ValueError("only integer PCM WAV streams are supported")
+            fmt = (rate, bits // 8, channels)
+
+class PCMStream:
+    """
+    Reads PCM audio from a file-like source (stdin, a socket file, an open
+    file) and yields one sr.AudioData per utterance as soon as it ends.
+
+    A WAV header at the start of the stream is detected and used;
+    otherwise the audio is raw little-endian PCM in the given format.
+    Audio is converted to 16-bit mono and kept in a ring buffer sized for
+    the longest utterance, so memory stays constant however long the
+    stream runs.
+    """
+    def __init__(self, source, rate=16000, sample_width=2, channels=1, frame_ms=30,
+                 read_frames=10, **endpoint_kwargs):
+        self.source = source
+        self.rate = rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.frame_ms = frame_ms
+        self.read_frames = read_frames
+        self.endpointer = Endpointer(frame_ms=frame_ms, **endpoint_kwargs)
+        self.ring = None
+        self.frame_len = None
+
+    def _open(self):
+        head = read_exact(self.source, 4)
+        if head == b'RIFF':
+            self.rate, self.sample_width, self.channels = read_wav_header(self.source)
+            head = b''
+        if self.sample_width not in (1, 2, 4):
+            raise ValueError(f"unsupported sample width {self.sample_width}")
+        self.frame_len = max(1, int(self.rate * self.frame_ms / 1000))
+        max_frames = self.endpointer.max_frames + self.endpointer.min_silence + 1
+        self.ring = RingBuffer(max_frames * self.frame_len * 2)
+        return head
+
+    def _to_mono16(self, data):
+        """Convert interleaved PCM bytes of the input format to 16-bit mono samples"""
+        if self.sample_width == 1:
+            samples = (np.frombuffer(data, np.uint8).astype(np.int16) - 128) << 8
+        elif self.sample_width == 2:
+            samples = np.frombuffer(data, '<i2')
+        else:
+            samples = (np.frombuffer(data, '<i4') >> 16).astype(np.int16)
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1).astype(np.int16)
+        return samples
+
+    def utterances(self):
+        pending = self._open()
+        in_bytes = self.frame_len * self.sample_width * self.channels
+        frame_bytes = self.frame_len * 2
+        while True:
+            chunk = self.source.read(in_bytes * self.read_frames)
+            if not chunk:
+                break
+            pending += chunk
+            usable = len(pending) - len(pending) % in_bytes
+            if not usable:
+                continue
+            samples = self._to_mono16(pending[:usable])
+            pending = pending[usable:]
+            frames = samples.reshape(-1, self.frame_len).astype(np.float32)
+            # AC level only, so a DC offset in the source can't mask the pauses
+            frames -= frames.mean(axis=1, keepdims=True)
+            rms = np.sqrt(np.mean(frames * frames, axis=1)) / 32768.0
+            levels = 20 * np.log10(np.maximum(rms, 1e-10))
+            for i, level in enumerate(levels):
+                self.ring.append(samples[i * self.frame_len:(i + 1) * self.frame_len].tobytes())
+                utterance = self.endpointer.push(float(level))
+                if utterance:
+                    yield self._audio(utterance, frame_bytes)
+        utterance = self.endpointer.flush()
+        if utterance:
+            yield self._audio(utterance, frame_bytes)
+
+    def _audio(self, utterance, frame_bytes):
+        start, end = utterance
+        audio = sr.AudioData(self.ring.get(start * frame_bytes, end * frame_bytes), self.rate, 2)
+        audio.start_time = start * self.frame_ms / 1000
+        audio.end_time = end * self.frame_ms / 1000
+        return audio
+
+def transcribe_stream(stream, recognize, max_workers=2):
+    """
+    Recognize each utterance of stream while reading continues, yielding
+    (audio, transcript) in stream order. recognize(AudioData) -> str or None.
+    An utterance whose recognition fails (service errors, an open circuit)
+    is reported and yielded with None, so the stream keeps going.
+    """
+    def outcome(audio, future):
+        try:
+            return audio, future.result()
+        except Exception as e:
+            print(f"Recognition failed for {audio.start_time:.2f}s - {audio.end_time:.2f}s: {e}",
+                  file=sys.stderr)
+            return audio, None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = []
+        for audio in stream.utterances():
+            pending.append((audio, executor.submit(recognize, audio)))
+            while pending and pending[0][1].done():
+                yield outcome(*pending.pop(0))
+        for audio, future in pending:
+            yield outcome(audio, future)
+
+def open_source(args):
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        return socket.create_connection((host or '127.0.0.1', int(port))).makefile('rb')
+    if args.listen:
+        server = socket.create_server(('0.0.0.0', args.listen))
+        print(f"Waiting for a PCM stream on port {args.listen}...", file=sys.stderr)
+        connection, _ = server.accept()
+        server.close()
+        return connection.makefile('rb')
+    if args.file:
+        return open(args.file, 'rb')
+    return sys.stdin.buffer
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe live PCM audio utterance by utterance")
+    parser.add_argument('--file', help="read from this file instead of stdin")
+    parser.add_argument('--connect', help="read from a TCP server at [HOST:]PORT")
+    parser.add_argument('--listen', type=int, help="accept one TCP connection on PORT and read from it")
+    parser.add_argument('--rate', type=int, default=16000, help="raw PCM sample rate (WAV headers override)")
+    parser.add_argument('--width', type=int, default=2, help="raw PCM bytes per sample")
+    parser.add_argument('--channels', type=int, default=1, help="raw PCM channels")
+    parser.add_argument('--segments-only', action='store_true', help="print utterance times without recognizing")
+    args = parser.parse_args()
+
+    stream = PCMStream(open_source(args), args.rate, args.width, args.channels)
+    if args.segments_only:
+        for audio in stream.utterances():
+            print(f"{audio.start_time:8.2f}s - {audio.end_time:8.2f}s")
+        return
+
+    from main import RobotVoiceSystem
+    robot = RobotVoiceSystem()
+    for audio, text in transcribe_stream(stream, robot.transcribe):
+        print(f"[{audio.start_time:.2f}s - {audio.end_time:.2f}s] {text or '(unintelligible)'}")
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,110 @@
 import speech_recognition as sr
-import pyttsx3
-import requests
 import json
 import os
-import wave
+import sys
+import threading
 import time
-import librosa
+import tts_cache
+import audio_output
+import llm_client
+import resilience
+import intents
+import streaming_tts
+import segmenter
+import wav_analyzer
+import voices
+from lazy import lazy_import
+from metrics import METRICS
 from dotenv import load_dotenv
 
+pyttsx3 = lazy_import('pyttsx3')
+librosa = lazy_import('librosa')
+
 # Load environment variables (e.g., API keys)
 load_dotenv()
 
 class RobotVoiceSystem:
+    # Recordings longer than this are split at pauses and transcribed in parallel
+    SEGMENT_THRESHOLD_S = 15
+    VOICE_KEYWORD = 'female'
+    VOICE_RATE = 150  # Set to 0.75x speed
+    VOICE_VOLUME = 1
+
     def __init__(self):
         self.recognizer = sr.Recognizer()
-        self.engine = pyttsx3.init()
-        self.setup_voice()
+        # Abandoned (hedged or timed-out) attempts must not hold a worker thread forever
+        self.recognizer.operation_timeout = float(os.getenv('STT_TIMEOUT', 15))
+        self._engine = None  # Started on first use, see the engine property
+        self._voice_id = None
+        # Concurrent TTS requests must not start two engines or drive one from two threads
+        self._engine_lock = threading.RLock()
+        self.tts_pool = None  # Optional tts_pool.TTSPool that renders instead of the local engine
         self.api_key = os.getenv('OPENAI_API_KEY')
+        self.chat = llm_client.ChatClient(
+            self.api_key,
+            cache_ttl=float(os.getenv('LLM_CACHE_TTL', 600))
+        )
+        self.stt_policy = resilience.Resilience(
+            'google_stt',
+            retryable=lambda error: isinstance(error, sr.RequestError),
+            deadline=float(os.getenv('STT_DEADLINE', 10))
+        )
+        self.llm_policy = resilience.Resilience(
+            'openrouter',
+            retryable=llm_client.is_retryable,
+            deadline=float(os.getenv('LLM_DEADLINE', 12))
+        )
+        # Common device commands are answered locally, without a chat round-trip
+        self.intents = intents.IntentMatcher()
+        self.tts_cache = tts_cache.get_default_cache()
+        # What the speakers play (AUDIO_OUTPUT_PROFILE); None keeps the engine's own WAV
+        self.output_profile = audio_output.get_profile()
         
-    def setup_voice(self):
+    @property
+    def engine(self):
+        """pyttsx3 engine, started and configured the first time speech is rendered"""
+        if self._engine is None:
+            with self._engine_lock:
+                if self._engine is None:
+                    engine = pyttsx3.init()
+                    self.setup_voice(engine)
+                    self._engine = engine  # Published only once fully configured
+        return self._engine
+
+    @property
+    def voice_id(self):
+        """Selected voice (None for the default), known without starting the engine once cached"""
+        if self._engine is None:
+            voice_id = voices.cached_voice_id(self.VOICE_KEYWORD)
+            if voice_id is not voices.UNRESOLVED:
+                return voice_id
+        self.engine  # Starting the engine resolves the voice
+        return self._voice_id
+
+    def setup_voice(self, engine):
         """Configure voice settings for a more robotic response"""
-        voices = self.engine.getProperty('voices')
-        for voice in voices:
-            if "female" in voice.name.lower():
-                self.engine.setProperty('voice', voice.id)
-                break
-        self.engine.setProperty('rate', 150)  # Set to 0.75x speed
-        self.engine.setProperty('volume', 1)
+        self._voice_id = voices.resolve_voice_id(engine, self.VOICE_KEYWORD)
+        engine.setProperty('rate', self.VOICE_RATE)
+        engine.setProperty('volume', self.VOICE_VOLUME)
 
+    @METRICS.timed('stt')
     def process_audio(self, input_wav):
         """Convert input WAV to text with noise reduction and error handling"""
         try:
-            y, sr = librosa.load(input_wav, sr=None)
-            librosa.output.write_wav("temp.wav", y, sr)
+            y, rate = librosa.load(input_wav, sr=None)
+            librosa.output.write_wav("temp.wav", y, rate)
             with sr.AudioFile("temp.wav") as source:
                 self.recognizer.adjust_for_ambient_noise(source)
                 print("Processing audio...")
                 audio = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio)
+                duration = len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+                METRICS.record_audio(duration, 'stt')
+                if duration > self.SEGMENT_THRESHOLD_S:
+                    text = segmenter.transcribe_segments(audio, self.recognize_reliably, retries=0)
+                else:
+                    text = segmenter.recognize_with_retry(self.recognize_reliably, audio, retries=0)
+                if not text:
+                    raise sr.UnknownValueError()
                 print(f"Transcribed text: {text}")
                 return text
         except sr.UnknownValueError:
@@ -48,66 +115,117 @@ class RobotVoiceSystem:
             print(f"Audio processing error: {e}")
         return None
 
+    SYSTEM_PROMPT = "You are a futuristic robot assistant. Keep responses under 50 words."
+
+    @METRICS.timed('llm')
     def get_ai_response(self, text):
-        """Get AI-generated response with enhanced error handling"""
+        """
+        Get AI-generated response with enhanced error handling. Each run
+        answers a single recording, so unlike main.py no conversation
+        history is kept and every request is self-contained (and cacheable).
+        """
+        match = self.intents.match(text)
+        if match:
+            print(f"AI Response (local intent {match['intent']}): {match['reply']}")
+            return match['reply']
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "system", "content": "You are a futuristic robot assistant. Keep responses under 50 words."},
-                    {"role": "user", "content": text}
-                ]
-            }
-            response = requests.post(
-                'https://openrouter.ai/api/v1/chat/completions',
-                headers=headers,
-                json=payload
-            )
-            if response.status_code == 200:
-                ai_response = response.json()['choices'][0]['message']['content']
-                print(f"AI Response: {ai_response}")
-                return ai_response
-            else:
-                print("Error from API. Using fallback response.")
+            ai_response = self.llm_policy.call(self.chat.complete, text, system_prompt=self.SYSTEM_PROMPT)
+            print(f"AI Response: {ai_response}")
+            return ai_response
+        except (llm_client.ChatError, resilience.ResilienceError):
+            print("Error from API. Using fallback response.")
         except Exception as e:
             print(f"API error: {e}")
         return "I'm sorry, I cannot process your request at the moment."
 
+    @METRICS.timed('tts')
     def create_audio_response(self, text, output_wav):
         """Convert text to WAV with AI-like speech"""
         try:
-            self.engine.save_to_file(text, output_wav)
-            self.engine.runAndWait()
+            key = self.tts_cache.key(
+                text, 'pyttsx3',
+                voice=self.voice_id,
+                rate=self.VOICE_RATE,
+                volume=self.VOICE_VOLUME,
+                output=self.output_profile.name if self.output_profile else 'original'
+            )
+            if not self.tts_cache.synthesize(key, 'wav', output_wav, lambda path: self._render_output(text, path)):
+                raise RuntimeError("TTS engine produced no audio")
             print(f"Audio response saved to {output_wav}")
             return True
         except Exception as e:
             print(f"Speech generation error: {e}")
             return False
 
+    def stream_response(self, text, output_wav):
+        """Stream the AI reply and speak each sentence as soon as it arrives"""
+        started = time.perf_counter()
+        match = self.intents.match(text)
+        try:
+            if match:
+                # Nothing to stream: the whole reply is known already
+                if not self.create_audio_response(match['reply'], output_wav):
+                    return None
+                elapsed = time.perf_counter() - started
+                result = {'text': match['reply'], 'sentences': 1,
+                          'time_to_first_audio': elapsed, 'total_time': elapsed}
+            else:
+                # Spoken sentences can't be taken back, so streaming is only breaker-guarded
+                with self.llm_policy.guarded():
+                    pieces = self.chat.stream(text, system_prompt=self.SYSTEM_PROMPT)
+                    result = streaming_tts.stream_to_wav(pieces, self.create_audio_response, output_wav, started)
+                if not result['sentences']:
+                    # Nothing was spoken, so there is no WAV either: use the fallback
+                    raise ValueError("streamed reply contained no speech")
+            print(f"AI Response: {result['text']}")
+        except Exception as e:
+            print(f"Streaming error: {e}. Using fallback response.")
+            response = "I'm sorry, I cannot process your request at the moment."
+            if not self.create_audio_response(response, output_wav):
+                return None
+            result = {'text': response, 'sentences': 1,
+                      'time_to_first_audio': time.perf_counter() - started,
+                      'total_time': time.perf_counter() - started}
+        print(f"Time to first audio: {result['time_to_first_audio']:.2f}s "
+              f"({result['sentences']} sentences in {result['total_time']:.2f}s)")
+        return result
+
+    def recognize_reliably(self, audio):
+        """recognize() under the STT resilience policy, giving up as sr.RequestError"""
+        try:
+            return self.stt_policy.call(self.recognize, audio)
+        except resilience.ResilienceError as e:
+            raise sr.RequestError(str(e)) from e
+
+    def recognize(self, audio):
+        """Single recognize_google call, counted as a remote call"""
+        METRICS.record_remote_call('google_stt', sent=len(audio.frame_data))
+        return self.recognizer.recognize_google(audio)
+
+    def _render_output(self, text, path):
+        """Render text to path, then trim and encode it for the speakers"""
+        self._render(text, path)
+        if self.output_profile is not None and os.path.getsize(path):
+            print(audio_output.format_saving(audio_output.convert(path, profile=self.output_profile)))
+
+    def _render(self, text, path):
+        if self.tts_pool is not None:
+            self.tts_pool.render(text, path)
+            return
+        with self._engine_lock:
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+
+    @METRICS.timed('analyze')
     def analyze_wav(self, wav_file):
-        """Analyze WAV file properties"""
+        """Analyze WAV file properties and signal levels, returning a dict (None on failure)"""
         try:
-            with wave.open(wav_file, 'rb') as audio:
-                channels = audio.getnchannels()
-                sample_width = audio.getsampwidth()
-                frame_rate = audio.getframerate()
-                num_frames = audio.getnframes()
-                duration = num_frames / frame_rate
-
-                print("\nWAV File Analysis:")
-                print(f"- Channels: {'Mono' if channels == 1 else 'Stereo'}")
-                print(f"- Sample Rate: {frame_rate} Hz")
-                print(f"- Sample Width: {sample_width * 8} bits ({sample_width} bytes)")
-                print(f"- Duration: {duration:.2f} seconds")
-                print(f"- Total Frames: {num_frames}")
+            return wav_analyzer.analyze(wav_file)
         except Exception as e:
             print(f"Error analyzing WAV file: {e}")
+            return None
 
-    def run(self, input_wav="AUDIO.wav", output_wav="output.wav"):
+    def run(self, input_wav="AUDIO.wav", output_wav="output.wav", stream=False):
         """Main processing function"""
         if not os.path.exists(input_wav):
             print("Input WAV file not found.")
@@ -117,14 +235,22 @@ class RobotVoiceSystem:
         if not text:
             return
         
-        response = self.get_ai_response(text)
-        success = self.create_audio_response(response, output_wav)
+        if stream:
+            success = self.stream_response(text, output_wav) is not None
+        else:
+            response = self.get_ai_response(text)
+            success = self.create_audio_response(response, output_wav)
         
         if success:
-            self.analyze_wav(output_wav)
+            analysis = self.analyze_wav(output_wav)
+            if analysis:
+                print(wav_analyzer.format_report(analysis))
         else:
             print("Failed to generate voice response.")
 
 if __name__ == "__main__":
     robot = RobotVoiceSystem()
-    robot.run()
+    with METRICS.trace(input="AUDIO.wav"):
+        robot.run(stream="--stream" in sys.argv)
+    if METRICS.tracing:
+        METRICS.export_traces("traces.jsonl")
@@ -0,0 +1,246 @@
+# Deadlines, retries, hedged requests and circuit breaking for remote STT/LLM calls
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from metrics import METRICS
+
+class ResilienceError(Exception):
+    """Base class for calls given up on by a resilience policy"""
+
+class CircuitOpenError(ResilienceError):
+    """Raised without calling the backend while its circuit breaker is open"""
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit is open, retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+class DeadlineExceeded(ResilienceError):
+    """Raised when no attempt succeeded before the call's deadline"""
+
+class LatencyTracker:
+    """Rolling window of successful call latencies"""
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failures; open
+    rejects calls for reset_timeout seconds, then half-open lets one
+    probe through, which closes the circuit on success or reopens it.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go to the backend now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_in(self):
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        METRICS.inc('circuit_transitions_total', service=self.name, state=state)
+        METRICS.set_gauge('circuit_open', 0 if state == self.CLOSED else 1, service=self.name)
+
+class Resilience:
+    """
+    Policy wrapped around one remote backend.
+
+    call(func, *args) runs func under an overall deadline. Failed attempts
+    for which retryable(error) is true are retried with jittered
+    exponential backoff while time remains; other errors are raised at
+    once (the backend answered, so they count as success for the
+    breaker). If an attempt is still running after the hedge quantile
+    (p95 by default) of recent latencies, one duplicate request is sent
+    and whichever finishes first wins. While the circuit breaker is open
+    calls fail immediately with CircuitOpenError.
+
+    Only use hedging for idempotent calls; deadline=None, retries=0,
+    hedge=False and breaker=None each switch that part off.
+    """
+    def __init__(self, name, retryable=None, deadline=10.0, retries=2, backoff=0.25, max_backoff=2.0,
+                 hedge=True, hedge_quantile=95, min_hedge_delay=0.05, initial_hedge_delay=2.0,
+                 min_samples=20, breaker=True, max_workers=8):
+        self.name = name
+        self.retryable = retryable or (lambda error: True)
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(name) if breaker is True else breaker or None
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # Attempts run on worker threads so a slow one can be hedged or abandoned at the deadline
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=f"{self.name}-call")
+            return self._executor
+
+    def hedge_delay(self):
+        """Seconds to wait for an attempt before sending its duplicate"""
+        if len(self.latency) < self.min_samples:
+            return self.initial_hedge_delay
+        return max(self.min_hedge_delay, self.latency.percentile(self.hedge_quantile))
+
+    def call(self, func, *args, deadline=None, **kwargs):
+        deadline = self.deadline if deadline is None else deadline
+        ends = time.monotonic() + deadline if deadline else None
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if self.breaker is not None and not self.breaker.allow():
+                METRICS.inc('circuit_rejections_total', service=self.name)
+                raise CircuitOpenError(self.name, self.breaker.retry_in()) from last_error
+            if attempt:
+                METRICS.inc('retries_total', service=self.name)
+            try:
+                result = self._attempt(func, args, kwargs, ends)
+            except DeadlineExceeded as e:
+                self._failed()
+                raise e from last_error
+            except Exception as e:
+                if not self.retryable(e):
+                    self._succeeded()
+                    raise
+                self._failed()
+                last_error = e
+                if attempt == self.retries:
+                    break
+                pause = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if ends is not None and time.monotonic() + pause >= ends:
+                    raise DeadlineExceeded(f"{self.name}: no time left to retry after {e}") from e
+                time.sleep(pause)
+                continue
+            self._succeeded()
+            return result
+        raise last_error
+
+    @contextmanager
+    def guarded(self):
+        """
+        Breaker bookkeeping only, for calls that can't be retried or
+        hedged (e.g. a streamed reply that is already being spoken).
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            METRICS.inc('circuit_rejections_total', service=self.name)
+            raise CircuitOpenError(self.name, self.breaker.retry_in())
+        try:
+            yield
+        except Exception as e:
+            if self.retryable(e):
+                self._failed()
+            else:
+                self._succeeded()
+            raise
+        self._succeeded()
+
+    def _attempt(self, func, args, kwargs, ends):
+        """Run func once, plus one hedged duplicate if it is slow; first success wins"""
+        run = METRICS.wrap(func)
+        started = {}
+
+        def submit():
+            future = self.executor.submit(run, *args, **kwargs)
+            started[future] = time.monotonic()
+            return future
+
+        primary = submit()
+        pending = {primary}
+        hedge_at = started[primary] + self.hedge_delay() if self.hedge else None
+        error = None
+        while pending:
+            now = time.monotonic()
+            if ends is not None and now >= ends:
+                raise DeadlineExceeded(f"{self.name}: no answer within the deadline")
+            wake_at = [at for at in (ends, hedge_at) if at is not None]
+            timeout = max(0.0, min(wake_at) - now) if wake_at else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # Per-request latency, so hedging doesn't hide the backend's own tail
+                    self.latency.add(time.monotonic() - started[future])
+                    if future is not primary:
+                        METRICS.inc('hedge_wins_total', service=self.name)
+                    return future.result()
+                error = error or future.exception()
+            if pending and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                METRICS.inc('hedged_requests_total', service=self.name)
+                pending.add(submit())
+        raise error
+
+    def _succeeded(self):
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def _failed(self):
+        if self.breaker is not None:
+            self.breaker.record_failure()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,141 @@
+# Energy-based speech segmentation and parallel per-segment transcription
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import speech_recognition as sr
+from metrics import METRICS
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def pcm_samples(audio):
+    """Return the AudioData samples as a 16-bit numpy array"""
+    return np.frombuffer(audio.get_raw_data(convert_width=2), dtype=np.int16)
+
+def frame_levels(samples, rate, frame_ms=30):
+    """AC RMS level in dBFS of each frame_ms frame (each frame's mean is removed first)"""
+    frame_len = max(1, int(rate * frame_ms / 1000))
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[:n_frames * frame_len].astype(np.float32).reshape(n_frames, frame_len)
+    # A DC offset in the recording would otherwise lift every pause above the threshold
+    frames -= frames.mean(axis=1, keepdims=True)
+    rms = np.sqrt(np.mean(frames * frames, axis=1)) / 32768.0
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def find_speech_regions(samples, rate, frame_ms=30, min_speech_ms=250, min_silence_ms=400,
+                        pad_ms=150, max_segment_s=30, margin_db=10, floor_db=-50):
+    """
+    Find (start, end) sample ranges that contain speech.
+
+    A frame counts as speech when it is margin_db above the estimated noise
+    floor (10th percentile level), or within margin_db of the loudest frame
+    for recordings with no pauses at all, and never below floor_db.
+    Gaps shorter than min_silence_ms are bridged, regions are padded by
+    pad_ms, and anything longer than max_segment_s is split at its
+    quietest frame.
+    """
+    levels = frame_levels(samples, rate, frame_ms)
+    if len(levels) == 0:
+        return []
+    threshold = min(np.percentile(levels, 10) + margin_db, np.max(levels) - margin_db)
+    threshold = max(threshold, floor_db)
+    voiced = levels > threshold
+
+    frame_len = max(1, int(rate * frame_ms / 1000))
+    min_silence = max(1, min_silence_ms // frame_ms)
+    min_speech = max(1, min_speech_ms // frame_ms)
+    pad = pad_ms // frame_ms
+    max_frames = max(min_speech, int(max_segment_s * 1000 // frame_ms))
+
+    # Collect voiced runs, bridging short pauses
+    regions = []
+    start = None
+    silence = 0
+    for i, is_voiced in enumerate(voiced):
+        if is_voiced:
+            if start is None:
+                start = i
+            silence = 0
+        elif start is not None:
+            silence += 1
+            if silence >= min_silence:
+                regions.append([start, i - silence + 1])
+                start = None
+                silence = 0
+    if start is not None:
+        regions.append([start, len(voiced) - silence])
+
+    result = []
+    for start, end in regions:
+        if end - start < min_speech:
+            continue
+        start = max(0, start - pad)
+        end = min(len(levels), end + pad)
+        # Split over-long regions at the quietest frame of their second half
+        while end - start > max_frames:
+            window = levels[start + max_frames // 2:start + max_frames]
+            cut = start + max_frames // 2 + int(np.argmin(window))
+            result.append((start, cut))
+            start = cut
+        result.append((start, end))
+
+    # Merge padded regions that now overlap and convert frames to samples
+    merged = []
+    for start, end in result:
+        if merged and start <= merged[-1][1] and end - merged[-1][0] <= max_frames:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return [(start * frame_len, min(len(samples), end * frame_len)) for start, end in merged]
+
+def split_audio(audio, **region_kwargs):
+    """Split AudioData into one 16-bit AudioData per speech region"""
+    samples = pcm_samples(audio)
+    regions = find_speech_regions(samples, audio.sample_rate, **region_kwargs)
+    return [sr.AudioData(samples[start:end].tobytes(), audio.sample_rate, 2) for start, end in regions]
+
+def recognize_with_retry(recognize, audio, retries=2, backoff=0.5):
+    """Call recognize(audio), retrying service errors with jittered backoff"""
+    for attempt in range(retries + 1):
+        try:
+            return recognize(audio)
+        except sr.UnknownValueError:
+            return None
+        except sr.RequestError:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def transcribe_segments(audio, recognize, max_workers=4, retries=2, backoff=0.5, **region_kwargs):
+    """
+    Transcribe AudioData segment by segment and stitch the text in order.
+
+    recognize: callable(AudioData) -> str, e.g. recognizer.recognize_google
+    Each segment is retried on its own; segments that still fail are
+    skipped. Returns None when no segment produced text, unless some
+    segment failed: then the last sr.RequestError is raised, so an outage
+    isn't mistaken for silence.
+    """
+    segments = split_audio(audio, **region_kwargs)
+    if not segments:
+        return None
+    errors = []
+
+    def run(segment):
+        try:
+            with METRICS.stage('stt_segment'):
+                return recognize_with_retry(recognize, segment, retries, backoff)
+        except sr.RequestError as e:
+            print(f"Segment failed after {retries + 1} attempts: {e}")
+            errors.append(e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        texts = list(executor.map(METRICS.wrap(run), segments))
+
+    texts = [text for text in texts if text]
+    if not texts and errors:
+        raise errors[-1]
+    return ' '.join(texts) if texts else None
@@ -0,0 +1,135 @@
+# Incremental text-to-speech: speak a streamed reply sentence by sentence
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+import audio_output
+import wav_analyzer
+
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+def split_sentences(pieces):
+    """Regroup streamed text pieces into complete sentences"""
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        while True:
+            match = SENTENCE_END.search(buffer)
+            if not match:
+                break
+            sentence = buffer[:match.end()].strip()
+            buffer = buffer[match.end():]
+            if sentence:
+                yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
+class ProgressiveWavWriter:
+    """
+    WAV writer that keeps the header valid after every append, so players
+    can open the file while later chunks are still being written. Chunks
+    may be any format wav_analyzer reads (PCM, float, mu-law) as long as
+    they all match.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.params = None
+        self.chunks = 0
+        self.data_size = 0
+        self._file = None
+
+    def append(self, wav_file):
+        """Append the frames of another WAV file with matching format"""
+        header = wav_analyzer.read_header(wav_file)
+        params = (header['format'], header['bits_per_sample'], header['sample_rate'], header['channels'])
+        with open(wav_file, 'rb') as chunk:
+            chunk.seek(header['data_offset'])
+            frames = chunk.read(header['data_size'])
+        if self._file is None:
+            self.params = params
+            # path may be a read-only hardlink into the TTS cache: replace it, never write through it
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self._file = open(self.path, 'wb')
+            self._file.write(audio_output.wav_header(*params, 0))
+        elif params != self.params:
+            raise ValueError(f"Chunk format {params} does not match {self.params}")
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(frames)
+        self.data_size += len(frames)
+        # Same format, so the patched header is the same length
+        self._file.seek(0)
+        self._file.write(audio_output.wav_header(*self.params, self.data_size))
+        self._file.flush()
+        self.chunks += 1
+
+    def close(self):
+        if self._file is not None:
+            if self.data_size & 1:
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(b'\0')  # RIFF chunks are word-aligned
+            self._file.close()
+            self._file = None
+
+def stream_to_wav(pieces, synthesize, output_wav, started=None, on_chunk=None):
+    """
+    Speak streamed text into output_wav one sentence at a time.
+
+    pieces: iterable of text fragments (e.g. ChatClient.stream)
+    synthesize: callable(sentence, wav_path) -> bool rendering one sentence
+    started: perf_counter() timestamp the time-to-first-audio is measured from
+    on_chunk: optional callable(index, wav_path) for pushing chunks elsewhere
+
+    Text is read on a background thread so the network keeps flowing while
+    the calling thread (which owns the TTS engine) synthesizes.
+    """
+    started = time.perf_counter() if started is None else started
+    sentences = queue.Queue()
+    failure = []
+
+    def produce():
+        try:
+            for sentence in split_sentences(pieces):
+                sentences.put(sentence)
+        except Exception as e:
+            failure.append(e)
+        finally:
+            sentences.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    writer = ProgressiveWavWriter(output_wav)
+    workdir = tempfile.mkdtemp(prefix='tts_stream_')
+    spoken = []
+    first_audio = None
+    try:
+        while True:
+            sentence = sentences.get()
+            if sentence is None:
+                break
+            chunk_path = os.path.join(workdir, f"chunk_{len(spoken)}.wav")
+            if not synthesize(sentence, chunk_path):
+                raise RuntimeError(f"Could not synthesize: {sentence!r}")
+            writer.append(chunk_path)
+            if first_audio is None:
+                first_audio = time.perf_counter() - started
+            if on_chunk:
+                on_chunk(len(spoken), chunk_path)
+            spoken.append(sentence)
+    finally:
+        writer.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failure:
+        raise failure[0]
+    return {
+        'text': ' '.join(spoken),
+        'sentences': len(spoken),
+        'time_to_first_audio': first_audio,
+        'total_time': time.perf_counter() - started
+    }
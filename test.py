@@ -1,23 +1,40 @@
 from gtts import gTTS
 import os
+import tempfile
 import playsound
+import tts_cache
+import audio_output
 
 class FemaleVoiceTTS:
     def __init__(self, language='en', slow=False):
         """Initialize the TTS system with language and speed."""
         self.language = language
         self.slow = slow  # Set to True if you want a slower speech rate
+        self.tts_cache = tts_cache.get_default_cache()
+        # gTTS returns MP3, so it is always decoded into a real WAV
+        self.output_profile = audio_output.get_profile() or audio_output.PROFILES['pcm16_16k']
 
     def create_audio(self, text, output_file='output.wav'):
         """Convert text to speech and save as WAV file."""
         try:
-            tts = gTTS(text=text, lang=self.language, slow=self.slow)
-            tts.save(output_file)
+            key = self.tts_cache.key(text, 'gtts', rate='slow' if self.slow else 'normal',
+                                     language=self.language, output=self.output_profile.name)
+            self.tts_cache.synthesize(key, 'wav', output_file, lambda path: self._render(text, path))
             print(f"Audio saved to {output_file}. Playing audio...")
             playsound.playsound(output_file)
         except Exception as e:
             print(f"Error generating audio: {e}")
 
+    def _render(self, text, path):
+        """Fetch the MP3 from gTTS and convert it to the output WAV at path"""
+        fd, mp3_path = tempfile.mkstemp(suffix='.mp3')
+        os.close(fd)
+        try:
+            gTTS(text=text, lang=self.language, slow=self.slow).save(mp3_path)
+            print(audio_output.format_saving(audio_output.convert(mp3_path, path, self.output_profile)))
+        finally:
+            os.remove(mp3_path)
+
 if __name__ == "__main__":
     tts_system = FemaleVoiceTTS(language='en')  # 'en' for English (US female-like voice)
     text_to_convert = "Hello! Ishan you are my creator."
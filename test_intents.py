@@ -0,0 +1,42 @@
+# Tests for the local intent fast path (run with: python -m pytest test_intents.py)
+import pytest
+import intents
+
+@pytest.fixture(scope='module')
+def matcher():
+    return intents.IntentMatcher()
+
+def test_normalize_command_expands_contractions_and_drops_filler():
+    assert intents.normalize_command("Please, can you turn ON the light?") == "turn on the light"
+    assert intents.normalize_command("Don't turn it off") == "do not turn it off"
+    assert intents.normalize_command("doesn’t work") == "does not work"
+    assert intents.normalize_command("won't stop") == "will not stop"
+
+@pytest.mark.parametrize('text, intent', [
+    ("turn on the light", 'light_on'),
+    ("turn the lights on please", 'light_on'),
+    ("turn off the light", 'light_off'),
+    ("switch the lights off", 'light_off'),
+    ("please turn off the fan", 'fan_off'),
+    ("never mind", 'stop')
+])
+def test_matches_on_and_off_commands(matcher, text, intent):
+    result = matcher.match(text)
+    assert result is not None and result['intent'] == intent
+
+@pytest.mark.parametrize('text', [
+    "do not turn on the light",
+    "don't turn off the lights",
+    "never turn on the fan",
+    "no lights on",
+    "it doesn't turn on the light"
+])
+def test_negated_commands_go_to_the_llm(matcher, text):
+    assert matcher.match(text) is None
+
+def test_unrelated_requests_go_to_the_llm(matcher):
+    assert matcher.match("tell me a story about dragons") is None
+
+def test_time_reply_carries_its_ttl(matcher):
+    result = matcher.match("what time is it")
+    assert result['intent'] == 'time' and result['ttl'] == 30
@@ -0,0 +1,52 @@
+# Tests for replaying whole utterances (run with: python -m pytest test_utterance_cache.py)
+import wave
+import numpy as np
+import pytest
+import fake_services
+import utterance_cache
+from main import RobotVoiceSystem
+
+def write_wav(path, samples, rate=16000):
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+def spoken_clip(seconds=1.5, rate=16000):
+    """Harmonics gated at syllable rate, so the clip has a fingerprint"""
+    t = np.arange(int(seconds * rate)) / rate
+    voice = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 6))
+    return np.int16(voice * np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * 8000)
+
+@pytest.fixture
+def robot(tmp_path):
+    robot = RobotVoiceSystem()
+    robot.chat.cache = None
+    robot.utterances = utterance_cache.UtteranceCache(str(tmp_path / 'utterances'))
+
+    def speak(text, output_wav):
+        write_wav(output_wav, spoken_clip(0.5))
+        return True
+    robot.create_audio_response = speak
+    return robot
+
+def respond_twice(robot, tmp_path, transcript):
+    clip = tmp_path / 'clip.wav'
+    write_wav(clip, spoken_clip())
+    with fake_services.FakeServices(transcript=transcript, reply="Reply {n}") as services, \
+            fake_services.redirect(services.base_url):
+        replies = [robot.respond(str(clip), str(tmp_path / 'out.wav'), session_id=None) for _ in range(2)]
+    return replies, services.requests
+
+def test_resent_clip_is_replayed(robot, tmp_path):
+    replies, requests = respond_twice(robot, tmp_path, "tell me a joke")
+    assert replies[0] == replies[1]
+    assert requests['stt'] == 1 and requests['llm'] == 1
+    assert robot.utterances.stats['hits'] == 1
+
+def test_time_sensitive_reply_is_never_replayed(robot, tmp_path):
+    replies, requests = respond_twice(robot, tmp_path, "what's the weather today")
+    assert replies[0] != replies[1]
+    assert requests['stt'] == 2 and requests['llm'] == 2
+    assert robot.utterances.stats['hits'] == 0 and len(robot.utterances) == 0
@@ -0,0 +1,103 @@
+# Single-pass text normalizer for the TTS front-end
+import functools
+import re
+
+# One alternation, tried left to right at each position, so every token is
+# rewritten in a single scan of the text.
+TOKEN_PATTERN = re.compile(r'''
+    (?P<currency>[$£€])(?P<amount>\d{1,3}(?:,\d{3})+|\d+)(?:\.(?P<cents>\d{1,2}))?\b
+  | \b(?P<ordinal>\d+)(?:st|nd|rd|th)\b
+  | \b(?P<decimal>\d+\.\d+)\b(?P<decimal_percent>%)?
+  | \b(?P<grouped>\d{1,3}(?:,\d{3})+)\b
+  | \b(?P<year>(?:19|20)\d{2})\b
+  | \b(?P<integer>\d+)\b(?P<percent>%)?
+  | (?P<comma>,)
+''', re.VERBOSE)
+
+CURRENCIES = {
+    '$': ('dollar', 'dollars', 'cent', 'cents'),
+    '£': ('pound', 'pounds', 'penny', 'pence'),
+    '€': ('euro', 'euros', 'cent', 'cents')
+}
+
+_inflect_engine = None
+
+def _engine():
+    global _inflect_engine
+    if _inflect_engine is None:
+        import inflect
+        _inflect_engine = inflect.engine()
+    return _inflect_engine
+
+@functools.lru_cache(maxsize=4096)
+def number_words(number):
+    """Verbalize a number given as a digit string (memoized)"""
+    return _engine().number_to_words(number)
+
+@functools.lru_cache(maxsize=1024)
+def ordinal_words(number):
+    return _engine().number_to_words(_engine().ordinal(int(number)))
+
+@functools.lru_cache(maxsize=1024)
+def year_words(year):
+    """Read a year the way it is spoken: 1999 -> nineteen ninety-nine"""
+    century, rest = year[:2], year[2:]
+    if year.startswith('20') and int(rest) < 10:
+        return number_words(year)  # two thousand (and five)
+    if rest == '00':
+        return f"{number_words(century)} hundred"
+    if rest.startswith('0'):
+        return f"{number_words(century)} oh {number_words(rest[1])}"
+    return f"{number_words(century)} {number_words(rest)}"
+
+def currency_words(symbol, amount, cents):
+    one, many, cent_one, cent_many = CURRENCIES[symbol]
+    amount = amount.replace(',', '')
+    words = f"{number_words(amount)} {one if amount == '1' else many}"
+    if cents and int(cents):
+        cents = cents.ljust(2, '0')
+        words += f" and {number_words(str(int(cents)))} {cent_one if int(cents) == 1 else cent_many}"
+    return words
+
+class TextNormalizer:
+    def __init__(self, speech_patterns=True):
+        """speech_patterns: also rewrite commas into spoken pauses"""
+        self.speech_patterns = speech_patterns
+
+    def _replace(self, match):
+        kind = match.lastgroup
+        if kind == 'comma':
+            return '...' if self.speech_patterns else ','
+        if kind in ('amount', 'cents'):
+            return currency_words(match.group('currency'), match.group('amount'), match.group('cents'))
+        if kind == 'ordinal':
+            return ordinal_words(match.group('ordinal'))
+        if kind in ('decimal', 'decimal_percent'):
+            words = number_words(match.group('decimal'))
+            return f"{words} percent" if match.group('decimal_percent') else words
+        if kind == 'grouped':
+            return number_words(match.group('grouped').replace(',', ''))
+        if kind == 'year':
+            return year_words(match.group('year'))
+        words = number_words(match.group('integer'))
+        return f"{words} percent" if match.group('percent') else words
+
+    def normalize(self, text):
+        """Rewrite numbers, years, decimals, ordinals, currency and punctuation in one pass"""
+        return TOKEN_PATTERN.sub(self._replace, text)
+
+    def normalize_lines(self, lines):
+        """Normalize an iterable of lines lazily, one line in memory at a time"""
+        for line in lines:
+            yield self.normalize(line)
+
+    def normalize_file(self, source, destination, encoding='utf-8'):
+        """Stream-normalize a text file line by line in constant memory"""
+        with open(source, 'r', encoding=encoding) as src, open(destination, 'w', encoding=encoding) as dst:
+            for line in self.normalize_lines(src):
+                dst.write(line)
+
+_default = TextNormalizer()
+
+def normalize(text):
+    return _default.normalize(text)
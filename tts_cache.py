@@ -0,0 +1,191 @@
+# Content-addressed on-disk cache for synthesized speech, shared by all TTS engines
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unicodedata
+from metrics import METRICS
+
+DEFAULT_CACHE_DIR = os.getenv('TTS_CACHE_DIR', '.tts_cache')
+DEFAULT_MAX_BYTES = int(os.getenv('TTS_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+def normalize_text(text):
+    """Normalize text so trivially different strings share a cache entry"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return ' '.join(text.split())
+
+class SynthesisCache:
+    """
+    Stores one file per (text, engine, voice, rate, language, format) key.
+
+    Entries are written atomically and kept read-only so they can be served
+    by hardlink; the least recently used entries are evicted once the cache
+    grows past max_bytes.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, text, engine, voice=None, rate=None, language=None, fmt='wav', **options):
+        """Build the cache key for a synthesis request"""
+        parts = [normalize_text(text), engine, voice, rate, language, fmt, sorted(options.items())]
+        return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+    def path_for(self, key, fmt='wav'):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def fetch(self, key, fmt, output_file):
+        """Serve a cached entry into output_file, returning False on a miss"""
+        path = self.path_for(key, fmt)
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            self.stats['misses'] += 1
+            METRICS.record_cache('tts', False)
+            return False
+        _remove(output_file)
+        try:
+            os.link(path, output_file)
+        except OSError:
+            shutil.copyfile(path, output_file)
+        self.stats['hits'] += 1
+        METRICS.record_cache('tts', True)
+        return True
+
+    def get_bytes(self, key, fmt):
+        """Return the cached payload, or None on a miss"""
+        path = self.path_for(key, fmt)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.stats['misses'] += 1
+            METRICS.record_cache('tts', False)
+            return None
+        self.stats['hits'] += 1
+        METRICS.record_cache('tts', True)
+        return data
+
+    def open_entry(self, key, fmt):
+        """Open a cached entry for reading (marking it recently used), or None on a miss"""
+        path = self.path_for(key, fmt)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.stats['misses'] += 1
+            METRICS.record_cache('tts', False)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # Evicted meanwhile; the open handle still reads it
+        self.stats['hits'] += 1
+        METRICS.record_cache('tts', True)
+        return f
+
+    def store(self, key, fmt, source_file):
+        """Atomically copy source_file into the cache"""
+        def write(tmp):
+            shutil.copyfile(source_file, tmp)
+        return self._commit(key, fmt, write)
+
+    def put_bytes(self, key, fmt, data):
+        """Atomically write a payload into the cache"""
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(data)
+        return self._commit(key, fmt, write)
+
+    def synthesize(self, key, fmt, output_file, render):
+        """
+        Serve output_file from the cache, calling render(path) to
+        synthesize into a temporary path on a miss.
+        """
+        if self.fetch(key, fmt, output_file):
+            return True
+        path = self._commit(key, fmt, render)
+        if path is None:
+            return False
+        _remove(output_file)
+        try:
+            os.link(path, output_file)
+        except OSError:
+            shutil.copyfile(path, output_file)
+        return True
+
+    def _commit(self, key, fmt, write):
+        path = self.path_for(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            self._current_size()  # Scan existing entries before adding this one
+        fd, tmp = tempfile.mkstemp(suffix=f".{fmt}", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            write(tmp)
+            if os.path.getsize(tmp) == 0:
+                return None
+            os.chmod(tmp, 0o444)
+            size = os.path.getsize(tmp)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+        finally:
+            _remove(tmp)
+        with self._lock:
+            self._size += size - replaced
+        self.evict(keep=path)
+        return path
+
+    def _current_size(self):
+        if self._size is None:
+            self._size = sum(os.path.getsize(p) for p, _ in self._entries())
+        return self._size
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.startswith('tmp'):
+                    continue  # Entry still being written
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path).st_mtime
+                except OSError:
+                    continue
+
+    def evict(self, keep=None):
+        """Drop least recently used entries (except keep) until the cache fits max_bytes"""
+        with self._lock:
+            if self._current_size() <= self.max_bytes:
+                return
+            for path, _ in sorted(self._entries(), key=lambda entry: entry[1]):
+                if self._size <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._size -= size
+                self.stats['evictions'] += 1
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+_default_cache = None
+
+def get_default_cache():
+    """Return the process-wide cache shared by every engine"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SynthesisCache()
+    return _default_cache
@@ -0,0 +1,140 @@
+# Process pool of pyttsx3 engines that renders queued utterances in batches
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from metrics import METRICS
+
+# One engine per worker process, created by _init_worker
+_engine = None
+
+def _init_worker(voice_keyword, rate, volume):
+    global _engine
+    import pyttsx3
+    import voices
+    _engine = pyttsx3.init()
+    voices.resolve_voice_id(_engine, voice_keyword)
+    _engine.setProperty('rate', rate)
+    _engine.setProperty('volume', volume)
+
+def _render_batch(jobs):
+    """Queue every (text, path) on the worker's engine and run them in one runAndWait"""
+    for text, path in jobs:
+        _engine.save_to_file(text, path)
+    _engine.runAndWait()
+    return [os.path.exists(path) and os.path.getsize(path) > 0 for _, path in jobs]
+
+class TTSPool:
+    """
+    Renders (text, output path) jobs on worker processes that each own one
+    pyttsx3 engine. Jobs are queued; a dispatcher thread groups whatever has
+    arrived within max_wait seconds (up to max_batch jobs) into one batch
+    per runAndWait, keeping at most two batches in flight per worker.
+    Workers are spawned, so scripts creating a pool need the usual
+    if __name__ == "__main__" guard.
+    """
+    def __init__(self, workers=2, voice_keyword='female', rate=200, volume=1.0,
+                 max_batch=16, max_wait=0.02):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # Spawned, not forked: the parent is usually running threads, and engines must start fresh
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(voice_keyword, rate, volume))
+        self._jobs = queue.Queue()
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name='tts-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, text, output_path):
+        """Queue one utterance; the Future resolves to True once output_path is written"""
+        if self._closed:
+            raise RuntimeError("TTS pool is shut down")
+        future = Future()
+        self._jobs.put((text, output_path, future))
+        return future
+
+    def submit_batch(self, jobs):
+        """Queue many (text, output_path) jobs, returning their futures in order"""
+        return [self.submit(text, output_path) for text, output_path in jobs]
+
+    def render(self, text, output_path, timeout=None):
+        """Blocking helper: render one utterance and return True on success"""
+        return self.submit(text, output_path).result(timeout)
+
+    def _next_batch(self):
+        job = self._jobs.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                job = self._jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if job is None:
+                self._jobs.put(None)  # Let the outer loop see the shutdown marker
+                break
+            batch.append(job)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self._slots.acquire()
+            METRICS.observe('tts_batch_size', len(batch))
+            try:
+                pending = self.executor.submit(_render_batch, [(text, path) for text, path, _ in batch])
+            except Exception as e:
+                self._slots.release()
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            pending.add_done_callback(lambda done, batch=batch: self._finish(done, batch))
+
+    def _finish(self, done, batch):
+        self._slots.release()
+        try:
+            results = done.result()
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, path, future), ok in zip(batch, results):
+            if ok:
+                future.set_result(True)
+            else:
+                future.set_exception(RuntimeError(f"TTS engine produced no audio for {path}"))
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; with wait, finish everything already queued first"""
+        if self._closed:
+            return
+        self._closed = True
+        if not wait:
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[2].cancel()
+        self._jobs.put(None)
+        if wait:
+            self._dispatcher.join()
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
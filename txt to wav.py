@@ -2,55 +2,182 @@ from gtts import gTTS
 import playsound
 import re
 import sys
-import inflect
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import tts_cache
+import text_normalizer
+import audio_output
+import streaming_tts
 
 class AdvancedTTSConverter:
     def __init__(self):
         """Initialize the enhanced TTS engine with female-like voice settings."""
-        self.inflect_engine = inflect.engine()
+        self.normalizer = text_normalizer.TextNormalizer()
+        self.number_normalizer = text_normalizer.TextNormalizer(speech_patterns=False)
         self.language = 'en'
         self.slow = False  # Faster, natural speech
+        self.tts_cache = tts_cache.get_default_cache()
+        # gTTS returns MP3, so it is always decoded into a real WAV
+        self.output_profile = audio_output.get_profile() or audio_output.PROFILES['pcm16_16k']
 
     def normalize_numbers(self, text):
-        """Convert numbers to words."""
-        def replace_number(match):
-            number = match.group(0)
-            try:
-                if '.' in number:  # Decimal numbers
-                    return self.inflect_engine.number_to_words(float(number))
-                elif len(number) == 4 and number.startswith(('19', '20')):  # Years
-                    return number[:2] + ' ' + self.inflect_engine.number_to_words(int(number[2:]))
-                else:
-                    return self.inflect_engine.number_to_words(int(number))
-            except:
-                return number
-
-        return re.sub(r'\b\d+\.?\d*\b', replace_number, text)
+        """Convert numbers, years, ordinals and currency to words."""
+        return self.number_normalizer.normalize(text)
 
     def add_speech_patterns(self, text):
         """Add natural speech patterns."""
         text = text.replace(",", "...")
         return text
 
+    def prepare_text(self, text):
+        """Normalize text and add speech patterns in a single pass."""
+        return self.normalizer.normalize(text)
+
     def text_to_speech(self, text, output_file='output.wav'):
         """Convert text to speech and save as audio file."""
         try:
-            normalized_text = self.normalize_numbers(text)
-            processed_text = self.add_speech_patterns(normalized_text)
+            processed_text = self.prepare_text(text)
             print(f"Speaking: {processed_text}")
-            tts = gTTS(text=processed_text, lang=self.language, slow=self.slow)
-            tts.save(output_file)
+            key = self.tts_cache.key(processed_text, 'gtts', rate='slow' if self.slow else 'normal',
+                                     language=self.language, output=self.output_profile.name)
+            self.tts_cache.synthesize(key, 'wav', output_file, lambda path: self._render(processed_text, path))
             print(f"Audio saved as: {output_file}. Playing audio...")
             playsound.playsound(output_file)
         except Exception as e:
             print(f"Speech generation error: {e}")
 
+    def _render(self, text, path):
+        """Fetch the MP3 from gTTS and convert it to the output WAV at path"""
+        fd, mp3_path = tempfile.mkstemp(suffix='.mp3')
+        os.close(fd)
+        try:
+            gTTS(text=text, lang=self.language, slow=self.slow).save(mp3_path)
+            print(audio_output.format_saving(audio_output.convert(mp3_path, path, self.output_profile)))
+        finally:
+            os.remove(mp3_path)
+
+    def split_document(self, text, max_chars=500):
+        """Split text into paragraph chunks, breaking long paragraphs at sentence ends."""
+        chunks = []
+        for paragraph in re.split(r'\n\s*\n', text):
+            paragraph = ' '.join(paragraph.split())
+            if not paragraph:
+                continue
+            current = ''
+            for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+                if current and len(current) + len(sentence) + 1 > max_chars:
+                    chunks.append(current)
+                    current = sentence
+                else:
+                    current = f"{current} {sentence}".strip()
+            if current:
+                chunks.append(current)
+        return chunks
+
+    def synthesize_chunk(self, text):
+        """Return the MP3 bytes for one chunk, using the synthesis cache."""
+        key = self.tts_cache.key(text, 'gtts', rate='slow' if self.slow else 'normal',
+                                 language=self.language, fmt='mp3')
+        data = self.tts_cache.get_bytes(key, 'mp3')
+        if data is None:
+            buffer = io.BytesIO()
+            gTTS(text=text, lang=self.language, slow=self.slow).write_to_fp(buffer)
+            data = buffer.getvalue()
+            self.tts_cache.put_bytes(key, 'mp3', data)
+        return data
+
+    def document_to_speech(self, text, output_file='output.wav', max_workers=4, max_chars=500, play=True):
+        """
+        Convert a long document chunk by chunk.
+
+        Chunks render concurrently on max_workers threads and are appended to
+        output_file in order, converted to the output profile's WAV format;
+        playback starts with the first chunk while the rest are still
+        rendering. The WAV is built next to output_file and replaces it
+        when complete, so a cached file hardlinked there is never written
+        through and a failed run leaves the old file alone.
+        """
+        playback = queue.Queue()
+        player = threading.Thread(target=self._play_chunks, args=(playback,), daemon=True)
+        if play:
+            player.start()
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_file)),
+                                       prefix='.tts_document_', suffix='.wav')
+        os.close(fd)
+        writer = streaming_tts.ProgressiveWavWriter(partial)
+        workdir = tempfile.mkdtemp(prefix='tts_document_')
+        try:
+            processed_text = self.prepare_text(text)
+            chunks = self.split_document(processed_text, max_chars)
+            print(f"Rendering {len(chunks)} chunks with {max_workers} workers...")
+
+            mp3_bytes = 0
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self.synthesize_chunk, chunk) for chunk in chunks]
+                # Chunks are appended in order as they complete; the header stays valid after each
+                for index, future in enumerate(futures):
+                    data = future.result()
+                    mp3_path = os.path.join(workdir, f"chunk_{index}.mp3")
+                    with open(mp3_path, 'wb') as f:
+                        f.write(data)
+                    # Trimmed chunks keep pad_ms of silence each side, so paragraphs stay apart
+                    wav_path = os.path.join(workdir, f"chunk_{index}.wav")
+                    audio_output.convert(mp3_path, wav_path, self.output_profile)
+                    writer.append(wav_path)
+                    mp3_bytes += len(data)
+                    if play:
+                        playback.put(data)
+                    print(f"Chunk {index + 1}/{len(chunks)} ready.")
+            writer.close()
+            os.replace(partial, output_file)
+
+            print(f"Audio saved as: {output_file} ({mp3_bytes} bytes of MP3 -> "
+                  f"{os.path.getsize(output_file)} bytes, {self.output_profile.name}).")
+        except Exception as e:
+            print(f"Speech generation error: {e}")
+        finally:
+            writer.close()
+            if os.path.exists(partial):
+                os.remove(partial)
+            shutil.rmtree(workdir, ignore_errors=True)
+            if play:
+                playback.put(None)
+                player.join()
+
+    def _play_chunks(self, playback):
+        """Play queued MP3 chunks one after another."""
+        workdir = tempfile.mkdtemp(prefix='tts_play_')
+        try:
+            index = 0
+            while True:
+                data = playback.get()
+                if data is None:
+                    break
+                path = os.path.join(workdir, f"chunk_{index}.mp3")
+                with open(path, 'wb') as f:
+                    f.write(data)
+                playsound.playsound(path)
+                os.remove(path)
+                index += 1
+        except Exception as e:
+            print(f"Playback error: {e}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
 if __name__ == '__main__':
     # Read text from prompt.txt
     try:
         with open('prompt.txt', 'r') as file:
             text_to_convert = file.read()
         converter = AdvancedTTSConverter()
-        converter.text_to_speech(text_to_convert)
+        if '--document' in sys.argv:
+            converter.document_to_speech(text_to_convert)
+        else:
+            converter.text_to_speech(text_to_convert)
     except FileNotFoundError:
         print("prompt.txt not found. Please provide a valid file.")
@@ -0,0 +1,324 @@
+# Whole-pipeline memo: transcript, reply and reply WAV keyed by a robust audio fingerprint
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from metrics import METRICS
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+DEFAULT_CACHE_DIR = os.getenv('UTTERANCE_CACHE_DIR', '.utterance_cache')
+DEFAULT_TTL = float(os.getenv('UTTERANCE_CACHE_TTL', 24 * 3600))
+DEFAULT_MAX_BYTES = int(os.getenv('UTTERANCE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+FINGERPRINT_RATE = 8000
+FINGERPRINT_BANDS = 24
+FINGERPRINT_SLOTS = 32
+
+# What fingerprint() returns: the coarse spectral vector finds candidates, the
+# trimmed waveform (int8, peak-normalized, at rate Hz) confirms them
+Fingerprint = namedtuple('Fingerprint', 'vector seconds waveform rate')
+
+def _sound(samples, rate, trim_db):
+    """
+    16-bit mono samples decimated to about 8 kHz, DC-free and cut to the
+    stretch within trim_db of the loudest millisecond: (float32, rate) or None
+    """
+    x = samples.astype(np.float32)
+    x -= x.mean()
+    step = max(1, rate // FINGERPRINT_RATE)
+    if step > 1:
+        # Block averaging doubles as the anti-aliasing filter
+        usable = len(x) - len(x) % step
+        x = x[:usable].reshape(-1, step).mean(axis=1)
+    fs = rate / step
+
+    # Trim on a 1 ms envelope so leading silence can't shift the frame grid
+    block = 8
+    blocks = len(x) // block
+    if not blocks:
+        return None
+    envelope = (x[:blocks * block].reshape(blocks, block) ** 2).mean(axis=1)
+    if envelope.max() <= 0:
+        return None
+    loud = np.flatnonzero(envelope > envelope.max() * 10 ** (-trim_db / 10))
+    x = x[loud[0] * block:(loud[-1] + 1) * block]
+    return x - x.mean(), fs
+
+def fingerprint(samples, rate, bands=FINGERPRINT_BANDS, slots=FINGERPRINT_SLOTS, trim_db=20, floor_db=40):
+    """
+    Spectral summary of 16-bit mono samples: decimated to 8 kHz and cut
+    to the stretch within trim_db of the loudest millisecond, then log
+    energy in `bands` log-spaced bands (100 Hz - 4 kHz), smoothed over
+    time and averaged over `slots` equal parts of it. DC is removed, levels are relative to the loudest
+    cell and the vector is mean-free with unit length, so gain, offset
+    and padding differences leave it (nearly) unchanged. That also makes
+    it blind to a changed word, so the trimmed waveform comes along for
+    waveform_mismatch() to confirm a match.
+    Returns a Fingerprint, or None for silence.
+    """
+    sound = _sound(samples, rate, trim_db)
+    if sound is None:
+        return None
+    x, fs = sound
+
+    # Four frames per slot (fewer on long clips), so a few samples more or less barely move a boundary
+    n_fft = 512
+    hop = min(256, (len(x) - n_fft) // (4 * slots - 1))
+    if hop < 16:
+        return None
+    frames = np.lib.stride_tricks.sliding_window_view(x, n_fft)[::hop] * np.hanning(n_fft).astype(np.float32)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    edges = np.geomspace(100, min(4000, fs / 2), bands + 1) * n_fft / fs
+    band_of = np.searchsorted(edges, np.arange(power.shape[1]), side='right') - 1
+    band_power = np.stack([power[:, band_of == band].sum(axis=1) for band in range(bands)], axis=1)
+    # Blur across about two slots: onsets landing either side of a slot boundary then look alike
+    kernel = np.hanning(10)[1:-1]
+    band_power = np.stack([np.convolve(column, kernel / kernel.sum(), mode='same') for column in band_power.T], axis=1)
+    pooled = np.stack([chunk.mean(axis=0) for chunk in np.array_split(band_power, slots)])
+    vector = np.log10(pooled + pooled.max() * 10 ** (-floor_db / 10)).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    waveform = np.int8(np.round(x * (127 / np.abs(x).max())))
+    return Fingerprint((vector / norm).astype(np.float32), len(x) / fs, waveform, fs)
+
+def audio_fingerprint(audio):
+    """fingerprint() of an sr.AudioData"""
+    samples = np.frombuffer(audio.get_raw_data(convert_width=2), dtype=np.int16)
+    return fingerprint(samples, audio.sample_rate)
+
+def waveform_mismatch(a, b, rate, max_shift=0.1, window_ms=50, edge_ratio=0.25):
+    """
+    How differently two trimmed waveforms sound, window by window, after
+    lining them up (by cross-correlation, up to max_shift of their length)
+    and matching levels: the worst window's residual energy relative to its
+    own, where windows much quieter than average count with the average's
+    tenth. Near 0 for the same recording resent with another gain, offset
+    or padding; around 1 or more where a word differs. Sound beyond the
+    overlap (trim edges) only passes if quieter than edge_ratio of it.
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    size = 1 << int(np.ceil(np.log2(len(a) + len(b))))
+    correlation = np.fft.irfft(np.fft.rfft(a, size) * np.conj(np.fft.rfft(b, size)), size)
+    limit = max(1, int(max_shift * max(len(a), len(b))))
+    shifts = np.r_[0:limit + 1, -limit:0]
+    shift = int(shifts[np.argmax(correlation[shifts])])
+    # a[shift + i] lines up with b[i]
+    a_start, b_start = max(shift, 0), max(-shift, 0)
+    window = max(1, int(rate * window_ms / 1000))
+    windows = min(len(a) - a_start, len(b) - b_start) // window
+    if windows < 1:
+        return float('inf')
+    overlap = windows * window
+    x = a[a_start:a_start + overlap]
+    b = b * (float(x @ b[b_start:b_start + overlap]) / max(float(np.square(b[b_start:b_start + overlap]).sum()), 1e-9))
+    y = b[b_start:b_start + overlap]
+    own = np.maximum(np.square(x).reshape(windows, window).sum(axis=1),
+                     np.square(y).reshape(windows, window).sum(axis=1))
+    residual = np.square(x - y).reshape(windows, window).sum(axis=1)
+
+    # Whatever one clip has beyond the overlap must be trim-edge noise, not a word
+    mean_power = own.mean() / window
+    edges = (a[:a_start], a[a_start + overlap:], b[:b_start], b[b_start + overlap:])
+    if any(len(edge) >= window and np.mean(np.square(edge)) > edge_ratio * mean_power for edge in edges):
+        return float('inf')
+    return float(np.max(residual / (own + 0.1 * own.mean())))
+
+class UtteranceCache:
+    """
+    Persistent map from an audio fingerprint to (transcript, reply, reply WAV).
+
+    Lookups compare the fingerprint against every live entry in one
+    matrix product; candidates of similar duration with cosine similarity
+    of at least threshold are then confirmed, best first, by comparing the
+    stored waveform (waveform_mismatch() at most max_mismatch), so a clip
+    that differs in one word is a miss. Clips with under min_seconds of
+    sound are never cached. Entries expire after their own ttl, and the
+    least recently used are evicted past max_entries or max_bytes of WAV
+    and waveform data. The index is a JSON file rewritten atomically next
+    to the WAVs.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_entries=512,
+                 max_bytes=DEFAULT_MAX_BYTES, threshold=0.98, duration_tolerance=0.1, min_seconds=0.5,
+                 max_mismatch=0.1):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.threshold = threshold
+        self.duration_tolerance = duration_tolerance
+        self.min_seconds = min_seconds  # Shorter clips are too alike to tell apart
+        self.max_mismatch = max_mismatch
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._matrix = None  # Stacked fingerprints, rebuilt after changes
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def _load(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return []
+        now = time.time()
+        for entry in entries:
+            entry['vector'] = np.frombuffer(base64.b64decode(entry.pop('fingerprint')), dtype=np.float16).astype(np.float32)
+        # Entries without a stored waveform (older indexes) cannot be confirmed
+        return [entry for entry in entries
+                if entry['expires'] > now and 'waveform' in entry and os.path.exists(self._wav_path(entry))
+                and os.path.exists(os.path.join(self.cache_dir, entry['waveform']))]
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        records = []
+        for entry in self._entries:
+            record = {key: value for key, value in entry.items() if key != 'vector'}
+            record['fingerprint'] = base64.b64encode(entry['vector'].astype(np.float16).tobytes()).decode('ascii')
+            records.append(record)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='tmp', suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(records, f)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            print(f"Could not save utterance cache index: {e}")
+
+    def _wav_path(self, entry):
+        return os.path.join(self.cache_dir, entry['wav'])
+
+    def get(self, key):
+        """
+        key: Fingerprint from fingerprint(). Returns the matching entry
+        ({'transcript', 'reply', 'wav_path', 'similarity'}) or None.
+        """
+        if key is None or key.seconds < self.min_seconds:
+            return None
+        now = time.time()
+        with self._lock:
+            self._drop([entry for entry in self._entries if entry['expires'] <= now])
+            best, similarity = None, self.threshold
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix = np.stack([entry['vector'] for entry in self._entries])
+                scores = self._matrix @ key.vector
+                for i in np.argsort(-scores):
+                    if scores[i] < similarity:
+                        break
+                    entry = self._entries[i]
+                    if (abs(entry['seconds'] - key.seconds) <= self.duration_tolerance * max(key.seconds, entry['seconds'])
+                            and self._confirm(entry, key)):
+                        best, similarity = entry, float(scores[i])
+                        break
+            if best is None:
+                self.stats['misses'] += 1
+                METRICS.record_cache('utterance', False)
+                return None
+            best['last_used'] = now
+            self.stats['hits'] += 1
+        METRICS.record_cache('utterance', True)
+        return {'transcript': best['transcript'], 'reply': best['reply'],
+                'wav_path': self._wav_path(best), 'similarity': round(similarity, 4)}
+
+    def _confirm(self, entry, key):
+        """True if entry's stored waveform sounds like key's, not just similar in spectrum"""
+        if entry['rate'] != key.rate:
+            return False
+        try:
+            waveform = np.load(os.path.join(self.cache_dir, entry['waveform']))
+        except (OSError, ValueError) as e:
+            print(f"Could not read cached waveform: {e}")
+            return False
+        return waveform_mismatch(waveform, key.waveform, key.rate) <= self.max_mismatch
+
+    def fetch(self, key, output_wav):
+        """get() and copy the cached reply WAV to output_wav; None on a miss"""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        # output_wav may be a hardlink into the (read-only) TTS cache: replace it, never write through it
+        directory = os.path.dirname(os.path.abspath(output_wav))
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.utterance_', suffix='.wav')
+            os.close(fd)
+            try:
+                shutil.copyfile(entry['wav_path'], tmp)
+                os.replace(tmp, output_wav)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except OSError as e:
+            print(f"Could not replay cached reply: {e}")
+            return None
+        return entry
+
+    def put(self, key, transcript, reply, wav_bytes, ttl=None):
+        """Remember a finished utterance; ttl=0 (or a missing fingerprint) stores nothing"""
+        ttl = self.ttl if ttl is None else ttl
+        if key is None or key.seconds < self.min_seconds or not wav_bytes or ttl <= 0:
+            return False
+        name = uuid.uuid4().hex
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, name + '.wav'), 'wb') as f:
+                f.write(wav_bytes)
+            np.save(os.path.join(self.cache_dir, name + '.npy'), key.waveform)
+        except OSError as e:
+            print(f"Could not cache utterance reply: {e}")
+            return False
+        now = time.time()
+        entry = {'transcript': transcript, 'reply': reply, 'wav': name + '.wav', 'seconds': round(key.seconds, 3),
+                 'waveform': name + '.npy', 'rate': key.rate, 'size': len(wav_bytes) + key.waveform.nbytes,
+                 'created': now, 'last_used': now, 'expires': now + ttl, 'vector': key.vector}
+        with self._lock:
+            self._entries.append(entry)
+            self._matrix = None
+            self._evict()
+            self._save()
+        return True
+
+    def _evict(self):
+        now = time.time()
+        doomed = [entry for entry in self._entries if entry['expires'] <= now]
+        kept = sorted((entry for entry in self._entries if entry['expires'] > now),
+                      key=lambda entry: entry['last_used'])
+        size = sum(entry['size'] for entry in kept)
+        while kept and (len(kept) > self.max_entries or size > self.max_bytes):
+            entry = kept.pop(0)
+            size -= entry['size']
+            doomed.append(entry)
+            self.stats['evictions'] += 1
+        self._drop(doomed)
+
+    def _drop(self, doomed):
+        if not doomed:
+            return
+        ids = {id(entry) for entry in doomed}
+        self._entries = [entry for entry in self._entries if id(entry) not in ids]
+        self._matrix = None
+        for entry in doomed:
+            for name in (entry['wav'], entry['waveform']):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._drop(list(self._entries))
+            self._save()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,260 @@
+# Resident voice service: keeps the STT/LLM/TTS engines warm and serves WAV requests
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import tts_pool
+import utterance_cache
+from main import RobotVoiceSystem
+from metrics import METRICS
+
+class Stage:
+    """A pipeline stage with its own worker threads and concurrency limit"""
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=name)
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+
+    async def run(self, func, *args):
+        queued = time.perf_counter()
+        async with self.semaphore:
+            METRICS.observe('stage_queue_seconds', time.perf_counter() - queued, stage=self.name)
+            self.active += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, METRICS.wrap(func), *args)
+            finally:
+                self.active -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class VoiceService:
+    def __init__(self, robot=None, stt_limit=4, llm_limit=8, tts_limit=1,
+                 max_pending=32, max_body=10 * 1024 * 1024, tts_workers=0):
+        """
+        stt_limit / llm_limit / tts_limit: concurrent calls allowed per stage
+        (pyttsx3 engines are not thread-safe, so TTS defaults to one)
+        max_pending: utterances admitted at once before answering 503
+        tts_workers: render speech on this many engine processes instead;
+        the TTS stage then admits enough calls to fill their batches
+        """
+        self.robot = robot or RobotVoiceSystem()
+        if tts_workers:
+            self.robot.tts_pool = tts_pool.TTSPool(tts_workers, self.robot.VOICE_KEYWORD,
+                                                   self.robot.VOICE_RATE, self.robot.VOICE_VOLUME)
+            tts_limit = max(tts_limit, tts_workers * self.robot.tts_pool.max_batch)
+        self.stages = {
+            'stt': Stage('stt', stt_limit),
+            'llm': Stage('llm', llm_limit),
+            'tts': Stage('tts', tts_limit)
+        }
+        self.max_pending = max_pending
+        self.max_body = max_body
+        self.pending = 0
+        self.served = 0
+        self.rejected = 0
+
+    def _synthesize(self, text):
+        fd, path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            if not self.robot.create_audio_response(text, path):
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def _speak(self, key, text, reply, ttl):
+        """TTS stage: render reply and remember it for the utterance (file I/O stays off the event loop)"""
+        audio = self._synthesize(reply)
+        if audio is not None:
+            self.robot.utterances.put(key, text, reply, audio, ttl)
+        return audio
+
+    async def handle_utterance(self, wav_bytes, session_id=None):
+        """
+        Run STT -> LLM -> TTS for one WAV payload. Requests sharing a
+        session_id are answered as one conversation; None is stateless.
+        """
+        with METRICS.trace(bytes=len(wav_bytes)):
+            return await self._run_pipeline(wav_bytes, session_id)
+
+    def _listen(self, wav_bytes, session_id):
+        """STT stage: (fingerprint, cached entry with its WAV bytes, None) on a replay, else (fingerprint, None, text)"""
+        audio = self.robot.load_audio(io.BytesIO(wav_bytes))
+        if audio is None:
+            return None, None, None
+        key = utterance_cache.audio_fingerprint(audio)
+        cached = self.robot.utterances.get(key)
+        if cached:
+            try:
+                with open(cached['wav_path'], 'rb') as f:
+                    cached = dict(cached, audio=f.read())
+                self.robot.remember_turn(session_id, cached['transcript'], cached['reply'])
+                return key, cached, None
+            except OSError:
+                pass
+        with METRICS.stage('stt'):
+            return key, None, self.robot.transcribe_audio(audio)
+
+    async def _run_pipeline(self, wav_bytes, session_id):
+        key, cached, text = await self.stages['stt'].run(self._listen, wav_bytes, session_id)
+        if cached:
+            return cached['transcript'], cached['reply'], cached['audio']
+        if not text:
+            return None, None, None
+        reply, ttl = await self.stages['llm'].run(self.robot.answer, text, session_id)
+        audio = await self.stages['tts'].run(self._speak, key, text, reply, ttl)
+        return text, reply, audio
+
+    def status(self):
+        return {
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'served': self.served,
+            'rejected': self.rejected,
+            'intents': self.robot.intent_report(),
+            'utterance_cache': dict(self.robot.utterances.stats, entries=len(self.robot.utterances)),
+            'stages': {name: {'active': stage.active, 'limit': stage.limit}
+                       for name, stage in self.stages.items()}
+        }
+
+    async def handle_client(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until it closes"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > self.max_body:
+                    await self._respond(writer, 413, b'Payload too large', close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                if method == 'GET' and path == '/health':
+                    await self._respond(writer, 200, json.dumps(self.status()).encode(),
+                                        content_type='application/json')
+                elif method == 'GET' and path == '/metrics':
+                    await self._respond(writer, 200, METRICS.to_prometheus().encode(),
+                                        content_type='text/plain; version=0.0.4')
+                elif method == 'GET' and path == '/traces':
+                    traces = [json.dumps(trace) for trace in METRICS.take_traces()]
+                    await self._respond(writer, 200, '\n'.join(traces).encode(),
+                                        content_type='application/x-ndjson')
+                elif method == 'POST' and path == '/utterance':
+                    await self._serve_utterance(writer, body, headers.get('x-session-id'))
+                else:
+                    await self._respond(writer, 404, b'Not found')
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError) as e:
+            print(f"Client error: {e}")
+        finally:
+            writer.close()
+
+    async def _serve_utterance(self, writer, body, session_id=None):
+        # Backpressure: shed load instead of queueing without bound
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            await self._respond(writer, 503, b'Busy', extra={'Retry-After': '1'})
+            return
+        self.pending += 1
+        try:
+            text, reply, audio = await self.handle_utterance(body, session_id)
+        except Exception as e:
+            print(f"Pipeline error: {e}")
+            await self._respond(writer, 500, b'Pipeline error')
+            return
+        finally:
+            self.pending -= 1
+
+        if not text:
+            await self._respond(writer, 422, b'Could not understand audio')
+        elif audio is None:
+            await self._respond(writer, 500, b'Failed to create response')
+        else:
+            self.served += 1
+            await self._respond(writer, 200, audio, content_type='audio/wav', extra={
+                'X-Transcript': urllib.parse.quote(text),
+                'X-Reply': urllib.parse.quote(reply)
+            })
+
+    async def _respond(self, writer, status, body, content_type='text/plain', extra=None, close=False):
+        reasons = {200: 'OK', 404: 'Not Found', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+                   500: 'Internal Server Error', 503: 'Service Unavailable'}
+        headers = {'Content-Type': content_type, 'Content-Length': str(len(body))}
+        if close:
+            headers['Connection'] = 'close'
+        headers.update(extra or {})
+        head = f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path)
+            print(f"Voice service listening on {unix_path}")
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+            print(f"Voice service listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for stage in self.stages.values():
+                stage.shutdown()
+            if self.robot.tts_pool is not None:
+                self.robot.tts_pool.shutdown(wait=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident STT -> LLM -> TTS voice service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help="serve on this Unix socket path instead of TCP")
+    parser.add_argument('--stt-limit', type=int, default=4)
+    parser.add_argument('--llm-limit', type=int, default=8)
+    parser.add_argument('--tts-limit', type=int, default=1)
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--tts-workers', type=int, default=0,
+                        help="pyttsx3 worker processes rendering batched replies (0 renders in-process)")
+    args = parser.parse_args()
+
+    async def run():
+        # Semaphores must be created inside the running loop
+        service = VoiceService(
+            stt_limit=args.stt_limit,
+            llm_limit=args.llm_limit,
+            tts_limit=args.tts_limit,
+            max_pending=args.max_pending,
+            tts_workers=args.tts_workers
+        )
+        await service.serve(args.host, args.port, args.unix)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Voice service stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,217 @@
 # Voice RSS text-to-speech SDK for Python 3.x
 import http.client
+import os
+import queue
+import shutil
+import tempfile
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import tts_cache
+from metrics import METRICS
+
+HOST = 'api.voicerss.org'
+HTTP_PORT = 80
+HTTPS_PORT = 443
 
 def speech(settings):
-	__validate(settings)
-	return __request(settings)
+	return _default_client().speech(settings)
+
+def speech_many(settings_list, max_workers=4):
+	return _default_client().speech_many(settings_list, max_workers)
+
+def speech_to_file(settings, sink, chunk_size=64 * 1024):
+	return _default_client().speech_to_file(settings, sink, chunk_size)
+
+class Client:
+	"""
+	Reusable VoiceRSS client that keeps up to pool_size keep-alive
+	connections per scheme open between calls. Safe to share between threads.
+	"""
+	def __init__(self, pool_size=4, timeout=30):
+		self.pool_size = pool_size
+		self.timeout = timeout
+		self._pools = {}
+		self._lock = threading.Lock()
+
+	def speech(self, settings):
+		_validate(settings)
+		if 'cache' in settings and not settings['cache']:
+			return self._request(settings)
+
+		cache = tts_cache.get_default_cache()
+		key = _cacheKey(cache, settings)
+		content = cache.get_bytes(key, 'bin')
+		if content is not None:
+			return {'error': None, 'response': content}
+
+		result = self._request(settings)
+		if result['response']:
+			cache.put_bytes(key, 'bin', result['response'])
+		return result
+
+	def speech_many(self, settings_list, max_workers=4):
+		"""Synthesize many requests concurrently, returning results in input order"""
+		def run(settings):
+			try:
+				return self.speech(settings)
+			except Exception as e:
+				return {'error': str(e), 'response': None}
+
+		with ThreadPoolExecutor(max_workers=max_workers) as executor:
+			return list(executor.map(run, settings_list))
+
+	def speech_to_file(self, settings, sink, chunk_size=64 * 1024):
+		"""
+		Stream the audio into sink (a path or binary file object) in chunks
+		instead of holding it in memory. Cached audio is served from the
+		synthesis cache, and audio streamed to a path is added to it.
+		Returns {'error', 'bytes'}.
+		"""
+		_validate(settings)
+		use_cache = not ('cache' in settings and not settings['cache'])
+		cache = tts_cache.get_default_cache() if use_cache else None
+		key = _cacheKey(cache, settings) if use_cache else None
+		if use_cache:
+			cached = cache.open_entry(key, 'bin')
+			if cached is not None:
+				with cached:
+					return _copyToSink(cached, sink, chunk_size)
+
+		if isinstance(sink, (str, os.PathLike)):
+			# Stream into a temporary file so a failed request never leaves a partial sink
+			fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(sink)), prefix='.voicerss_')
+			try:
+				with os.fdopen(fd, 'wb') as f:
+					result = self.speech_to_file(dict(settings, cache=False), f, chunk_size)
+				if not result['error']:
+					os.replace(tmp, sink)
+			finally:
+				if os.path.exists(tmp):
+					os.remove(tmp)
+			if not result['error'] and use_cache:
+				cache.store(key, 'bin', sink)
+			return result
+
+		result = {'error': None, 'bytes': 0}
+		conn, response, sent = self._open(settings)
+		try:
+			if response.status != 200:
+				response.read()
+				result['error'] = response.reason
+				return result
+			first = response.read(chunk_size)
+			if first.find(b'ERROR') == 0:
+				result['error'] = first + response.read()
+				return result
+			chunk = first
+			while chunk:
+				sink.write(chunk)
+				result['bytes'] += len(chunk)
+				chunk = response.read(chunk_size)
+			return result
+		finally:
+			METRICS.record_remote_call('voicerss', sent, result['bytes'], error=result['error'] is not None)
+			self._release(conn, response)
+
+	def close(self):
+		with self._lock:
+			pools = list(self._pools.values())
+		for pool in pools:
+			while not pool.empty():
+				pool.get_nowait().close()
 
-def __validate(settings):
+	def _request(self, settings):
+		result = {'error': None, 'response': None}
+		conn, response, sent = self._open(settings)
+		content = response.read()
+		self._release(conn, response)
+
+		if response.status != 200:
+			result['error'] = response.reason
+		elif content.find(b'ERROR') == 0:
+			result['error'] = content
+		else:
+			result['response'] = content
+		METRICS.record_remote_call('voicerss', sent, len(content), error=result['error'] is not None)
+		return result
+
+	def _open(self, settings):
+		"""Send the request on a pooled connection, retrying once on a stale one"""
+		headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
+		params = urllib.parse.urlencode(_buildRequest(settings))
+		ssl = bool('ssl' in settings and settings['ssl'])
+
+		for attempt in range(2):
+			conn = self._acquire(ssl)
+			try:
+				conn.request('POST', '/', params, headers)
+				return conn, conn.getresponse(), len(params)
+			except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+				# The server closed an idle keep-alive connection
+				conn.close()
+				if attempt == 1:
+					raise
+			except Exception:
+				conn.close()
+				raise
+
+	def _acquire(self, ssl):
+		port = HTTPS_PORT if ssl else HTTP_PORT
+		with self._lock:
+			pool = self._pools.setdefault((ssl, HOST, port), queue.LifoQueue())
+		try:
+			return pool.get_nowait()
+		except queue.Empty:
+			if ssl:
+				return http.client.HTTPSConnection(HOST, port, timeout=self.timeout)
+			return http.client.HTTPConnection(HOST, port, timeout=self.timeout)
+
+	def _release(self, conn, response):
+		ssl = isinstance(conn, http.client.HTTPSConnection)
+		with self._lock:
+			pool = self._pools.setdefault((ssl, conn.host, conn.port), queue.LifoQueue())
+		# Only reuse connections whose response was read to the end
+		if response.will_close or not response.isclosed() or pool.qsize() >= self.pool_size:
+			conn.close()
+		else:
+			pool.put(conn)
+
+_client = None
+_client_lock = threading.Lock()
+
+def _default_client():
+	global _client
+	with _client_lock:
+		if _client is None:
+			_client = Client()
+		return _client
+
+def _copyToSink(source, sink, chunk_size):
+	if isinstance(sink, (str, os.PathLike)):
+		with open(sink, 'wb') as f:
+			shutil.copyfileobj(source, f, chunk_size)
+		return {'error': None, 'bytes': os.path.getsize(sink)}
+	size = 0
+	for chunk in iter(lambda: source.read(chunk_size), b''):
+		sink.write(chunk)
+		size += len(chunk)
+	return {'error': None, 'bytes': size}
+
+def _cacheKey(cache, settings):
+	params = _buildRequest(settings)
+	return cache.key(params['src'], 'voicerss', voice=params['v'], rate=params['r'], language=params['hl'],
+		fmt=params['f'] or 'default', codec=params['c'], ssml=params['ssml'], b64=params['b64'])
+
+def _validate(settings):
 	if not settings: raise RuntimeError('The settings are undefined')
 	if 'key' not in settings or not settings['key']: raise RuntimeError('The API key is undefined')
 	if 'src' not in settings or not settings['src']: raise RuntimeError('The text is undefined')
 	if 'hl' not in settings or not settings['hl']: raise RuntimeError('The language is undefined')
 
-def __request(settings):
-	result = {'error': None, 'response': None}
-
-	headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'}
-	params = urllib.parse.urlencode(__buildRequest(settings))
-	
-	if 'ssl' in settings and settings['ssl']:
-		conn = http.client.HTTPSConnection('api.voicerss.org:443')
-	else:
-		conn = http.client.HTTPConnection('api.voicerss.org:80')
-		
-	conn.request('POST', '/', params, headers)
-	
-	response = conn.getresponse()
-
-	content = response.read()
-	
-	if response.status != 200:
-		result['error'] = response.reason
-	elif content.find(b'ERROR') == 0:
-		result['error'] = content
-	else:
-		result['response'] = content
-		
-	conn.close()
-
-	return result
-
-def __buildRequest(settings):
+def _buildRequest(settings):
 	params = {'key': '', 'src': '', 'hl': '', 'v': '', 'r': '', 'c': '', 'f': '', 'ssml': '', 'b64': ''}
-	
+
 	if 'key' in settings: params['key'] = settings['key']
 	if 'src' in settings: params['src'] = settings['src']
 	if 'hl' in settings: params['hl'] = settings['hl']
@@ -52,5 +221,5 @@ def __buildRequest(settings):
 	if 'f' in settings: params['f'] = settings['f']
 	if 'ssml' in settings: params['ssml'] = settings['ssml']
 	if 'b64' in settings: params['b64'] = settings['b64']
-	
-	return params
\ No newline at end of file
+
+	return params
@@ -0,0 +1,59 @@
+# Remembers which pyttsx3 voice was picked, so startup can skip enumerating system voices
+import json
+import os
+import tempfile
+
+VOICE_CACHE_FILE = os.getenv('VOICE_CACHE_FILE', '.voice_cache.json')
+
+# Returned by cached_voice_id for keywords that were never resolved
+UNRESOLVED = object()
+
+def _load(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save(path, cache):
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='tmp', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not save voice cache: {e}")
+
+def cached_voice_id(keyword, path=None):
+    """The voice id remembered for keyword, None if no voice matched, or UNRESOLVED"""
+    return _load(path or VOICE_CACHE_FILE).get(keyword, UNRESOLVED)
+
+def resolve_voice_id(engine, keyword, path=None):
+    """
+    Select the first voice whose name contains keyword on engine and return
+    its id (None if there is no such voice). The answer is cached on disk;
+    the voice list is only enumerated on the first run or when the cached
+    voice can no longer be selected.
+    """
+    path = path or VOICE_CACHE_FILE
+    cache = _load(path)
+    voice_id = cache.get(keyword, UNRESOLVED)
+    if voice_id is None:
+        return None
+    if voice_id is not UNRESOLVED:
+        try:
+            engine.setProperty('voice', voice_id)
+            return voice_id
+        except Exception:
+            pass  # The voice was removed since it was cached
+
+    voice_id = None
+    for voice in engine.getProperty('voices'):
+        if keyword in voice.name.lower():
+            voice_id = voice.id
+            engine.setProperty('voice', voice_id)
+            break
+    cache[keyword] = voice_id
+    _save(path, cache)
+    return voice_id
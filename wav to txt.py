@@ -1,168 +1,265 @@
 import wave
-import numpy as np
-from scipy.io import wavfile
-from scipy.signal import butter, filtfilt
 import speech_recognition as sr
-from pydub import AudioSegment, effects
-import noisereduce as nr
-import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import itertools
+import hashlib
+import threading
+from metrics import METRICS
+from lazy import lazy_import
+import attempt_scheduler
+
+# Heavy modules are only loaded once audio is actually optimized
+np = lazy_import('numpy')
+pydub = lazy_import('pydub')
+dsp = lazy_import('dsp')
+
+class CachedAudioData(sr.AudioData):
+    """AudioData that encodes each FLAC payload once and reuses it"""
+    def __init__(self, frame_data, sample_rate, sample_width):
+        super().__init__(frame_data, sample_rate, sample_width)
+        self.fingerprint = hashlib.sha1(
+            b"%d:%d:" % (sample_rate, sample_width) + frame_data
+        ).hexdigest()
+        self.encodes = 0
+        self.reuses = 0
+        self._flac_cache = {}
+        self._flac_lock = threading.Lock()
+
+    def get_flac_data(self, convert_rate=None, convert_width=None):
+        key = (convert_rate, convert_width)
+        with self._flac_lock:
+            if key in self._flac_cache:
+                self.reuses += 1
+            else:
+                self._flac_cache[key] = super().get_flac_data(convert_rate, convert_width)
+                self.encodes += 1
+            return self._flac_cache[key]
+
+def best_alternative(response):
+    """Pick (transcript, confidence) from a recognize_google(show_all=True) response"""
+    if not isinstance(response, dict) or not response.get('alternative'):
+        return None, None
+    alternatives = response['alternative']
+    if any('confidence' in alternative for alternative in alternatives):
+        best = max(alternatives, key=lambda alternative: alternative.get('confidence', 0))
+    else:
+        best = alternatives[0]
+    return best.get('transcript') or None, best.get('confidence')
 
 class ShortPhraseTranscriber:
-    def __init__(self, wav_file):
+    def __init__(self, wav_file, max_workers=4, quorum=3,
+                 attempt_order=('speed', 'config', 'language'),
+                 scheduler=None, confidence_threshold=None):
+        """
+        max_workers: recognition requests allowed in flight at once
+        quorum: identical transcripts needed to stop early (None runs every attempt)
+        attempt_order: nesting of the attempt loops, outermost first
+        scheduler: optional AttemptScheduler; attempts then run likeliest
+        first, starting with a single request
+        confidence_threshold: stop as soon as one result is at least this confident
+        """
         self.wav_file = wav_file
+        self.max_workers = max_workers
+        self.quorum = quorum
+        self.attempt_order = tuple(attempt_order)
+        self.scheduler = scheduler
+        self.confidence_threshold = confidence_threshold
+        self.speeds = [1.0, 0.8, 0.5]  # Normal, slightly slow, and slower
+        self.configs = [
+            (300, 0.8),   # Default
+            (200, 1.0),   # More sensitive
+            (400, 0.6)    # Less sensitive
+        ]
+        self.languages = ['en-US', 'en-GB', 'en-IN']
+        self.dsp = None  # Created on first use; importing it loads scipy
+        self.stats = {}
 
+    @METRICS.timed('preprocess')
     def optimize_for_speech(self):
         """Optimize audio specifically for short phrase recognition"""
         try:
             print("\nOptimizing audio for speech recognition...")
             
             # Load audio
-            audio = AudioSegment.from_wav(self.wav_file)
+            audio = pydub.AudioSegment.from_wav(self.wav_file)
             
             # Convert to mono and set optimal sample rate
             audio = audio.set_channels(1)
             audio = audio.set_frame_rate(16000)
             
             # Normalize and boost voice frequencies
-            audio = effects.normalize(audio)
+            audio = pydub.effects.normalize(audio)
             audio = audio + 40  # Significant volume boost
             
-            # Export base version
-            audio.export("temp_base.wav", format="wav")
-            
-            # Read for additional processing
-            rate, data = wavfile.read("temp_base.wav")
-            data = data.astype(np.float32)
+            # Noise reduction and the speech bandpass share one float32 STFT pass
+            samples = np.asarray(audio.get_array_of_samples())
+            if self.dsp is None:
+                self.dsp = dsp.SpeechDSP()
+            cleaned = self.dsp.process(samples)
             
-            # Aggressive noise reduction
-            clean_data = nr.reduce_noise(
-                y=data,
-                sr=rate,
-                prop_decrease=0.99,
-                n_std_thresh_stationary=1.1
-            )
-            
-            # Speech-focused bandpass filter
-            nyquist = rate / 2
-            cutoffs = [250, 3500]  # Wider range for better clarity
-            b, a = butter(4, [f/nyquist for f in cutoffs], btype='band')
-            filtered = filtfilt(b, a, clean_data)
-            
-            # Create three versions with different speeds
-            speeds = [1.0, 0.8, 0.5]  # Normal, slightly slow, and slower
-            processed_files = []
-            
-            for speed in speeds:
-                # Adjust speed and save
-                if speed == 0.5:
-                    output_data = filtered
-                else:
-                    # Resample for speed change
-                    new_len = int(len(filtered) / speed)
-                    output_data = np.interp(
-                        np.linspace(0, len(filtered)-1, new_len),
-                        np.arange(len(filtered)),
-                        filtered
-                    )
-                
-                # Normalize and convert to int16
-                output_data = output_data / np.max(np.abs(output_data))
-                output_data = np.int16(output_data * 32767)
-                
-                # Save version
-                output_file = f"processed_speed_{speed}.wav"
-                wavfile.write(output_file, rate, output_data)
-                processed_files.append(output_file)
+            # Create one version per configured speed (0.5 has always been sent at its original length)
+            stretches = [1.0 if speed == 0.5 else 1 / speed for speed in self.speeds]
+            processed_audio = []
+            for speed, (_, pcm) in zip(self.speeds, self.dsp.speed_variants(cleaned, stretches)):
+                # Keep the version in memory as 16-bit mono PCM
+                processed_audio.append((speed, CachedAudioData(pcm.tobytes(), audio.frame_rate, 2)))
             
             print("Audio optimization complete.")
-            return processed_files
+            return processed_audio
             
         except Exception as e:
             print(f"Optimization error: {e}")
             return []
 
+    def plan_attempts(self, processed_audio):
+        """
+        Build the ordered list of distinct (attempt, weight) pairs.
+
+        Thresholds don't change already-recorded AudioData, so attempts that
+        would send the same clip in the same language are collapsed into the
+        first one, whose weight counts the attempts it stands in for. Weights
+        only break ties between transcripts; the quorum counts responses.
+        """
+        axes = {
+            'speed': list(processed_audio),
+            'config': list(self.configs),
+            'language': list(self.languages)
+        }
+        if sorted(self.attempt_order) != sorted(axes):
+            raise ValueError(f"attempt_order must name each of {sorted(axes)}")
+
+        planned = {}
+        for combo in itertools.product(*(axes[name] for name in self.attempt_order)):
+            picked = dict(zip(self.attempt_order, combo))
+            speed, audio = picked['speed']
+            key = (getattr(audio, 'fingerprint', id(audio)), picked['language'])
+            if key in planned:
+                planned[key][1] += 1
+            else:
+                planned[key] = [(speed, audio, picked['config'], picked['language']), 1]
+
+        attempts = [(attempt, weight) for attempt, weight in planned.values()]
+        total = sum(weight for _, weight in attempts)
+        self.stats = {
+            'attempts_planned': total,
+            'attempts_distinct': len(attempts),
+            'remote_calls_saved': total - len(attempts)
+        }
+        return attempts
+
+    def run_attempt(self, attempt):
+        """Run a single recognition attempt, returning (transcript, confidence) or (None, None)"""
+        speed, audio, (energy, pause), language = attempt
+        # Recognizers carry mutable thresholds, so each attempt gets its own
+        recognizer = sr.Recognizer()
+        recognizer.energy_threshold = energy
+        recognizer.pause_threshold = pause
+        recognizer.dynamic_energy_threshold = True
+        with METRICS.stage('recognition_attempt', speed=speed, language=language, energy=energy, pause=pause):
+            METRICS.record_remote_call('google_stt', sent=len(audio.frame_data))
+            try:
+                response = recognizer.recognize_google(audio, language=language, show_all=True)
+            except sr.UnknownValueError:
+                return None, None
+            except sr.RequestError:
+                METRICS.inc('remote_errors_total', service='google_stt')
+                return None, None
+        return best_alternative(response)
+
     def transcribe(self):
-        """Transcribe with multiple attempts"""
+        """Transcribe with concurrent attempts, stopping once a quorum agrees"""
+        with METRICS.trace(input=self.wav_file):
+            return self._transcribe()
+
+    def _transcribe(self):
+        executor = None
+        processed_audio = []
         try:
             # Get optimized versions
-            processed_files = self.optimize_for_speech()
-            if not processed_files:
+            processed_audio = self.optimize_for_speech()
+            if not processed_audio:
                 return None
             
-            recognizer = sr.Recognizer()
-            all_results = []
+            planned = self.plan_attempts(processed_audio)
+            if self.scheduler is not None:
+                planned = self.scheduler.order(planned)
+            attempts = iter(planned)
+            print(f"Planned {self.stats['attempts_distinct']} distinct attempts "
+                  f"({self.stats['remote_calls_saved']} duplicate calls skipped).")
+            votes = Counter()    # Distinct responses per transcript, for the quorum
+            weights = Counter()  # Collapsed attempts behind them, for tie-breaks
+            submitted = {}
+            outcomes = {}
+            confident = None
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            pending = set()
+            # With a learned order the first guess usually settles it, so try it alone
+            in_flight = 1 if self.scheduler is not None else self.max_workers
             
-            # Recognition settings to try
-            configs = [
-                (300, 0.8),   # Default
-                (200, 1.0),   # More sensitive
-                (400, 0.6)    # Less sensitive
-            ]
+            def refill():
+                # Only keep in_flight attempts queued so an early exit has little to cancel
+                for attempt, weight in itertools.islice(attempts, in_flight - len(pending)):
+                    future = executor.submit(METRICS.wrap(self.run_attempt), attempt)
+                    submitted[future] = (attempt, weight)
+                    pending.add(future)
             
-            # Try each processed file
-            for audio_file in processed_files:
-                print(f"\nAttempting recognition on {audio_file}...")
+            refill()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempt, weight = submitted[future]
+                    text, confidence = future.result()
+                    outcomes[attempt] = text
+                    if text:
+                        votes[text] += 1
+                        weights[text] += weight
+                        print(f"Detected: {text}")
+                        if (confident is None and self.confidence_threshold is not None
+                                and confidence is not None and confidence >= self.confidence_threshold):
+                            confident = text
                 
-                with sr.AudioFile(audio_file) as source:
-                    # Try different recognition configurations
-                    for energy, pause in configs:
-                        recognizer.energy_threshold = energy
-                        recognizer.pause_threshold = pause
-                        recognizer.dynamic_energy_threshold = True
-                        
-                        # Get audio data
-                        audio = recognizer.record(source)
-                        
-                        # Try recognition with different language models
-                        for language in ['en-US', 'en-GB', 'en-IN']:
-                            try:
-                                text = recognizer.recognize_google(
-                                    audio,
-                                    language=language
-                                )
-                                if text:
-                                    all_results.append(text)
-                                    print(f"Detected: {text}")
-                            except sr.UnknownValueError:
-                                continue
-                            except sr.RequestError:
-                                continue
-                        
-                        # Reset for next attempt
-                        source.stream.seek(0)
-            
-            # Process results
-            if all_results:
-                # Get most common result
-                from collections import Counter
-                most_common = Counter(all_results).most_common(1)[0][0]
-                return most_common
+                if confident is not None:
+                    print(f"Confidence above {self.confidence_threshold}, skipping remaining attempts.")
+                    break
+                if votes and self.quorum and votes.most_common(1)[0][1] >= self.quorum:
+                    print(f"Quorum of {self.quorum} reached, skipping remaining attempts.")
+                    break
+                in_flight = self.max_workers
+                refill()
             
-            return None
+            # Process results: a confident answer, else the most common one
+            final = confident
+            if final is None and votes:
+                final = max(votes, key=lambda text: (votes[text], weights[text]))
+            self.stats['remote_calls'] = len(outcomes)
+            self.stats['stopped_on_confidence'] = confident is not None
+            if self.scheduler is not None and outcomes:
+                self.scheduler.record(outcomes, final)
+            return final
             
         except Exception as e:
             print(f"Transcription error: {e}")
             return None
-        
+
         finally:
-            # Cleanup
-            self.cleanup()
-
-    def cleanup(self):
-        """Remove temporary files"""
-        temp_files = ["temp_base.wav"] + [f"processed_speed_{speed}.wav" for speed in [1.0, 0.8, 0.6]]
-        for file in temp_files:
-            if os.path.exists(file):
-                try:
-                    os.remove(file)
-                except:
-                    pass
+            if executor is not None:
+                # Don't wait on requests that are still in flight after an early exit
+                executor.shutdown(wait=False, cancel_futures=True)
+            if processed_audio:
+                clips = {id(audio): audio for _, audio in processed_audio}.values()
+                self.stats['flac_encodes'] = sum(getattr(a, 'encodes', 0) for a in clips)
+                self.stats['flac_reuses'] = sum(getattr(a, 'reuses', 0) for a in clips)
 
 def main():
     wav_file = "AUDIO.wav"
     
     print(f"Processing file: {wav_file}")
-    transcriber = ShortPhraseTranscriber(wav_file)
+    transcriber = ShortPhraseTranscriber(
+        wav_file,
+        scheduler=attempt_scheduler.AttemptScheduler(),
+        confidence_threshold=0.85
+    )
     
     result = transcriber.transcribe()
     if result:
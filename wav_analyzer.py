@@ -0,0 +1,262 @@
+# Bounded-memory WAV analysis: RIFF/RF64 header parsing and block-wise signal statistics
+import argparse
+import glob
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Histogram of 30 ms frame levels, 0.5 dB wide bins from -120 dBFS up to 0 dBFS
+LEVEL_FLOOR_DB = -120.0
+LEVEL_BIN_DB = 0.5
+
+class WavFormatError(Exception):
+    pass
+
+def read_header(path):
+    """
+    Walk the RIFF (or RF64) chunks and return the format fields plus the
+    offset and size of the data chunk, without reading any audio.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+            raise WavFormatError(f"{path} is not a RIFF/WAVE file")
+
+        fmt = None
+        data_size_64 = None
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                raise WavFormatError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', head)
+            start = f.tell()
+            if chunk_id == b'ds64':
+                _, data_size_64 = struct.unpack('<QQ', f.read(16))
+            elif chunk_id == b'fmt ':
+                fields = f.read(min(size, 40))
+                tag, channels, rate, _, block_align, bits = struct.unpack('<HHIIHH', fields[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(fields) >= 26:
+                    tag = struct.unpack('<H', fields[24:26])[0]  # first two bytes of the sub-format GUID
+                fmt = {'format': tag, 'channels': channels, 'sample_rate': rate,
+                       'bits_per_sample': bits, 'block_align': block_align}
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise WavFormatError(f"{path} has data before its fmt chunk")
+                if riff == b'RF64' and size == 0xFFFFFFFF and data_size_64 is not None:
+                    size = data_size_64
+                # Streamed or truncated files carry a placeholder size; trust the file instead
+                size = min(size, file_size - start)
+                fmt['data_offset'] = start
+                fmt['data_size'] = size - size % fmt['block_align']
+                return fmt
+            f.seek(start + size + (size & 1))  # chunks are word-aligned
+
+def _sample_view(path, header):
+    """Memory-map the data chunk as a (frames, channels[, bytes]) array"""
+    channels = header['channels']
+    width = header['bits_per_sample'] // 8
+    frames = header['data_size'] // header['block_align']
+    if header['format'] == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        dtype = np.dtype(f'<f{width}')
+    elif header['format'] == WAVE_FORMAT_PCM and width in (1, 2, 3, 4):
+        dtype = np.dtype({1: 'u1', 2: '<i2', 3: 'u1', 4: '<i4'}[width])
+    elif header['format'] == WAVE_FORMAT_MULAW and width == 1:
+        dtype = np.dtype('u1')
+    else:
+        raise WavFormatError(f"unsupported format {header['format']:#06x} at {header['bits_per_sample']} bits")
+    if frames == 0:
+        return np.empty((0, channels), dtype), width
+    shape = (frames, channels, 3) if width == 3 else (frames, channels)
+    return np.memmap(path, dtype=dtype, mode='r', offset=header['data_offset'], shape=shape), width
+
+def ulaw_decode(codes):
+    """G.711 mu-law bytes to 16-bit linear sample values"""
+    u = ~codes.astype(np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = ((((u & 0x0F) << 3) + 0x84) << exponent) - 0x84
+    return np.where(u & 0x80, -magnitude, magnitude)
+
+def _to_float(block, width, tag):
+    """Scale one block of raw samples to float64 in [-1, 1]"""
+    if tag == WAVE_FORMAT_IEEE_FLOAT:
+        return block.astype(np.float64)
+    if tag == WAVE_FORMAT_MULAW:
+        return ulaw_decode(block) / 32768.0
+    if width == 1:
+        return (block.astype(np.float64) - 128) / 128
+    if width == 3:
+        packed = block.astype(np.int32)
+        values = packed[..., 0] | (packed[..., 1] << 8) | (packed[..., 2] << 16)
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        return values / float(1 << 23)
+    return block.astype(np.float64) / float(1 << (8 * width - 1))
+
+def _full_scale(width, tag):
+    """Largest positive value _to_float() can return for this sample format"""
+    if tag == WAVE_FORMAT_IEEE_FLOAT:
+        return 1.0
+    if tag == WAVE_FORMAT_MULAW:
+        return float(ulaw_decode(np.array([0x80]))[0]) / 32768.0
+    top = 1 << (8 * width - 1)
+    return (top - 1) / top
+
+def read_samples(path):
+    """Whole file as float32 in [-1, 1], shaped (frames, channels), plus its header"""
+    header = read_header(path)
+    samples, width = _sample_view(path, header)
+    data = _to_float(samples, width, header['format']).astype(np.float32)
+    del samples
+    return data, header
+
+def _percentile_db(histogram, q):
+    """Level (dBFS) below which q percent of frames fall, from the level histogram"""
+    total = histogram.sum()
+    if total == 0:
+        return None
+    index = int(np.searchsorted(np.cumsum(histogram), total * q / 100))
+    return LEVEL_FLOOR_DB + (index + 0.5) * LEVEL_BIN_DB
+
+def _dbfs(value):
+    return round(float(20 * np.log10(value)), 2) + 0.0 if value > 0 else None
+
+def analyze(path, block_seconds=10, frame_ms=30, silence_db=-50, clip_level=0.999):
+    """
+    Return header fields and signal statistics for one WAV file.
+
+    The PCM data is memory-mapped and read block_seconds at a time, so
+    memory use does not grow with the file. Levels are in dBFS. The SNR is
+    estimated as the spread between loud (95th percentile) and quiet
+    (10th percentile) 30 ms frames; frames below silence_db count as
+    silence, and samples at or beyond clip_level of the format's largest
+    code value (127/128 for 8-bit PCM) as clipped.
+    """
+    header = read_header(path)
+    rate = header['sample_rate']
+    channels = header['channels']
+    samples, width = _sample_view(path, header)
+    tag = header['format']
+    frames = len(samples)
+
+    frame_len = max(1, int(rate * frame_ms / 1000))
+    block_frames = max(frame_len, int(rate * block_seconds) // frame_len * frame_len)
+    sums = np.zeros(channels)
+    squares = np.zeros(channels)
+    peaks = np.zeros(channels)
+    clipped = 0
+    clip_threshold = clip_level * _full_scale(width, tag)
+    histogram = np.zeros(int(-LEVEL_FLOOR_DB / LEVEL_BIN_DB) + 1, dtype=np.int64)
+
+    for start in range(0, frames, block_frames):
+        block = _to_float(samples[start:start + block_frames], width, tag)
+        sums += block.sum(axis=0)
+        squares += np.einsum('ij,ij->j', block, block)
+        peaks = np.maximum(peaks, np.abs(block).max(axis=0))
+        clipped += int(np.count_nonzero(np.abs(block) >= clip_threshold))
+
+        # Frame levels of the channel mix, binned so any length fits in a fixed array
+        mix = block.mean(axis=1) if channels > 1 else block[:, 0]
+        n_frames = len(mix) // frame_len
+        if n_frames:
+            power = np.mean(np.square(mix[:n_frames * frame_len].reshape(n_frames, frame_len)), axis=1)
+            levels = 10 * np.log10(np.maximum(power, 1e-12))
+            bins = np.clip((levels - LEVEL_FLOOR_DB) / LEVEL_BIN_DB, 0, len(histogram) - 1).astype(np.intp)
+            histogram += np.bincount(bins, minlength=len(histogram))
+    del samples
+
+    count = max(frames, 1)
+    rms = np.sqrt(squares / count)
+    analyzed = int(histogram.sum())
+    silent = int(histogram[:int((silence_db - LEVEL_FLOOR_DB) / LEVEL_BIN_DB)].sum())
+    noise_db = _percentile_db(histogram, 10)
+    speech_db = _percentile_db(histogram, 95)
+    return {
+        'path': path,
+        'channels': channels,
+        'sample_rate': rate,
+        'sample_width': width,
+        'format': {WAVE_FORMAT_IEEE_FLOAT: 'float', WAVE_FORMAT_MULAW: 'mulaw'}.get(tag, 'pcm'),
+        'frames': frames,
+        'duration': frames / rate if rate else 0.0,
+        'rms_dbfs': _dbfs(float(np.sqrt(np.mean(rms ** 2)))),
+        'peak_dbfs': _dbfs(float(peaks.max())) if channels else None,
+        'dc_offset': [round(float(s / count), 6) for s in sums],
+        'clipped_samples': clipped,
+        'silence_ratio': round(silent / analyzed, 4) if analyzed else None,
+        'noise_floor_dbfs': noise_db,
+        'snr_db': round(speech_db - noise_db, 1) if analyzed else None
+    }
+
+def analyze_directory(directory, pattern='*.wav', recursive=False, max_workers=4, **options):
+    """
+    Analyze every matching file under directory, a few at a time.
+    Returns {path: result}; files that cannot be analyzed map to {'error': message}.
+    """
+    search = os.path.join(directory, '**', pattern) if recursive else os.path.join(directory, pattern)
+    paths = sorted(glob.glob(search, recursive=recursive))
+
+    def run(path):
+        try:
+            return analyze(path, **options)
+        except (OSError, ValueError, struct.error, WavFormatError) as e:
+            return {'path': path, 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(run, paths)))
+
+def format_report(result):
+    """The human-readable summary printed by the voice scripts"""
+    if 'error' in result:
+        return f"\nWAV File Analysis ({result['path']}): {result['error']}"
+    channels = {1: 'Mono', 2: 'Stereo'}.get(result['channels'], f"{result['channels']} channels")
+
+    def level(value):
+        return '-inf dBFS' if value is None else f"{value:.1f} dBFS"
+
+    lines = [
+        "\nWAV File Analysis:",
+        f"- Channels: {channels}",
+        f"- Sample Rate: {result['sample_rate']} Hz",
+        f"- Sample Width: {result['sample_width'] * 8} bits ({result['sample_width']} bytes)",
+        f"- Duration: {result['duration']:.2f} seconds",
+        f"- Total Frames: {result['frames']}",
+        f"- RMS Level: {level(result['rms_dbfs'])}",
+        f"- Peak Level: {level(result['peak_dbfs'])}",
+        f"- DC Offset: {', '.join(f'{dc:+.4f}' for dc in result['dc_offset'])}",
+        f"- Clipped Samples: {result['clipped_samples']}"
+    ]
+    if result['silence_ratio'] is not None:
+        lines.append(f"- Silence: {result['silence_ratio'] * 100:.1f}%")
+        lines.append(f"- Estimated SNR: {result['snr_db']:.1f} dB")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze WAV files in bounded memory")
+    parser.add_argument('paths', nargs='+', help="WAV files or directories")
+    parser.add_argument('--recursive', action='store_true', help="descend into subdirectories")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', action='store_true', help="print one JSON object per file")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if os.path.isdir(path):
+            results = analyze_directory(path, recursive=args.recursive, max_workers=args.workers).values()
+        else:
+            try:
+                results = [analyze(path)]
+            except (OSError, ValueError, struct.error, WavFormatError) as e:
+                results = [{'path': path, 'error': str(e)}]
+        for result in results:
+            print(json.dumps(result) if args.json else format_report(result))
+
+if __name__ == "__main__":
+    main()